@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import asyncio
+import aiohttp
+import inference
+from inference import (
+    APIError, build_inputs, check_response_status, close_response_cache, create_api, parse_prediction,
+    prefetch_images, print_run_summary, results_frame, save_results, shutdown_image_executor,
+)
+from results_store import CheckpointStore
+
+
+# Offline mode for the same (dataset, model, shots, sample) grid as
+# inference.main(): requests are written to JSONL job files and run through the
+# vendors' batch APIs (OpenAI Batch API, Anthropic Message Batches), which are
+# not subject to the per-minute rate limits and cost half as much. Models of
+# other vendors in inference.all_vendors_models are skipped. Outputs are
+# recorded in the same checkpoint store and written to the same results files.
+batch_vendors = ("openai", "anthropic")
+# Job files and the state of submitted batches, so an interrupted run picks up
+# its batches instead of submitting them again
+batch_dir = os.path.join("results", "batches")
+# Seconds between status checks of submitted batches
+batch_poll_interval = 60
+# Job files are split so every batch stays within the vendor's limits
+batch_limits = {
+    "openai": {"max_requests": 50000, "max_bytes": 190 * 1024 * 1024},
+    "anthropic": {"max_requests": 100000, "max_bytes": 250 * 1024 * 1024},
+}
+anthropic_headers = {
+    "anthropic-version": "2023-06-01",
+    "anthropic-beta": "message-batches-2024-09-24,prompt-caching-2024-07-31",
+}
+
+
+class BatchState:
+    """
+    The submitted batches of a run, saved to `path` after every change. Each
+    batch keeps its vendor, model and, per custom_id, the cell it answers:
+    [dataset, shots, sample, image_path, example_paths, example_categories].
+    """
+    def __init__(self, path):
+        self.path = path
+        self.batches = []
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.batches = json.load(f)["batches"]
+
+    def open_batches(self):
+        return [batch for batch in self.batches if not batch["collected"]]
+
+    def queued_cells(self, model):
+        """(dataset, shots, sample) of every cell of `model` in a batch that has not been collected yet."""
+        return {
+            (cell[0], cell[1], cell[2])
+            for batch in self.open_batches() if batch["model"] == model
+            for cell in batch["requests"].values()
+        }
+
+    def add(self, batch):
+        self.batches.append(batch)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"batches": self.batches}, f)
+        os.replace(tmp_path, self.path)
+
+
+def batch_line(api, custom_id, inputs):
+    """One line of a job file: the request for `inputs` in the vendor's batch format."""
+    if isinstance(api, inference.GPTAPI):
+        return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": api.build_payload(inputs)}
+    params, _ = api.build_params(inputs)
+    return {"custom_id": custom_id, "params": params}
+
+async def write_job_files(api, vendor, model_name, cells, loaded_datasets):
+    """
+    Build the requests of `cells` ((dataset, shots, sample) tuples) and write
+    them to numbered JSONL job files within `batch_limits`. Returns
+    (job file, {custom_id: cell description}) per file.
+    """
+    limits = batch_limits[vendor]
+    os.makedirs(batch_dir, exist_ok=True)
+    by_name = {name: (all_data, prompt, examples) for all_data, name, prompt, _, examples in loaded_datasets}
+    stem = os.path.join(batch_dir, f"{model_name}.{int(time.time())}")
+    job_files = []
+    f, requests, size = None, {}, 0
+    try:
+        for n, (dataset, number_of_shots, i) in enumerate(cells):
+            all_data, prompt, examples = by_name[dataset]
+            try:
+                inputs, example_paths, example_categories = await build_inputs(api, i, number_of_shots, all_data, prompt, examples)
+            except Exception as e:
+                print(f"Error processing {all_data[0][i]}: {str(e)}")
+                continue
+            custom_id = f"r{n}"
+            line = (json.dumps(batch_line(api, custom_id, inputs)) + "\n").encode('utf-8')
+            if f is not None and (len(requests) >= limits["max_requests"] or size + len(line) > limits["max_bytes"]):
+                f.close()
+                f = None
+            if f is None:
+                job_files.append((f"{stem}.{len(job_files)}.jsonl", {}))
+                f, size = open(job_files[-1][0], 'wb'), 0
+                requests = job_files[-1][1]
+            f.write(line)
+            size += len(line)
+            requests[custom_id] = [dataset, number_of_shots, i, all_data[0][i], example_paths, [str(c) for c in example_categories]]
+    finally:
+        if f is not None:
+            f.close()
+    return job_files
+
+async def submit_openai(api, job_file):
+    """Upload a job file and create a batch from it; returns the batch id."""
+    session = api.get_session()
+    headers = {"Authorization": api.headers["Authorization"]}
+
+    async def upload():
+        with open(job_file, 'rb') as f:
+            form = aiohttp.FormData()
+            form.add_field("purpose", "batch")
+            form.add_field("file", f, filename=os.path.basename(job_file), content_type="application/jsonl")
+            async with session.post(f"{inference.api_base_urls['openai']}/files", headers=headers, data=form) as response:
+                check_response_status(response, await response.text())
+                return await response.json()
+
+    uploaded = await api.retry_policy.call(api, upload)
+
+    async def create():
+        payload = {"input_file_id": uploaded["id"], "endpoint": "/v1/chat/completions", "completion_window": "24h"}
+        async with session.post(f"{inference.api_base_urls['openai']}/batches", headers=api.headers, json=payload) as response:
+            check_response_status(response, await response.text())
+            return await response.json()
+
+    return (await api.retry_policy.call(api, create))["id"]
+
+async def submit_anthropic(api, job_file):
+    """Create a message batch from the requests of a job file; returns the batch id."""
+    session = api.get_session()
+    headers = {**anthropic_headers, "x-api-key": api.client.api_key, "content-type": "application/json"}
+
+    async def body():
+        # Stream the job file as {"requests": [...]} rather than parsing it
+        yield b'{"requests": ['
+        with open(job_file, 'rb') as f:
+            for n, line in enumerate(f):
+                yield (b',' if n else b'') + line.rstrip(b'\n')
+        yield b']}'
+
+    async def create():
+        async with session.post(f"{inference.api_base_urls['anthropic']}/v1/messages/batches", headers=headers, data=body()) as response:
+            check_response_status(response, await response.text())
+            return await response.json()
+
+    return (await api.retry_policy.call(api, create))["id"]
+
+async def fetch_json(api, url, headers):
+    async def get():
+        async with api.get_session().get(url, headers=headers) as response:
+            check_response_status(response, await response.text())
+            return await response.json()
+    return await api.retry_policy.call(api, get)
+
+async def fetch_lines(api, url, headers):
+    async def get():
+        async with api.get_session().get(url, headers=headers) as response:
+            text = await response.text()
+            check_response_status(response, text)
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return await api.retry_policy.call(api, get)
+
+async def batch_outputs(api, batch):
+    """
+    None while the batch is still running, else {custom_id: response text or
+    None} for the requests the vendor answered; requests it did not answer
+    (errors, expiry, cancellation) are missing or None.
+    """
+    if batch["vendor"] == "openai":
+        base_url = inference.api_base_urls['openai']
+        headers = {"Authorization": api.headers["Authorization"]}
+        status = await fetch_json(api, f"{base_url}/batches/{batch['id']}", headers)
+        if status["status"] not in ("completed", "failed", "expired", "cancelled"):
+            return None
+        outputs = {}
+        for file_id in (status.get("output_file_id"), status.get("error_file_id")):
+            if not file_id:
+                continue
+            for line in await fetch_lines(api, f"{base_url}/files/{file_id}/content", headers):
+                response = line.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") == 200 and body.get("choices"):
+                    usage = body.get("usage") or {}
+                    api.record_usage(usage.get("prompt_tokens"), (usage.get("prompt_tokens_details") or {}).get("cached_tokens"))
+                    outputs[line["custom_id"]] = body["choices"][0]["message"]["content"]
+                else:
+                    print(f"Batch request {line['custom_id']} failed: {line.get('error') or body}")
+                    outputs[line["custom_id"]] = None
+        return outputs
+
+    base_url = f"{inference.api_base_urls['anthropic']}/v1/messages/batches"
+    headers = {**anthropic_headers, "x-api-key": api.client.api_key}
+    status = await fetch_json(api, f"{base_url}/{batch['id']}", headers)
+    if status["processing_status"] != "ended":
+        return None
+    outputs = {}
+    for line in await fetch_lines(api, status["results_url"], headers):
+        result = line["result"]
+        if result["type"] == "succeeded":
+            usage = result["message"]["usage"]
+            cache_read = usage.get("cache_read_input_tokens") or 0
+            cache_write = usage.get("cache_creation_input_tokens") or 0
+            api.record_usage(usage["input_tokens"] + cache_read + cache_write, cache_read, cache_write)
+            outputs[line["custom_id"]] = result["message"]["content"][0]["text"]
+        else:
+            print(f"Batch request {line['custom_id']} {result['type']}: {result.get('error')}")
+            outputs[line["custom_id"]] = None
+    return outputs
+
+def record_outputs(checkpoint, batch, outputs):
+    """Record every cell of a finished batch; cells without a response are recorded as 'NA' and retried by the next run."""
+    for custom_id, (dataset, number_of_shots, i, image_path, example_paths, example_categories) in batch["requests"].items():
+        text = outputs.get(custom_id)
+        if text is None:
+            checkpoint.record(dataset, batch["model"], number_of_shots, i, image_path, 'NA', 'NA', 'NA')
+        else:
+            checkpoint.record(dataset, batch["model"], number_of_shots, i, image_path, parse_prediction(text, image_path), example_paths, example_categories)
+
+async def main():
+    """
+    Submit a batch for every cell that has no prediction in the checkpoint store
+    and is not already in a submitted batch, wait for all open batches, and
+    write the results of every (dataset, model) run.
+    """
+    checkpoint = CheckpointStore(inference.checkpoint_path)
+    state = BatchState(os.path.join(batch_dir, "state.json"))
+    loaded_datasets = inference.load_datasets()
+    models = [vendor_model for vendor_model in inference.all_vendors_models if vendor_model["vendor"] in batch_vendors]
+    apis = {vendor_model["model_name"]: create_api(vendor_model["vendor"], vendor_model["model"]) for vendor_model in models}
+    try:
+        for vendor_model in models:
+            model_name = vendor_model["model_name"]
+            api = apis[model_name]
+            queued = state.queued_cells(model_name)
+            cells = []
+            for all_data, dataset, _, shots, _ in loaded_datasets:
+                pending = checkpoint.restore(results_frame(all_data, shots), dataset, model_name, shots) if inference.resume else {
+                    number_of_shots: list(range(len(all_data))) for number_of_shots in shots
+                }
+                cells.extend(
+                    (dataset, number_of_shots, i)
+                    for number_of_shots in shots for i in pending[number_of_shots]
+                    if (dataset, number_of_shots, i) not in queued
+                )
+            if not cells:
+                continue
+            for all_data, _, _, _, _ in loaded_datasets:
+                await prefetch_images(all_data[0], api.image_settings)
+            submit = submit_openai if vendor_model["vendor"] == "openai" else submit_anthropic
+            for job_file, requests in await write_job_files(api, vendor_model["vendor"], model_name, cells, loaded_datasets):
+                batch_id = await submit(api, job_file)
+                state.add({"id": batch_id, "vendor": vendor_model["vendor"], "model": model_name, "job_file": job_file, "requests": requests, "collected": False})
+                print(f"Submitted batch {batch_id} with {len(requests)} requests for {model_name}")
+        shutdown_image_executor()
+
+        while True:
+            open_batches = [batch for batch in state.open_batches() if batch["model"] in apis]
+            if not open_batches:
+                break
+            for batch in open_batches:
+                try:
+                    outputs = await batch_outputs(apis[batch["model"]], batch)
+                except APIError as e:
+                    if e.status != 404:
+                        raise
+                    # Deleted or expired on the vendor side; its cells are requested again next run
+                    print(f"Batch {batch['id']} no longer exists: {str(e)}")
+                    outputs = {}
+                if outputs is None:
+                    continue
+                record_outputs(checkpoint, batch, outputs)
+                batch["collected"] = True
+                state.save()
+                answered = sum(text is not None for text in outputs.values())
+                print(f"Collected batch {batch['id']}: {answered} of {len(batch['requests'])} requests answered")
+            if any(not batch["collected"] for batch in open_batches):
+                await asyncio.sleep(batch_poll_interval)
+
+        run_summary = []
+        for all_data, dataset, _, shots, _ in loaded_datasets:
+            for model_name, api in apis.items():
+                run = {
+                    "dataset": dataset,
+                    "model": model_name,
+                    "all_data": all_data,
+                    "shots": shots,
+                    "output_file": os.path.join("results", model_name, f"{dataset}.csv"),
+                    "image_settings": api.image_settings,
+                }
+                os.makedirs(os.path.dirname(run["output_file"]), exist_ok=True)
+                results = await save_results(run, checkpoint)
+                run_summary.append({"model": model_name, "dataset": dataset, "predictions": len(results), "na": int(results["prediction"].isna().sum())})
+        print_run_summary(run_summary, {model_name: api.stats for model_name, api in apis.items()})
+    finally:
+        shutdown_image_executor()
+        for api in apis.values():
+            await api.close()
+        checkpoint.close()
+        close_response_cache()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
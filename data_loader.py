@@ -1,21 +1,60 @@
 import os
+import json
 import pandas as pd
-from sklearn.utils import shuffle
 from PIL import Image
 import numpy as np
 
-import kaggle
-from kaggle.api.kaggle_api_extended import KaggleApi
 import zipfile
 import shutil
 from tqdm import tqdm
 import difflib
 import requests
-from tqdm import tqdm
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# Datasets are downloaded to and read from here. The path is absolute (the data
+# folder next to this file), so loading never depends on the working directory
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(repo_dir, "data")
+
+# Image file types picked up from class folders
+image_extensions = ('.jpg', '.jpeg', '.png')
+
+# Zenodo API (point this at a local stand-in such as mock_server.MockZenodoServer
+# to test downloads), the number of files of a record fetched at once, the chunk
+# size downloads are streamed in, the attempts made at each file before giving
+# up, and the delay before the first retry (doubled on each further one)
+zenodo_api = "https://zenodo.org/api"
+download_workers = 4
+download_chunk_size = 1024 * 1024
+download_attempts = 5
+download_retry_delay = 1.0
+
+# Keep the zip archives of newly downloaded Zenodo datasets unextracted: loaders
+# list them from the archives' central directories and extract only the images
+# they sample. Set to False to extract every archive in full after downloading
+lazy_extraction = True
+# Written into a dataset's directory, naming the archives that were kept unextracted
+lazy_archives_file = ".lazy_archives.json"
+
+# Directory listings and derived labels (mask percentages, label counts) of each
+# dataset are cached here between runs
+manifest_dir = os.path.join(data_dir, ".manifests")
+
+# Processes used to compute PlantDoc mask percentages that are not cached yet
+mask_workers = os.cpu_count()
+
+# Datasets downloaded and indexed at once by prepare_all
+prepare_workers = 4
 
 
 # Utility functions
 def download_with_progress(dataset_name, path="."):
+    # Imported here: importing kaggle authenticates, which needs credentials
+    # even when every dataset is already on disk
+    from kaggle.api.kaggle_api_extended import KaggleApi
     api = KaggleApi()
     api.authenticate()
 
@@ -23,6 +62,22 @@ def download_with_progress(dataset_name, path="."):
     api.dataset_download_files(dataset_name, path=path, unzip=True, quiet=False)
     print("Download complete.")
 
+def stored_path(path):
+    """
+    `path` as results, checkpoints and few-shot tables save it: relative to
+    `repo_dir` ("data/<dataset>/..."), like the published results, so saved
+    paths don't depend on where the repository is checked out. Paths outside
+    the repository are kept absolute.
+    """
+    path = resolve_path(path)
+    if path.startswith(repo_dir + os.sep):
+        return os.path.relpath(path, repo_dir)
+    return path
+
+def resolve_path(path):
+    """The absolute path of an image path as loaded (absolute) or as saved (relative to `repo_dir`)."""
+    return os.path.normpath(os.path.join(repo_dir, path))
+
 def get_closest_match(name, options):
     return difflib.get_close_matches(name, options, n=1, cutoff=0.2)[0]
 
@@ -65,28 +120,78 @@ def convert_tiff_to_jpg(file_path):
             print(f"Error converting {file_path}: {str(e)}")
             return file_path
     return file_path
-def download_file(url, filename):
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    block_size = 1024  # 1 KB
-    
-    with open(filename, 'wb') as file, tqdm(
-        desc=filename,
-        total=total_size,
-        unit='iB',
-        unit_scale=True,
-        unit_divisor=1024,
-    ) as progress_bar:
-        for data in response.iter_content(block_size):
-            size = file.write(data)
-            progress_bar.update(size)
+def file_digest(path, algorithm="md5"):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(download_chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def download_file(url, filename, checksum=None, progress_bar=None):
+    """
+    Download `url` to `filename` in `download_chunk_size` chunks.
+
+    Data is written to `<filename>.part` and an interrupted download resumes
+    from where it stopped with an HTTP Range request, both on a retry and on a
+    later run. Dropped connections, timeouts, 429 and 5xx responses are retried.
+    `checksum` ("md5:<hex>", as Zenodo reports it) is verified before the file
+    is moved to `filename`; a mismatch discards the download.
+    """
+    algorithm, _, expected = checksum.partition(":") if checksum else ("md5", "", "")
+    if os.path.exists(filename):
+        if not expected or file_digest(filename, algorithm) == expected:
+            return filename
+        os.remove(filename)
+
+    part_path = f"{filename}.part"
+    # Bytes of this file added to `progress_bar` so far, so a resumed or
+    # restarted attempt only adds what this run has not counted yet
+    counted = 0
+    for attempt in range(download_attempts):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with requests.get(url, stream=True, headers=headers, timeout=60) as response:
+                if offset and response.status_code == 416:
+                    # Nothing left to fetch: the part file is already complete
+                    if progress_bar is not None and offset != counted:
+                        progress_bar.update(offset - counted)
+                    break
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # The server ignored the range and is sending the whole file
+                    offset = 0
+                if progress_bar is not None and offset != counted:
+                    progress_bar.update(offset - counted)
+                counted = offset
+                with open(part_path, 'ab' if offset else 'wb') as file:
+                    for data in response.iter_content(download_chunk_size):
+                        size = file.write(data)
+                        counted += size
+                        if progress_bar is not None:
+                            progress_bar.update(size)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, requests.HTTPError) as e:
+            if isinstance(e, requests.HTTPError) and e.response.status_code != 429 and e.response.status_code < 500:
+                raise
+            if attempt == download_attempts - 1:
+                raise
+            print(f"Download of {filename} interrupted ({e}). Resuming.")
+            time.sleep(download_retry_delay * 2 ** attempt)
+
+    if expected and file_digest(part_path, algorithm) != expected:
+        os.remove(part_path)
+        raise ValueError(f"Checksum mismatch for {filename}; the download was discarded")
+    os.replace(part_path, filename)
+    return filename
 
 def get_file_urls(record_id):
-    metadata_url = f"https://zenodo.org/api/records/{record_id}"
-    response = requests.get(metadata_url)
+    """(url, filename, checksum, size) of every file of a Zenodo record."""
+    metadata_url = f"{zenodo_api}/records/{record_id}"
+    response = requests.get(metadata_url, timeout=60)
     if response.status_code == 200:
         data = response.json()
-        return [(file['links']['self'], file['key']) for file in data.get('files', [])]
+        return [(file['links']['self'], file['key'], file.get('checksum'), file.get('size', 0)) for file in data.get('files', [])]
     else:
         print(f"Error fetching metadata. Status code: {response.status_code}")
         return []
@@ -100,858 +205,784 @@ def extract_zip(zip_path, extract_path):
         for file in tqdm(iterable=zip_ref.infolist(), total=total_files, desc="Extracting"):
             zip_ref.extract(member=file, path=extract_path)
 
-# Load and prepare data functions
-def load_and_prepare_data_SBRD(total_samples_to_check):
-    # Dataset details
-    dataset_name = "isaacritharson/severity-based-rice-leaf-diseases-dataset"
-    download_path = "./data/Severity_Based_Rice_Leaf_Diseases_Dataset"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
+class DatasetManifest:
+    """
+    Cached directory listings and per-file derived labels of one dataset.
+
+    A directory's listing is reused while the directory's mtime is unchanged
+    (adding, removing or renaming an entry updates it), and is kept in the order
+    `os.listdir` returned it, so sampling picks the same files as a fresh scan.
+    A derived label (e.g. the affected area of a mask) is reused while its source
+    file's size and mtime are unchanged, so only new or changed files are read.
+    """
+    def __init__(self, name, cache_dir=None):
+        self.path = os.path.join(cache_dir or manifest_dir, f"{name}.json")
+        self.directories = {}
+        self.derived = {}
+        self.dirty = False
+        self.rescanned = 0
+        self.recomputed = 0
+        # ArchiveIndex of the dataset's unextracted archives, if it has any
+        self.archives = None
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    stored = json.load(f)
+                self.directories = stored["directories"]
+                self.derived = stored["derived"]
+            except (ValueError, KeyError):
+                print(f"Warning: ignoring unreadable manifest {self.path}")
+
+    def listdir(self, directory):
+        if self.archives is not None and self.archives.isdir(directory):
+            return self.archives.listdir(directory)
+        key = os.path.abspath(directory)
+        # Stat before listing: a change made while listing then invalidates the entry next time
+        mtime = os.stat(directory).st_mtime_ns
+        cached = self.directories.get(key)
+        if cached is not None and cached["mtime_ns"] == mtime:
+            return list(cached["names"])
+        names = os.listdir(directory)
+        self.directories[key] = {"mtime_ns": mtime, "names": names}
+        self.rescanned += 1
+        self.dirty = True
+        return list(names)
+
+    def isdir(self, path):
+        return (self.archives is not None and self.archives.isdir(path)) or os.path.isdir(path)
+
+    def extract(self, paths):
+        """Make sure files that are still inside an unextracted archive exist on disk."""
+        if self.archives is not None:
+            self.archives.extract(paths)
+
+    def cached(self, path, kind):
+        """The value derived from `path` under `kind`, or None if missing or the file changed since."""
+        stat = os.stat(path)
+        cached = self.derived.get(kind, {}).get(os.path.abspath(path))
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        return None
+
+    def store(self, path, kind, value):
+        stat = os.stat(path)
+        self.derived.setdefault(kind, {})[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, value]
+        self.recomputed += 1
+        self.dirty = True
+
+    def derive(self, path, compute, kind):
+        """Return `compute(path)`, cached under `kind` until the file's size or mtime changes."""
+        value = self.cached(path, kind)
+        if value is None:
+            value = compute(path)
+            self.store(path, kind, value)
+        return value
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"directories": self.directories, "derived": self.derived}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+def zip_members(zip_path):
+    """Member names of a zip, read from its central directory only."""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return zip_ref.namelist()
+
+class ArchiveIndex:
+    """
+    The files of a dataset's unextracted zip archives, addressed by the paths
+    `extract_zip` would have extracted them to.
+
+    Listings come from the archives' central directories (cached in the
+    dataset's manifest until an archive changes), so a loader can list and
+    sample a dataset without unpacking it; `extract` then writes out just the
+    members that are needed. Directory listings follow archive order.
+    """
+    def __init__(self, extract_path, archives, manifest=None):
+        self.files = {}
+        self.children = {}
+        root = os.path.abspath(extract_path)
+        self.children[root] = {}
+        for archive in archives:
+            zip_path = os.path.join(extract_path, archive)
+            members = manifest.derive(zip_path, zip_members, "zip_members") if manifest else zip_members(zip_path)
+            directories = {"": root}
+            for member in members:
+                name = member.strip('/')
+                if not name:
+                    continue
+                parent, _, leaf = name.rpartition('/')
+                path = os.path.join(self._directory(directories, parent), leaf)
+                self.children[os.path.dirname(path)].setdefault(leaf, None)
+                if member.endswith('/'):
+                    self.children.setdefault(path, {})
+                else:
+                    self.files[path] = (zip_path, member)
+
+    def _directory(self, directories, name):
+        """Path of archive directory `name` ("a/b"), adding it and its parents to the listings."""
+        if name not in directories:
+            parent, _, leaf = name.rpartition('/')
+            parent_path = self._directory(directories, parent)
+            self.children[parent_path].setdefault(leaf, None)
+            directories[name] = os.path.join(parent_path, leaf)
+            self.children.setdefault(directories[name], {})
+        return directories[name]
+
+    def isdir(self, path):
+        return os.path.abspath(path) in self.children
+
+    def listdir(self, directory):
+        return list(self.children[os.path.abspath(directory)])
+
+    def rename(self, directory, new_name):
+        """
+        Rename the subdirectories of `directory` as `rename_folders` would on disk;
+        `new_name(folder)` returns a folder's new name, or None to keep it.
+        """
+        directory = os.path.abspath(directory)
+        renames = {}
+        for folder in self.listdir(directory):
+            name = new_name(folder) if os.path.join(directory, folder) in self.children else None
+            if name is not None and name != folder:
+                renames[folder] = name
+        if not renames:
+            return
+        prefix = directory + os.sep
+
+        def renamed(path):
+            if not path.startswith(prefix):
+                return path
+            folder, separator, rest = path[len(prefix):].partition(os.sep)
+            return prefix + renames.get(folder, folder) + separator + rest
+
+        self.children[directory] = {renames.get(child, child): None for child in self.children[directory]}
+        self.children = {renamed(path): names for path, names in self.children.items()}
+        self.files = {renamed(path): member for path, member in self.files.items()}
+
+    def extract(self, paths):
+        """Extract the members behind `paths` that are not on disk yet, opening each archive once."""
+        missing = {}
+        for path in paths:
+            key = os.path.abspath(path)
+            if key in self.files and not os.path.exists(key):
+                zip_path, member = self.files[key]
+                missing.setdefault(zip_path, []).append((key, member))
+        for zip_path, members in missing.items():
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                for path, member in members:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # Write to a temporary name first so an interruption never leaves a truncated image
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    with zip_ref.open(member) as source, open(tmp_path, 'wb') as target:
+                        shutil.copyfileobj(source, target, download_chunk_size)
+                    os.replace(tmp_path, path)
+
+def lazy_archive_index(download_path, manifest=None):
+    """ArchiveIndex of the archives a dataset was downloaded with but never extracted, or None."""
+    marker = os.path.join(download_path, lazy_archives_file)
+    if not os.path.exists(marker):
+        return None
+    with open(marker, 'r') as f:
+        archives = json.load(f)
+    return ArchiveIndex(download_path, archives, manifest)
+
+def mask_percentage(mask_path):
+    """
+    Integer percentage of a segmentation mask's pixels marked as diseased: red
+    pixels (R > 0, G = 0, B = 0) in colour masks, non-zero pixels otherwise.
+
+    Pixels are counted from PIL's colour histogram rather than a full-size NumPy
+    array per channel; masks use a handful of colours, so this is a small
+    table. The counts, and so the percentages, are exactly those of the array test.
+    """
+    with Image.open(mask_path) as mask:
+        total_pixels = mask.width * mask.height
+        if mask.mode in ('RGB', 'RGBA'):
+            colors = mask.getcolors(maxcolors=4096)
+            if colors is not None:
+                affected = sum(count for count, color in colors if color[0] > 0 and color[1] == 0 and color[2] == 0)
+                return int((affected / total_pixels) * 100)
+        elif mask.mode in ('L', 'P', '1'):
+            affected = total_pixels - mask.histogram()[0]
+            return int((affected / total_pixels) * 100)
+
+        # Many colours or an unusual mode: test the full array
+        mask_array = np.array(mask)
+        if len(mask_array.shape) == 3:
+            affected_pixels = (mask_array[:,:,0] > 0) & (mask_array[:,:,1] == 0) & (mask_array[:,:,2] == 0)
+        else:
+            affected_pixels = mask_array > 0
+        return int((np.sum(affected_pixels) / total_pixels) * 100)
+
+def mask_percentages(mask_paths, manifest=None, workers=None):
+    """
+    `mask_percentage` of many masks. Values cached in `manifest` are reused; the
+    rest are computed in a process pool of `workers` (default `mask_workers`)
+    when there are enough of them to be worth it, and stored back.
+    """
+    workers = mask_workers if workers is None else workers
+    values = {path: manifest.cached(path, "mask_percentage") if manifest else None for path in mask_paths}
+    missing = [path for path, value in values.items() if value is None]
+    if len(missing) >= 32 and workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = list(tqdm(executor.map(mask_percentage, missing, chunksize=16), total=len(missing), desc="Measuring masks"))
     else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-
-    # The dataset is downloaded and extracted to the specified directory
-    base_directory =os.path.join(download_path, "Leaf Disease Dataset", "train")
-
-    expected_classes = ['Healthy', 'Mild Bacterial Blight', 'Mild Blast', 'Mild Brownspot', 'Mild Tungro', 'Severe Bacterial Blight', 'Severe Blast', 'Severe Brownspot', 'Severe Tungro']
-    
-    # Rename folders to match expected classes
-    rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
+        computed = [mask_percentage(path) for path in missing]
+    for path, value in zip(missing, computed):
+        values[path] = value
+        if manifest:
+            manifest.store(path, "mask_percentage", value)
+    return [values[path] for path in mask_paths]
+
+def plantdoc_pairs(images_dir, masks_dir, manifest=None):
+    """(image paths, mask paths) of the PlantDoc images that have a mask, in listing order."""
+    listdir = manifest.listdir if manifest else os.listdir
+    mask_names = set(listdir(masks_dir))
     file_paths = []
-    labels = []
-
-    for subdir in os.listdir(base_directory):
-        #if subdir == ".DS_Store":
-        #    continue
-        subdir_path = os.path.join(base_directory, subdir)
-        if not os.path.isdir(subdir_path):
+    mask_paths = []
+    for filename in listdir(images_dir):
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            mask_name = filename.replace('.jpg', '.png')
+            if mask_name in mask_names:
+                file_paths.append(os.path.join(images_dir, filename))
+                mask_paths.append(os.path.join(masks_dir, mask_name))
+    return file_paths, mask_paths
+
+def plantdoc_mask_distribution(images_dir, masks_dir, manifest=None, workers=None):
+    """Mask percentage of every PlantDoc image with a mask, as a DataFrame like the loaders return."""
+    file_paths, mask_paths = plantdoc_pairs(images_dir, masks_dir, manifest)
+    return pd.DataFrame({0: file_paths, 1: mask_percentages(mask_paths, manifest, workers)})
+
+def count_lines(path):
+    with open(path, 'r') as f:
+        return len(f.readlines())
+
+def read_sheet_labels(labels_file, key_column, label_column):
+    """(key, label) pairs of a spreadsheet of labels, skipping labels that are not whole numbers."""
+    df = pd.read_excel(labels_file)
+    ratings = []
+    for index, row in df.iterrows():
+        key = str(row[key_column])
+        rating = row[label_column]
+        # if after converting the rating to integer it is not a integer then skip it
+        try:
+            rating = int(rating)
+        except:
             continue
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "SBRD"
-
-
-def load_and_prepare_data_DurumWheat(total_samples_to_check):
-      # Dataset details
-    dataset_name = "muratkokludataset/durum-wheat-dataset"
-    download_path = "./data/Durum_Wheat_Dataset"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-
-    # The dataset is downloaded and extracted to the specified directory
-    base_directory =os.path.join(download_path, "Durum_Wheat_Dataset", "Dataset2-Durum Wheat Video Images")
-
-    expected_classes = ['Foreign Matters', 'Starchy Kernels', 'Vitreous Kernels']
-    # Rename folders to match expected classes
-      # Define the renaming dictionary
-    rename_dict = {
-        '1-Images from Vitreous Durum Wheat': 'Vitreous Kernels',
-        '2-Images from Starchy Durum Wheat': 'Starchy Kernels',
-        '3-Images from Foreign Matters': 'Foreign Matters'
-    }
-
-    # Rename folders using the dictionary
-    rename_folders_dict(base_directory, rename_dict)
-
-    #rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
+        ratings.append([key, rating])
+    return ratings
+
+def read_class_names(file_path):
+    """Class names of a "<id> <name>" file; ids start at 1 and class folders are named id - 1."""
+    classes = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2:
+                class_id, class_name = parts
+                classes[int(class_id) - 1] = class_name.strip()
+    return [classes[i] for i in sorted(classes)]
+
+def download_zenodo(record_id, download_path, archives=(), lazy=None):
+    """
+    Download every file of a Zenodo record into `download_path`, `download_workers`
+    at a time, and extract the zips named in `archives` (or, if `lazy`, default
+    `lazy_extraction`, record them in `lazy_archives_file` for `ArchiveIndex`).
+    """
+    lazy = lazy_extraction if lazy is None else lazy
+    file_urls = get_file_urls(record_id)
+    if not file_urls:
+        raise RuntimeError(f"No files found for Zenodo record {record_id}")
+    os.makedirs(download_path, exist_ok=True)
+    with tqdm(desc=f"Downloading record {record_id}", total=sum(size for _, _, _, size in file_urls), unit='iB', unit_scale=True, unit_divisor=1024) as progress_bar:
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            futures = [executor.submit(download_file, url, os.path.join(download_path, filename), checksum, progress_bar) for url, filename, checksum, _ in file_urls]
+            for future in futures:
+                future.result()
+
+    kept = []
+    for filename in os.listdir(download_path):
+        if filename.lower() in archives:
+            if lazy:
+                kept.append(filename)
+            else:
+                extract_zip(os.path.join(download_path, filename), download_path)
+    if kept:
+        with open(os.path.join(download_path, lazy_archives_file), 'w') as f:
+            json.dump(kept, f)
+
+
+# Layouts: how the samples and labels of a dataset are found on disk. Each takes
+# the dataset's spec, its data directory, its manifest and its expected classes,
+# and returns (file paths, labels). Labels may instead be a function of the
+# sampled row positions, for labels that are expensive to derive and not needed
+# to sample.
+def class_folder_samples(spec, base_directory, manifest, classes):
+    """One folder per class, named after the class (or its index in `classes` with "indexed_folders")."""
+    extensions = spec.get("extensions", image_extensions)
     file_paths = []
     labels = []
-    
-    #print("Processing data and converting TIFF to JPG...")
-    for subdir in tqdm(os.listdir(base_directory), desc="Processing classes"):
+    for subdir in manifest.listdir(base_directory):
         subdir_path = os.path.join(base_directory, subdir)
-        if not os.path.isdir(subdir_path):
+        if not manifest.isdir(subdir_path):
             continue
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.tiff', '.tif')):
+        label = classes[int(subdir)] if spec.get("indexed_folders") else subdir
+        for filename in manifest.listdir(subdir_path):
+            if filename.lower().endswith(extensions):
                 file_path = os.path.join(subdir_path, filename)
-                converted_path = convert_tiff_to_jpg(file_path)
-                file_paths.append(converted_path)
-                labels.append(subdir)
-    
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Durum Wheat"
-
-
-def load_and_prepare_data_soybean_seeds(total_samples_to_check):
-
-
-     # Dataset details
-    dataset_name = "warcoder/soyabean-seeds"
-    download_path = "./data/soyabean-seeds_Dataset"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'Soybean Seeds')
-
-    #base_directory = 'data/Soybean Seeds'
-    expected_classes = ['Broken', 'Immature', 'Intact', 'Skin-damaged', 'Spotted']
-    # Rename folders to match expected classes
-    rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
+                if spec.get("convert_tiff"):
+                    file_path = convert_tiff_to_jpg(file_path)
+                file_paths.append(file_path)
+                labels.append(label)
+    return file_paths, labels
+
+def labels_csv_samples(spec, base_directory, manifest, classes):
+    """A CSV of file names and labels next to a folder of images."""
+    labels_df = pd.read_csv(os.path.join(base_directory, *spec["labels_csv"]))
+    file_paths = labels_df[spec["filename_column"]].apply(lambda x: os.path.join(base_directory, spec["images"], x))
+    return list(file_paths), list(labels_df[spec["label_column"]])
+
+def label_sheet_samples(spec, base_directory, manifest, classes):
+    """A spreadsheet of labels keyed by an id that names the image file."""
+    images_dir = os.path.join(base_directory, spec["images"])
+    labels_file = os.path.join(base_directory, spec["label_sheet"])
+    image_names = set(manifest.listdir(images_dir))
     file_paths = []
     labels = []
 
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Soybean Seeds"
-
-def load_and_prepare_data_mango_leaf(total_samples_to_check):
-      
-    # Dataset details
-    dataset_name = "aryashah2k/mango-leaf-disease-dataset"
-    download_path = "./data/mango-leaf-disease-dataset"
+    # The label sheet is parsed once and cached until it changes
+    read_labels = lambda path: read_sheet_labels(path, spec["key_column"], spec["label_column"])
+    for key, rating in manifest.derive(labels_file, read_labels, "ratings"):
+        filename = spec["image_name"].format(key)
+        if filename in image_names:
+            file_paths.append(os.path.join(images_dir, filename))
+            labels.append(rating)
+    return file_paths, labels
 
-    # Check if the dataset already exists
+def label_file_samples(spec, base_directory, manifest, classes):
+    """One text file per image; the label is its number of lines (e.g. one per annotated insect), read only for sampled rows."""
+    images_dir = os.path.join(base_directory, spec["images"])
+    labels_dir = os.path.join(base_directory, spec["labels"])
+    label_names = set(manifest.listdir(labels_dir))
+    file_paths = []
+    label_paths = []
+    for filename in manifest.listdir(images_dir):
+        if filename.lower().endswith(image_extensions):
+            label_name = os.path.splitext(filename)[0] + '.txt'
+            if label_name in label_names:
+                file_paths.append(os.path.join(images_dir, filename))
+                label_paths.append(os.path.join(labels_dir, label_name))
+
+    def labels(rows):
+        paths = [label_paths[i] for i in rows]
+        manifest.extract(paths)
+        return [manifest.derive(path, count_lines, "line_count") for path in paths]
+    return file_paths, labels
+
+def mask_samples(spec, base_directory, manifest, classes):
+    """Images with a segmentation mask; the label is the mask's affected percentage, measured only for sampled rows."""
+    file_paths, mask_paths = plantdoc_pairs(os.path.join(base_directory, spec["images"]), os.path.join(base_directory, spec["masks"]), manifest)
+    return file_paths, lambda rows: mask_percentages([mask_paths[i] for i in rows], manifest)
+
+LAYOUTS = {
+    "class_folders": class_folder_samples,
+    "labels_csv": labels_csv_samples,
+    "label_sheet": label_sheet_samples,
+    "label_files": label_file_samples,
+    "masks": mask_samples,
+}
+
+
+# Dataset registry, keyed by the name results are saved under. Adding a dataset
+# means adding an entry here:
+#   source, id      "kaggle" and the dataset slug, or "zenodo" and the record id;
+#                   "archives" are the Zenodo zips to extract after downloading
+#   directory       download folder under data_dir; "root" is the data inside it
+#   layout          how samples and labels are found (a key of LAYOUTS), plus
+#                   that layout's own keys
+#   classes         expected classes, or "classes_file" to read them from; without
+#                   either the sorted distinct labels are the classes
+#   rename          "closest" renames class folders to the closest expected class,
+#                   a dict renames them explicitly
+#   task            "classification" samples evenly per class, "quantification"
+#                   samples at random and its classes are the label range
+DATASETS = {
+    "SBRD": {
+        "source": "kaggle",
+        "id": "isaacritharson/severity-based-rice-leaf-diseases-dataset",
+        "directory": "Severity_Based_Rice_Leaf_Diseases_Dataset",
+        "root": ["Leaf Disease Dataset", "train"],
+        "layout": "class_folders",
+        "classes": ['Healthy', 'Mild Bacterial Blight', 'Mild Blast', 'Mild Brownspot', 'Mild Tungro', 'Severe Bacterial Blight', 'Severe Blast', 'Severe Brownspot', 'Severe Tungro'],
+        "rename": "closest",
+        "task": "classification",
+    },
+    "Durum Wheat": {
+        "source": "kaggle",
+        "id": "muratkokludataset/durum-wheat-dataset",
+        "directory": "Durum_Wheat_Dataset",
+        "root": ["Durum_Wheat_Dataset", "Dataset2-Durum Wheat Video Images"],
+        "layout": "class_folders",
+        "extensions": ('.jpg', '.jpeg', '.png', '.tiff', '.tif'),
+        "convert_tiff": True,
+        "classes": ['Foreign Matters', 'Starchy Kernels', 'Vitreous Kernels'],
+        "rename": {
+            '1-Images from Vitreous Durum Wheat': 'Vitreous Kernels',
+            '2-Images from Starchy Durum Wheat': 'Starchy Kernels',
+            '3-Images from Foreign Matters': 'Foreign Matters'
+        },
+        "task": "classification",
+    },
+    "Soybean Seeds": {
+        "source": "kaggle",
+        "id": "warcoder/soyabean-seeds",
+        "directory": "soyabean-seeds_Dataset",
+        "root": ["Soybean Seeds"],
+        "layout": "class_folders",
+        "classes": ['Broken', 'Immature', 'Intact', 'Skin-damaged', 'Spotted'],
+        "rename": "closest",
+        "task": "classification",
+    },
+    "Mango Leaf Disease": {
+        "source": "kaggle",
+        "id": "aryashah2k/mango-leaf-disease-dataset",
+        "directory": "mango-leaf-disease-dataset",
+        "layout": "class_folders",
+        "classes": ['Anthracnose', 'Bacterial Canker', 'Cutting Weevil', 'Die Back', 'Gall Midge', 'Healthy', 'Powdery Mildew', 'Sooty Mould'],
+        "rename": "closest",
+        "task": "classification",
+    },
+    "DeepWeeds": {
+        "source": "kaggle",
+        "id": "imsparsh/deepweeds",
+        "directory": "deepweeds",
+        "layout": "labels_csv",
+        "labels_csv": ["labels", "labels.csv"],
+        "images": "images",
+        "filename_column": "Filename",
+        "label_column": "Species",
+        "classes": ['Chinee apple', 'Lantana', 'Negative', 'Snake weed', 'Siam weed', 'Prickly acacia', 'Parthenium', 'Rubber vine', 'Parkinsonia'],
+        "task": "classification",
+    },
+    "IP02": {
+        "source": "kaggle",
+        "id": "rtlmhjbn/ip02-dataset",
+        "directory": "ip02-dataset",
+        "root": ["classification", "train"],
+        "layout": "class_folders",
+        "indexed_folders": True,
+        "classes_file": "classes.txt",
+        "task": "classification",
+    },
+    "Bean Leaf Lesions": {
+        "source": "kaggle",
+        "id": "marquis03/bean-leaf-lesions-classification",
+        "directory": "bean-leaf-lesions-classification",
+        "root": ["train"],
+        "layout": "class_folders",
+        "classes": ['Angular Leaf Spot', 'Bean Rust', 'Healthy'],
+        "rename": "closest",
+        "task": "classification",
+    },
+    "Yellow Rust 19": {
+        "source": "kaggle",
+        "id": "tolgahayit/yellowrust19-yellow-rust-disease-in-wheat",
+        "directory": "yellowrust19-yellow-rust-disease-in-wheat",
+        "root": ["YELLOW-RUST-19", "YELLOW-RUST-19"],
+        "layout": "class_folders",
+        "classes": ['Moderately Resistant (MR)', 'Moderately Susceptible (MS)', 'MRMS', 'No disease (0)', 'Resistant (R)', 'Susceptible (S)'],
+        "rename": {
+            'MR': 'Moderately Resistant (MR)',
+            'MS': 'Moderately Susceptible (MS)',
+            'MRMS': 'MRMS',
+            '0': 'No disease (0)',
+            'R': 'Resistant (R)',
+            'S': 'Susceptible (S)'
+        },
+        "task": "classification",
+    },
+    "FUSARIUM 22": {
+        "source": "kaggle",
+        "id": "tolgahayit/fusarium-wilt-disease-in-chickpea-dataset",
+        "directory": "fusarium-wilt-disease-in-chickpea-dataset",
+        "root": ["FUSARIUM-22", "dataset_raw"],
+        "layout": "class_folders",
+        "classes": ['Highly Resistant', 'Highly Susceptible', 'Moderately Resistant', 'Resistant', 'Susceptible'],
+        "rename": {
+            '1(HR)': 'Highly Resistant',
+            '9(HS)': 'Highly Susceptible',
+            '5(MR)': 'Moderately Resistant',
+            '3(R)': 'Resistant',
+            '7(S)': 'Susceptible'
+        },
+        "task": "classification",
+    },
+    "PlantDoc": {
+        "source": "kaggle",
+        "id": "sovitrath/leaf-disease-segmentation-with-trainvalid-split",
+        "directory": "leaf-disease-segmentation-with-trainvalid-split",
+        "root": ["leaf_disease_segmentation", "orig_data"],
+        "layout": "masks",
+        "images": "train_images",
+        "masks": "train_masks",
+        "task": "quantification",
+    },
+    "Dangerous Insects": {
+        "source": "kaggle",
+        "id": "tarundalal/dangerous-insects-dataset",
+        "directory": "farm_insects",
+        "root": ["farm_insects"],
+        "layout": "class_folders",
+        "classes": ['Africanized Honey Bees', 'Aphids', 'Armyworms', 'Brown Marmorated Stink Bugs', 'Cabbage Loopers', 'Citrus Canker', 'Colorado Potato Beetles', 'Corn Borers', 'Corn Earworms', 'Fall Armyworms', 'Fruit Flies', 'Spider Mites', 'Thrips', 'Tomato Hornworms', 'Western Corn Rootworms'],
+        "rename": "closest",
+        "task": "classification",
+    },
+    "IDC": {
+        "source": "zenodo",
+        "id": "12740714",
+        "archives": ["images.zip"],
+        "directory": "IDC_data",
+        "layout": "label_sheet",
+        "images": "images",
+        "label_sheet": "class_label.xlsx",
+        "key_column": "Plot#",
+        "label_column": "Field Visual rating",
+        "image_name": "{}-p.jpg",
+        "task": "classification",
+    },
+    "Soybean Diseases": {
+        "source": "zenodo",
+        "id": "12747481",
+        "archives": ["soybean_stress_identification.zip"],
+        "directory": "Soybean-PNAS",
+        "root": ["Training Samples"],
+        "layout": "class_folders",
+        "classes": ['Bacterial Blight', 'Bacterial Pustule', 'Frogeye Leaf Spot', 'Healthy', 'Herbicide Injury', 'Iron Deficiency Chlorosis', 'Potassium Deficiency', 'Septoria Brown Spot', 'Sudden Death Syndrome'],
+        "rename": {
+            '0': 'Bacterial Blight',
+            '1': 'Bacterial Pustule',
+            '2': 'Frogeye Leaf Spot',
+            '3': 'Healthy',
+            '4': 'Herbicide Injury',
+            '5': 'Iron Deficiency Chlorosis',
+            '6': 'Potassium Deficiency',
+            '7': 'Septoria Brown Spot',
+            '8': 'Sudden Death Syndrome'
+        },
+        "task": "classification",
+    },
+    "InsectCount": {
+        "source": "zenodo",
+        "id": "12747496",
+        "archives": ["images.zip", "labels.zip"],
+        "directory": "insectcount",
+        "layout": "label_files",
+        "images": "images",
+        "labels": "labels",
+        "task": "quantification",
+    },
+}
+
+
+def prepare_dataset(name, manifest=None):
+    """
+    Download dataset `name` if it is not on disk yet and rename its class folders;
+    returns its data directory. If the dataset's archives were kept unextracted,
+    their index is attached to `manifest` and folders are renamed in the index.
+    """
+    spec = DATASETS[name]
+    download_path = os.path.join(data_dir, spec["directory"])
+
+    # Check if the dataset already exists. Downloads go to a staging directory
+    # that is only renamed to `download_path` once every file has arrived (and
+    # passed its checksum) and been extracted, so an interrupted download is
+    # never mistaken for a complete one; the next run resumes it.
     if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
+        staging_path = f"{download_path}.partial"
+        if spec["source"] == "kaggle":
+            download_with_progress(spec["id"], path=staging_path)
+        else:
+            download_zenodo(spec["id"], staging_path, spec.get("archives", ()))
+        os.replace(staging_path, download_path)
     else:
         print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path)
 
-
-    expected_classes = ['Anthracnose', 'Bacterial Canker', 'Cutting Weevil', 'Die Back', 'Gall Midge', 'Healthy', 'Powdery Mildew', 'Sooty Mould']
-    
-    rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    file_paths = []
-    labels = []
-    
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-    
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
+    base_directory = os.path.join(download_path, *spec.get("root", []))
+    archives = lazy_archive_index(download_path, manifest)
+    if manifest is not None:
+        manifest.archives = archives
+    rename = spec.get("rename")
+    if archives is not None and archives.isdir(base_directory):
+        if rename == "closest":
+            archives.rename(base_directory, lambda folder: next(iter(difflib.get_close_matches(folder, spec["classes"], n=1, cutoff=0.2)), None))
+        elif rename:
+            archives.rename(base_directory, rename.get)
+    elif rename == "closest":
+        rename_folders(base_directory, spec["classes"])
+    elif rename:
+        rename_folders_dict(base_directory, rename)
+    return base_directory
+
+def stratified_sample(data, classes, samples_per_class, random_state=42):
+    """
+    `samples_per_class` rows of each class in `classes` (all of them if there are
+    fewer), concatenated in class order.
+
+    Rows are grouped by label in one pass instead of filtering the frame once per
+    class, and each class is drawn exactly as `class_data.sample(n, random_state)`
+    draws it, so the same samples are picked as by the per-class loop the
+    published results were produced with. (A single `groupby().sample` shares
+    one random stream across classes and would pick different rows.)
+    """
+    positions = data.groupby(1, sort=False).indices
+    picked = []
+    for cls in classes:
+        rows = positions.get(cls, np.empty(0, dtype=np.intp))
+        if len(rows) >= samples_per_class:
+            rows = rows[np.random.RandomState(random_state).permutation(len(rows))[:samples_per_class]]
         else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Mango Leaf Disease"
-
-def load_and_prepare_data_DeepWeeds(total_samples_to_check):
-
-    # Dataset details
-    dataset_name = "imsparsh/deepweeds"
-    download_path = "./data/deepweeds"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
+            print(f"Warning: Not enough samples for class {cls}. Using all {len(rows)} available samples.")
+        picked.append(rows)
+    # Labels are kept as Python objects, as they always were
+    return data.take(np.concatenate(picked)).astype(object).reset_index(drop=True)
+
+def index_dataset(name, manifest):
+    """
+    Download (if needed) and list dataset `name` of DATASETS: returns its data
+    directory, expected classes (None if they are the distinct labels), file
+    paths and labels (see LAYOUTS).
+    """
+    spec = DATASETS[name]
+    base_directory = prepare_dataset(name, manifest)
+    if "classes_file" in spec:
+        classes = read_class_names(os.path.join(data_dir, spec["directory"], spec["classes_file"]))
     else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path)
-
-    expected_classes = ['Chinee apple', 'Lantana', 'Negative', 'Snake weed', 'Siam weed', 'Prickly acacia', 'Parthenium', 'Rubber vine', 'Parkinsonia']
-    #rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    
-    # Load the labels CSV file
-    labels_df = pd.read_csv(os.path.join(base_directory, 'labels', 'labels.csv'))
-    
-    # Create a dataframe with file paths and labels
-    data = pd.DataFrame({
-        0: labels_df['Filename'].apply(lambda x: os.path.join(base_directory, 'images', x)),
-        1: labels_df['Species']
-    })
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
+        classes = spec.get("classes")
+    file_paths, labels = LAYOUTS[spec["layout"]](spec, base_directory, manifest, classes)
+    return base_directory, classes, file_paths, labels
+
+def prepare_all(names=None, workers=None):
+    """
+    Download and index every dataset of DATASETS (or just `names`), `workers`
+    (default `prepare_workers`) at a time in threads, so later loads start from
+    complete downloads and warm manifests. Returns {name: number of images}.
+    """
+    names = list(DATASETS) if names is None else names
+
+    def prepare(name):
+        manifest = DatasetManifest(name)
+        file_paths = index_dataset(name, manifest)[2]
+        manifest.save()
+        return len(file_paths)
+
+    counts = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers or prepare_workers) as executor:
+        futures = {name: executor.submit(prepare, name) for name in names}
+        for name, future in futures.items():
+            try:
+                counts[name] = future.result()
+            except Exception as e:
+                print(f"Error preparing {name}: {str(e)}")
+                failed.append(name)
+    if failed:
+        raise RuntimeError(f"Could not prepare: {', '.join(failed)}")
+    return counts
+
+def load_dataset(name, total_samples_to_check, random_state=42):
+    """
+    Download (if needed), list and sample dataset `name` of DATASETS.
+
+    Returns the shuffled sample as a DataFrame of image paths (column 0) and
+    labels (column 1), the expected classes (the [min, max] label range for
+    quantification datasets) and the dataset name.
+    """
+    # Imported here, as importing scikit-learn takes longer than the rest of this module
+    from sklearn.utils import shuffle
+
+    spec = DATASETS[name]
+    manifest = DatasetManifest(name)
+    base_directory, classes, file_paths, labels = index_dataset(name, manifest)
+
+    if spec["task"] == "quantification":
+        data = pd.DataFrame({0: file_paths})
+        if len(data) > total_samples_to_check:
+            sampled_data = data.sample(n=total_samples_to_check, random_state=random_state)
         else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "DeepWeeds"
-
-
-def load_and_prepare_data_IP02(total_samples_to_check):
-    
-    dataset_name = "rtlmhjbn/ip02-dataset"
-    download_path = "./data/ip02-dataset"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
+            sampled_data = data
+            print(f"Warning: Not enough samples. Using all {len(data)} available samples.")
+        sampled_data = sampled_data.copy()
+        sampled_data[1] = labels(sampled_data.index) if callable(labels) else [labels[i] for i in sampled_data.index]
     else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'classification','train')
-    classes_file = os.path.join(download_path, 'classes.txt')
-
+        data = pd.DataFrame({0: file_paths, 1: labels})
+        if classes is None:
+            classes = sorted(data[1].unique())
+        samples_per_class = int(total_samples_to_check / len(classes))
+        sampled_data = stratified_sample(data, classes, samples_per_class, random_state)
+    # Images still inside an unextracted archive are extracted now, and only if sampled
+    manifest.extract(sampled_data[0])
+    manifest.save()
 
+    # Shuffle the sampled data
+    shuffled_data = shuffle(sampled_data, random_state=random_state).reset_index(drop=True)
+    print(f"Loaded {len(shuffled_data)} samples from {base_directory}")
+    if spec["task"] == "quantification":
+        classes = [shuffled_data[1].min(), shuffled_data[1].max()]
+    if spec["task"] == "quantification" or "classes" not in spec and "classes_file" not in spec:
+        print(f"Label range: {shuffled_data[1].min()} to {shuffled_data[1].max()}")
+    return shuffled_data, classes, name
 
-    def read_classes(file_path):
-        classes = {}
-        with open(file_path, 'r') as f:
-            for line in f:
-                parts = line.strip().split(maxsplit=1)
-                if len(parts) == 2:
-                    class_id, class_name = parts
-                    classes[int(class_id) - 1] = class_name.strip()  # Subtract 1 to match folder names
-        return classes
 
-    expected_classes = read_classes(classes_file)
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
+# Load and prepare data functions, one per dataset
+def load_and_prepare_data_SBRD(total_samples_to_check):
+    return load_dataset("SBRD", total_samples_to_check)
 
-    file_paths = []
-    labels = []
+def load_and_prepare_data_DurumWheat(total_samples_to_check):
+    return load_dataset("Durum Wheat", total_samples_to_check)
 
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        if os.path.isdir(subdir_path):
-            for filename in os.listdir(subdir_path):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    file_paths.append(os.path.join(subdir_path, filename))
-                    labels.append(expected_classes[int(subdir)])
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes.values():
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
+def load_and_prepare_data_soybean_seeds(total_samples_to_check):
+    return load_dataset("Soybean Seeds", total_samples_to_check)
 
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), list(expected_classes.values()), "IP02"
+def load_and_prepare_data_mango_leaf(total_samples_to_check):
+    return load_dataset("Mango Leaf Disease", total_samples_to_check)
 
+def load_and_prepare_data_DeepWeeds(total_samples_to_check):
+    return load_dataset("DeepWeeds", total_samples_to_check)
 
+def load_and_prepare_data_IP02(total_samples_to_check):
+    return load_dataset("IP02", total_samples_to_check)
 
 def load_and_prepare_data_bean_leaf(total_samples_to_check):
-    # Dataset details
-    dataset_name = "marquis03/bean-leaf-lesions-classification"
-    download_path = "./data/bean-leaf-lesions-classification"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'train')
-    expected_classes = ['Angular Leaf Spot', 'Bean Rust', 'Healthy']
-    rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    
-    file_paths = []
-    labels = []
-    
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-    
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Bean Leaf Lesions"
-
+    return load_dataset("Bean Leaf Lesions", total_samples_to_check)
 
 def load_and_prepare_data_YellowRust(total_samples_to_check):
-    dataset_name = "tolgahayit/yellowrust19-yellow-rust-disease-in-wheat"
-    download_path = "./data/yellowrust19-yellow-rust-disease-in-wheat"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'YELLOW-RUST-19','YELLOW-RUST-19')
-   
-    expected_classes = ['Moderately Resistant (MR)', 'Moderately Susceptible (MS)', 'MRMS', 'No disease (0)', 'Resistant (R)', 'Susceptible (S)']
-    
-    rename_dict = {
-        'MR':'Moderately Resistant (MR)', 
-        'MS':'Moderately Susceptible (MS)', 
-        'MRMS':'MRMS',
-        '0': 'No disease (0)',
-        'R': 'Resistant (R)',
-        'S': 'Susceptible (S)'
-    }
-
-    rename_folders_dict(base_directory, rename_dict )
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    file_paths = []
-    labels = []
-
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-
-        if os.path.isdir(subdir_path):  # Check if it's a directory
-            for filename in os.listdir(subdir_path):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    file_paths.append(os.path.join(subdir_path, filename))
-                    labels.append(subdir)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Yellow Rust 19"
-
+    return load_dataset("Yellow Rust 19", total_samples_to_check)
 
 def load_and_prepare_data_FUSARIUM22(total_samples_to_check):
-    dataset_name = "tolgahayit/fusarium-wilt-disease-in-chickpea-dataset"
-    download_path = "./data/fusarium-wilt-disease-in-chickpea-dataset"
-
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'FUSARIUM-22','dataset_raw')
-   
-    expected_classes = ['Highly Resistant', 'Highly Susceptible', 'Moderately Resistant', 'Resistant', 'Susceptible']
-    
-    rename_dict = {
-        '1(HR)':'Highly Resistant', 
-        '9(HS)':'Highly Susceptible', 
-        '5(MR)':'Moderately Resistant',
-        '3(R)': 'Resistant', 
-        '7(S)':'Susceptible'        
-    }
-
-    rename_folders_dict(base_directory, rename_dict )
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    file_paths = []
-    labels = []
-
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "FUSARIUM 22"
-
+    return load_dataset("FUSARIUM 22", total_samples_to_check)
 
 def load_and_prepare_data_DiseaseQuantify(total_samples_to_check):
-
-    dataset_name = "sovitrath/leaf-disease-segmentation-with-trainvalid-split"
-    download_path = "./data/leaf-disease-segmentation-with-trainvalid-split"
-
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'leaf_disease_segmentation' ,'orig_data')
-    
-    images_dir = os.path.join(base_directory, 'train_images')
-    masks_dir = os.path.join(base_directory, 'train_masks')
-    
-    file_paths = []
-    labels = []
-    for filename in os.listdir(images_dir):
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            image_path = os.path.join(images_dir, filename)
-            mask_path = os.path.join(masks_dir, filename.replace('.jpg', '.png'))
-            
-            if os.path.exists(mask_path):
-                # Open the mask image
-                with Image.open(mask_path) as mask:
-                    # Convert to numpy array
-                    mask_array = np.array(mask)
-                    
-                    
-                    # Check if the image is RGB
-                    if len(mask_array.shape) == 3:
-                        # Identify red pixels (R > 0, G = 0, B = 0)
-                        affected_pixels = (mask_array[:,:,0] > 0) & (mask_array[:,:,1] == 0) & (mask_array[:,:,2] == 0)
-                    else:
-                        # For grayscale images, consider any non-zero pixel as affected
-                        affected_pixels = mask_array > 0
-                    
-                    # Calculate percentage of affected area
-                    total_pixels = mask_array.shape[0] * mask_array.shape[1]
-                    percentage_affected = int((np.sum(affected_pixels) / total_pixels) * 100)
-                    
-                file_paths.append(image_path)
-                labels.append(percentage_affected)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    # Sample the data
-    if len(data) > total_samples_to_check:
-        sampled_data = data.sample(n=total_samples_to_check, random_state=random_state)
-    else:
-        sampled_data = data
-        print(f"Warning: Not enough samples. Using all {len(data)} available samples.")
-    
-    # Shuffle the sampled data
-    shuffled_data = shuffle(sampled_data, random_state=random_state).reset_index(drop=True)
-
-    return shuffled_data, [shuffled_data[1].min(), shuffled_data[1].max()], "PlantDoc"
-
+    return load_dataset("PlantDoc", total_samples_to_check)
 
 def load_and_prepare_data_Soybean_Dangerous_Insects(total_samples_to_check):
-
-    # Dataset details
-    dataset_name = "tarundalal/dangerous-insects-dataset"
-    download_path = "./data/farm_insects"
-
-    # Check if the dataset already exists
-    if not os.path.exists(download_path):
-        # Download the dataset with progress
-        download_with_progress(dataset_name, path=download_path)
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-    
-    base_directory =os.path.join(download_path,'farm_insects')
-    
-    expected_classes = [ 'Africanized Honey Bees', 'Aphids', 'Armyworms', 'Brown Marmorated Stink Bugs', 'Cabbage Loopers', 'Citrus Canker', 'Colorado Potato Beetles', 'Corn Borers', 'Corn Earworms', 'Fall Armyworms', 'Fruit Flies', 'Spider Mites', 'Thrips', 'Tomato Hornworms', 'Western Corn Rootworms' ]
-    rename_folders(base_directory, expected_classes)
-
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    file_paths = []
-    labels = []
-
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Dangerous Insects"
-
+    return load_dataset("Dangerous Insects", total_samples_to_check)
 
 def load_and_prepare_data_IDC(total_samples_to_check):
-    record_id = "12740714"
-    # Create a directory to store the downloaded files
-    download_path = "./data/IDC_data"
-    
-    # Store the current working directory
-    original_dir = os.getcwd()
-   
-    # Get file URLs from the record metadata
-    file_urls = get_file_urls(record_id)   
-    if not os.path.exists(download_path):
-        os.makedirs(download_path, exist_ok=True)
-        os.chdir(download_path)
-         # Download files
-        for url, filename in file_urls:
-            download_file(url, filename)    
-        
-        os.chdir(original_dir)
-
-        # Extract zip files named "images"
-        for filename in os.listdir(download_path):
-            if filename.lower() == "images.zip":
-                zip_path = os.path.join(download_path, filename)
-                extract_zip(zip_path, download_path)  
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
-
-    
-    os.chdir(original_dir)
- 
-
-    # Return to the original directory
-    base_directory = os.path.join(download_path,'images')
-    labels_file = os.path.join(download_path,'class_label.xlsx')
-    
-    # Read the Excel file
-    df = pd.read_excel(labels_file)    
-    file_paths = []
-    labels = []
-    
-    # Iterate through the dataframe
-    for index, row in df.iterrows():
-        plot_number = str(row['Plot#'])
-        rating = row['Field Visual rating']
-        # if after converting the rating to integer it is not a integer then skip it
-        try:
-            rating = int(rating)
-        except:
-            continue
-        # Construct the filename
-        filename = f"{plot_number}-p.jpg"
-        file_path = os.path.join(base_directory, filename)
-        
-        # Check if the file exists
-        if os.path.exists(file_path):
-            file_paths.append(file_path)
-            labels.append(rating)
-    
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Get unique labels
-    expected_classes = sorted(data[1].unique())
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    shuffled_data = shuffle(sampled_data, random_state=random_state).reset_index(drop=True)
-    
-    print(f"Loaded {len(shuffled_data)} samples from {base_directory}")
-    print(f"Label range: {shuffled_data[1].min()} to {shuffled_data[1].max()}")
-    print(f"Samples per class: {samples_per_class}")
-    
-    return shuffled_data, expected_classes, "IDC"
-
-
+    return load_dataset("IDC", total_samples_to_check)
 
 def load_and_prepare_data_Soybean_PNAS(total_samples_to_check):
-
-    record_id = "12747481"
-    # Create a directory to store the downloaded files
-    download_path = "./data/Soybean-PNAS"
-    
-    # Store the current working directory
-    original_dir = os.getcwd()
-   
-    # Get file URLs from the record metadata
-    file_urls = get_file_urls(record_id)   
-    if not os.path.exists(download_path):
-        os.makedirs(download_path, exist_ok=True)
-        os.chdir(download_path)
-         # Download files
-        for url, filename in file_urls:
-            download_file(url, filename)  
-        os.chdir(original_dir)      
-
-        # Extract zip files named "images"
-        for filename in os.listdir(download_path):
-            if filename.lower() == "soybean_stress_identification.zip":
-                zip_path = os.path.join(download_path, filename)
-                extract_zip(zip_path, download_path)  
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")      
-   
-
-    base_directory = './data/Soybean-PNAS/Training Samples'
-
-    expected_classes = ['Bacterial Blight','Bacterial Pustule','Frogeye Leaf Spot', 'Healthy' , 'Herbicide Injury' , 'Iron Deficiency Chlorosis', 'Potassium Deficiency','Septoria Brown Spot', 'Sudden Death Syndrome' ]
-    
-    soybean_stress_dict = {
-    '0': 'Bacterial Blight',
-    '1': 'Bacterial Pustule',
-    '2': 'Frogeye Leaf Spot',
-    '3': 'Healthy',
-    '4': 'Herbicide Injury',
-    '5': 'Iron Deficiency Chlorosis',
-    '6': 'Potassium Deficiency',
-    '7': 'Septoria Brown Spot',
-    '8': 'Sudden Death Syndrome'
-    }
-
-    rename_folders_dict(base_directory, soybean_stress_dict )
-    print(os.listdir(base_directory))
-    samples_per_class = int(total_samples_to_check / len(expected_classes))
-    file_paths = []
-    labels = []
-
-    for subdir in os.listdir(base_directory):
-        if subdir == ".DS_Store":
-            continue
-        subdir_path = os.path.join(base_directory, subdir)
-        for filename in os.listdir(subdir_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_paths.append(os.path.join(subdir_path, filename))
-                labels.append(subdir)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    sampled_data = pd.DataFrame(columns=[0, 1])
-    for cls in expected_classes:
-        class_data = data[data[1] == cls]
-        if len(class_data) >= samples_per_class:
-            class_sample = class_data.sample(n=samples_per_class, random_state=random_state)
-        else:
-            class_sample = class_data
-            print(f"Warning: Not enough samples for class {cls}. Using all {len(class_data)} available samples.")
-        sampled_data = pd.concat([sampled_data, class_sample], ignore_index=True)
-    
-    # Shuffle the sampled data
-    print(f"Loaded {len(sampled_data)} samples from {base_directory}")
-    return shuffle(sampled_data, random_state=random_state).reset_index(drop=True), expected_classes, "Soybean Diseases"
-
+    return load_dataset("Soybean Diseases", total_samples_to_check)
 
 def load_and_prepare_data_InsectCount(total_samples_to_check):
-    record_id = "12747496"
-    # Create a directory to store the downloaded files
-    download_path = "./data/insectcount"
-    
-    # Store the current working directory
-    original_dir = os.getcwd()
-   
-    # Get file URLs from the record metadata
-    file_urls = get_file_urls(record_id)   
-    if not os.path.exists(download_path):
-        os.makedirs(download_path, exist_ok=True)
-        os.chdir(download_path)
-         # Download files
-        for url, filename in file_urls:
-            download_file(url, filename)    
-
-        os.chdir(original_dir)
-        # Extract zip files named "images"
-        for filename in os.listdir(download_path):
-            if filename.lower() == "images.zip":
-                zip_path = os.path.join(download_path, filename)
-                extract_zip(zip_path, download_path)  
-
-            if filename.lower() == "labels.zip":
-                zip_path = os.path.join(download_path, filename)
-                extract_zip(zip_path, download_path)  
-    else:
-        print(f"Dataset already exists at {download_path}. Skipping download.")
+    return load_dataset("InsectCount", total_samples_to_check)
 
-    
-    os.chdir(original_dir)
 
-    base_directory = './data/insectcount'
-    images_dir = os.path.join(base_directory, 'images')
-    labels_dir = os.path.join(base_directory, 'labels')
-    
-    file_paths = []
-    labels = []
-
-    for filename in os.listdir(images_dir):
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            image_path = os.path.join(images_dir, filename)
-            label_path = os.path.join(labels_dir, os.path.splitext(filename)[0] + '.txt')
-            
-            if os.path.exists(label_path):
-                with open(label_path, 'r') as f:
-                    label = len(f.readlines())  # Count the number of rows
-                file_paths.append(image_path)
-                labels.append(label)
-
-    data = pd.DataFrame({0: file_paths, 1: labels})
-    
-    # Use a fixed random state for deterministic sampling
-    random_state = 42
-    
-    # Sample the data
-    if len(data) > total_samples_to_check:
-        sampled_data = data.sample(n=total_samples_to_check, random_state=random_state)
-    else:
-        sampled_data = data
-        print(f"Warning: Not enough samples. Using all {len(data)} available samples.")
-    
-    # Shuffle the sampled data
-    shuffled_data = shuffle(sampled_data, random_state=random_state).reset_index(drop=True)
-    
-    print(f"Loaded {len(shuffled_data)} samples from {base_directory}")
-    print(f"Label range: {shuffled_data[1].min()} to {shuffled_data[1].max()}")
-    return shuffled_data, [shuffled_data[1].min(), shuffled_data[1].max()], "InsectCount"
\ No newline at end of file
+if __name__ == "__main__":
+    for name, count in prepare_all().items():
+        print(f"{name}: {count} images")
@@ -0,0 +1,118 @@
+import os
+import json
+import zlib
+import numpy as np
+from data_loader import resolve_path, stored_path
+
+
+def example_order(rng, candidates, labels=None):
+    """
+    A random ordering of `candidates` (row indices). With `labels`, the ordering
+    is stratified: classes take turns in a random order, so every prefix is as
+    balanced across classes as the candidates allow.
+    """
+    shuffled = [int(j) for j in np.asarray(candidates)[rng.permutation(len(candidates))]]
+    if labels is None:
+        return shuffled
+    # Classes are ordered by where they first appear in the shuffle, i.e. at random
+    classes = {}
+    for j in shuffled:
+        classes.setdefault(labels[j], []).append(j)
+    order = []
+    for rank in range(max((len(rows) for rows in classes.values()), default=0)):
+        order.extend(rows[rank] for rows in classes.values() if rank < len(rows))
+    return order
+
+
+def draw_examples(labels, max_shots, dataset="", seed=42, stratified=False, shared=False):
+    """
+    Few-shot example indices for every row of a dataset with `labels`: row i gets
+    `max_shots` other rows, and its k-shot examples are the first k of them, so
+    smaller shot counts always use a subset of the larger ones' examples.
+
+    Draws are seeded by `seed` and the dataset name, and each row's draw only
+    depends on its own index, so tables drawn with a larger `max_shots` extend
+    rather than change the smaller ones. With `shared`, every row uses the same
+    ordering (skipping itself), so prompts share their example prefix.
+    """
+    labels = [str(label) for label in labels]
+    n = len(labels)
+    strata = labels if stratified else None
+    dataset_key = zlib.crc32(dataset.encode('utf-8'))
+    if shared:
+        order = example_order(np.random.default_rng([seed, dataset_key]), np.arange(n), strata)
+        return [[j for j in order if j != i][:max_shots] for i in range(n)]
+    return [
+        example_order(np.random.default_rng([seed, dataset_key, i]), np.delete(np.arange(n), i), strata)[:max_shots]
+        for i in range(n)
+    ]
+
+
+class FewShotTable:
+    """
+    Precomputed few-shot examples of one sampled dataset (see `draw_examples`).
+
+    Every model and shot count reads its examples from the same table, so runs
+    are reproducible and comparable across vendors, and looking up a row's
+    examples is a slice.
+    """
+    def __init__(self, dataset, image_paths, examples, max_shots, seed=42, stratified=False, shared=False):
+        self.dataset = dataset
+        self.image_paths = list(image_paths)
+        self.rows = examples
+        self.max_shots = max_shots
+        self.seed = seed
+        self.stratified = stratified
+        self.shared = shared
+
+    @classmethod
+    def draw(cls, dataset, all_data, max_shots, seed=42, stratified=False, shared=False):
+        """Draw the table of a dataset's sampled rows (`all_data` as the loaders return it)."""
+        examples = draw_examples(all_data[1].tolist(), max_shots, dataset, seed, stratified, shared)
+        return cls(dataset, all_data[0].tolist(), examples, max_shots, seed, stratified, shared)
+
+    @classmethod
+    def load_or_draw(cls, path, dataset, all_data, max_shots, seed=42, stratified=False, shared=False):
+        """
+        Reuse the table saved at `path` if it was drawn for the same images with the
+        same settings and enough shots; otherwise draw it and save it there.
+        """
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                stored = json.load(f)
+            table = cls(stored["dataset"], stored["image_paths"], stored["examples"], stored["max_shots"], stored["seed"], stored["stratified"], stored["shared"])
+            if table.matches(all_data, max_shots, seed, stratified, shared):
+                return table
+            print(f"Few-shot table {path} was drawn for other images or settings; drawing it again")
+        table = cls.draw(dataset, all_data, max_shots, seed, stratified, shared)
+        table.save(path)
+        return table
+
+    def matches(self, all_data, max_shots, seed, stratified, shared):
+        if (self.seed, self.stratified, self.shared) != (seed, stratified, shared) or self.max_shots < max_shots:
+            return False
+        paths = all_data[0].tolist()
+        return len(paths) == len(self.image_paths) and all(
+            a == b or resolve_path(a) == resolve_path(b) for a, b in zip(paths, self.image_paths)
+        )
+
+    def examples(self, i, number_of_shots):
+        """Indices of the `number_of_shots` examples of row `i`."""
+        return self.rows[i][:number_of_shots]
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "dataset": self.dataset,
+                "seed": self.seed,
+                "stratified": self.stratified,
+                "shared": self.shared,
+                "max_shots": self.max_shots,
+                "image_paths": [stored_path(path) for path in self.image_paths],
+                "examples": self.rows,
+            }, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,201 @@
+import os
+import asyncio
+import io
+import json
+import base64
+import hashlib
+from collections import OrderedDict
+from PIL import Image
+
+
+def target_size(width, height, max_edge=None, max_short_edge=None):
+    """Largest size with the original aspect ratio whose long edge fits `max_edge` and short edge fits `max_short_edge`."""
+    scale = 1.0
+    if max_edge:
+        scale = min(scale, max_edge / max(width, height))
+    if max_short_edge:
+        scale = min(scale, max_short_edge / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_image(image_path: str, max_edge=None, max_short_edge=None, max_bytes=None, quality=95, min_quality=50):
+    """
+    Load image from file, convert to JPEG, and encode as base64.
+
+    The image is downscaled to fit `max_edge`/`max_short_edge`, and the JPEG
+    quality is lowered in steps of 5 (down to `min_quality`, then the size
+    shrinks further) until the JPEG fits `max_bytes`. Returns the base64 string
+    and a dict describing the encoding that was chosen.
+    """
+    with Image.open(image_path) as img:
+        original_size = img.size
+        width, height = target_size(*img.size, max_edge, max_short_edge)
+        if (width, height) != img.size:
+            # Lets the JPEG decoder skip detail that the resize would discard anyway
+            img.draft('RGB', (width, height))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if (width, height) != img.size:
+            img = img.resize((width, height), Image.LANCZOS)
+
+        while True:
+            for q in range(quality, min_quality - 1, -5):
+                buffer = io.BytesIO()
+                img.save(buffer, format="JPEG", quality=q)
+                if not max_bytes or buffer.tell() <= max_bytes:
+                    break
+            if not max_bytes or buffer.tell() <= max_bytes or min(img.size) <= 64:
+                break
+            img = img.resize((max(1, int(img.width * 0.75)), max(1, int(img.height * 0.75))), Image.LANCZOS)
+
+        info = {
+            "original_width": original_size[0],
+            "original_height": original_size[1],
+            "width": img.width,
+            "height": img.height,
+            "quality": q,
+            "bytes": buffer.tell(),
+        }
+        return base64.b64encode(buffer.getvalue()).decode('utf-8'), info
+
+
+def encode_image_with_settings(image_path, settings):
+    """`encode_image` taking its keyword arguments as (name, value) pairs, for process pools."""
+    return encode_image(image_path, **dict(settings))
+
+
+class ImageCache:
+    """
+    Content-addressed cache of base64-encoded images.
+
+    Entries are keyed by absolute path plus file mtime and size (and the
+    preprocessing settings), so an image is encoded once per run and reused by
+    every vendor, shot count and dataset, and a file that changes on disk is
+    transparently re-encoded. An in-memory LRU holds the hot set, bounded by both
+    entry count and total encoded size; if `cache_dir` is given, encodings are
+    also persisted there and survive across runs.
+    """
+    def __init__(self, max_entries=1024, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.pending = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, image_path, settings=None):
+        stat = os.stat(image_path)
+        return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, tuple(sorted((settings or {}).items())))
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _remember(self, key, value, info):
+        # The encoding info lives in the LRU entry, so it is evicted with the image
+        if key in self.entries:
+            self.size_bytes -= len(self.entries[key][0])
+        self.entries[key] = (value, info)
+        self.entries.move_to_end(key)
+        self.size_bytes += len(value)
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+
+    def _lookup(self, key):
+        """Return a cached encoding from memory or disk, or None on a miss."""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        if self.cache_dir:
+            disk_path = self._disk_path(key)
+            if os.path.exists(disk_path):
+                with open(disk_path, 'r') as f:
+                    stored = json.load(f)
+                self.disk_hits += 1
+                self._remember(key, stored["data"], stored["info"])
+                return stored["data"]
+        return None
+
+    def _store(self, key, value, info):
+        self._remember(key, value, info)
+        if self.cache_dir:
+            # Write to a temporary name first so a crash never leaves a truncated entry
+            disk_path = self._disk_path(key)
+            tmp_path = f"{disk_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"info": info, "data": value}, f)
+            os.replace(tmp_path, disk_path)
+
+    def get(self, image_path: str, settings=None) -> str:
+        """
+        Return the base64 JPEG for `image_path`, encoding it only on a cache miss.
+        `settings` are keyword arguments of `encode_image` (max_edge, max_bytes, ...).
+        """
+        key = self.key(image_path, settings)
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+            value, info = encode_image(image_path, **(settings or {}))
+            self._store(key, value, info)
+        return value
+
+    async def get_async(self, image_path: str, executor=None, settings=None) -> str:
+        """
+        Like `get`, but a miss is encoded in `executor` (e.g. a process pool) so the
+        event loop keeps serving network I/O. Concurrent misses for the same image
+        share one encode.
+        """
+        key = self.key(image_path, settings)
+        value = self._lookup(key)
+        if value is not None:
+            return value
+        if key in self.pending:
+            self.hits += 1
+            value, _ = await asyncio.shield(self.pending[key])
+            return value
+
+        self.misses += 1
+        future = asyncio.get_running_loop().run_in_executor(executor, encode_image_with_settings, image_path, key[3])
+        self.pending[key] = future
+        try:
+            value, info = await asyncio.shield(future)
+        finally:
+            del self.pending[key]
+        self._store(key, value, info)
+        return value
+
+    def describe(self, image_path: str, settings=None):
+        """
+        Return the size and quality chosen for an image that is still cached, in
+        memory or on disk, or None.
+        """
+        key = self.key(image_path, settings)
+        if key in self.entries:
+            return self.entries[key][1]
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), 'r') as f:
+                return json.load(f)["info"]
+        return None
+
+    def clear(self):
+        self.entries.clear()
+        self.size_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "size_bytes": self.size_bytes,
+        }
@@ -8,21 +8,29 @@
 # Import the required libraries
 import os
 import json
-import base64
 import asyncio
 import aiohttp
 import time
-from anthropic import Anthropic
-from PIL import Image
-import io
+import functools
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import httpx
+import anthropic
+from anthropic import AsyncAnthropic
 import pandas as pd
 import numpy as np
 import random
-from sklearn.utils import shuffle
 import nest_asyncio
 from tqdm import tqdm
 import re
-from data_loader import load_and_prepare_data_SBRD, load_and_prepare_data_DurumWheat, load_and_prepare_data_soybean_seeds, load_and_prepare_data_mango_leaf, load_and_prepare_data_DeepWeeds, load_and_prepare_data_IP02, load_and_prepare_data_bean_leaf, load_and_prepare_data_YellowRust, load_and_prepare_data_FUSARIUM22, load_and_prepare_data_InsectCount, load_and_prepare_data_DiseaseQuantify, load_and_prepare_data_IDC, load_and_prepare_data_Soybean_PNAS, load_and_prepare_data_Soybean_Dangerous_Insects
+from image_cache import ImageCache
+from response_cache import ResponseCache, request_key
+from results_store import CheckpointStore, long_results, write_results, to_legacy_frame
+from few_shot import FewShotTable
+from data_loader import load_dataset, stored_path
 nest_asyncio.apply()
 global vision_prompt
 
@@ -68,21 +76,118 @@ idc_prompt="""
 
 universal_shots= [8, 4, 2, 1, 0]
 
+# Encoded images are shared by every shot count, model and dataset in a run.
+# Set cache_dir (e.g. "./cache/images") to also keep the encodings across runs.
+image_cache = ImageCache(max_entries=1024, cache_dir=None, max_bytes=512 * 1024 * 1024)
+# Per-vendor image preprocessing (keyword arguments of image_cache.encode_image).
+# Images are downscaled to the largest size each vendor actually uses, and the
+# JPEG quality is lowered from 95 until an image fits max_bytes. The chosen size
+# of every image is saved next to each results CSV as <dataset>.images.json
+# (images already evicted from image_cache are only listed with its cache_dir).
+image_settings = {
+    "openai": {"max_edge": 2048, "max_short_edge": 768, "max_bytes": 5 * 1024 * 1024},  # high detail: fit 2048x2048, then 768 px short side
+    "anthropic": {"max_edge": 1568, "max_bytes": 3750 * 1024},  # larger images are downscaled server-side; 5 MB base64 limit per image
+    "openrouter": {"max_edge": 1344, "max_bytes": 3750 * 1024},  # LLaVA 1.6 tiles images at up to 1344 px
+    "google": {"max_edge": 3072, "max_bytes": 1536 * 1024},  # 20 MB inline request limit: 9 images of 1.5 MiB are 18.9 MB base64, leaving room for the prompt
+}
+# Processes used to decode/encode images off the event loop (None runs them in a thread)
+image_workers = os.cpu_count()
+image_executor = None
+
+# Every finished request is committed to this store so an interrupted run can resume.
+checkpoint_path = os.path.join("results", "checkpoint.sqlite")
+# Skip cells that already hold a non-NA prediction in the checkpoint store
+resume = True
+# Also seed the checkpoint from existing results/<model>/<dataset>.csv files,
+# so only their NA cells are requested again
+rerun_na_from_csv = False
+# Results are saved as typed long-format results/<model>/<dataset>.parquet;
+# also write the legacy wide CSV layout that the analysis notebooks read
+write_legacy_csv = True
+# Opt-in cache of model responses, keyed on a canonical hash of each request
+# (vendor, model, prompt, example texts, image content hashes and generation
+# parameters), so a rerun only sends the requests whose inputs changed. Answers
+# without a parseable prediction are not cached, so NA cells get a fresh
+# request when they are rerun (resume, rerun_na_from_csv). Off by
+# default: the models sample at temperature 1.0, and a cached answer is an
+# earlier sample. "refresh" sends every request again and replaces the stored
+# responses with the fresh ones. Least recently used responses are evicted
+# beyond "max_bytes" (compressed).
+response_cache_settings = {"enabled": False, "path": os.path.join("results", "response_cache.sqlite"), "max_bytes": 256 * 1024 * 1024, "refresh": False}
+response_cache = None
+
+# Few-shot examples are read from a seeded draw table per dataset, saved as
+# results/<dataset>.examples.json and shared by every model; a row's k-shot
+# examples are the first k of its 8-shot examples. "stratified" balances each
+# draw across classes, "shared" gives every row the same examples (skipping
+# itself) so prompts share a cacheable prefix.
+few_shot_settings = {"seed": 42, "stratified": False, "shared": False}
+
+# Concurrent workers draining each model's job queue. This caps the requests in
+# flight per model, and with it how many prepared prompts are held in memory.
+workers_per_model = 100
+
+# Vendor API endpoints; point these at mock_server.py to run without credentials
+api_base_urls = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com",
+    "openrouter": "https://openrouter.ai/api/v1",
+    "google": "https://generativelanguage.googleapis.com/v1beta",
+}
+
+# Connection pool shared by all requests of one API client (see BaseAPI)
+http_pool_settings = {
+    "limit": 100,               # max simultaneous connections per client
+    "limit_per_host": 50,       # max simultaneous connections to one vendor host
+    "keepalive_timeout": 60,    # seconds an idle connection is kept open
+    "ttl_dns_cache": 300,       # seconds DNS results are cached
+    "timeout": 300,             # total seconds allowed per request
+}
+
+# Per-client rate limits. Requests are counted per time_window seconds; add
+# "max_tokens" (estimated input tokens) and "max_bytes" (request payload) per
+# time_window and "max_concurrent" (requests in flight) to match your vendor tier.
+rate_limit_settings = {
+    "openai": {"max_requests": 20, "time_window": 1},
+    "anthropic": {"max_requests": 5, "time_window": 2},
+    "openrouter": {"max_requests": 15, "time_window": 5},
+    "google": {"max_requests": 15, "time_window": 5},
+}
+# Retries for transient failures (429, 5xx, timeouts, malformed responses), see RetryPolicy
+retry_settings = {"max_attempts": 5, "base_delay": 1.0, "max_delay": 60.0, "deadline": 900.0}
+# Input tokens assumed per image when estimating a request's token cost
+tokens_per_image = 1105
+# Vendor-side caching of the request prefix (the prompt and few-shot examples,
+# everything before the queried image). Claude marks the prefix with a
+# cache_control breakpoint; Gemini uploads it as a cachedContents resource for
+# `ttl` and deletes it when the client closes (Gemini caching needs an explicit
+# model version such as gemini-1.5-flash-001). A prefix is only cached once
+# requests for `min_uses` different images have used it, as cache writes and
+# storage cost extra, and prefixes estimated below the vendor minimum
+# (`min_tokens`) are sent as-is. Only with few_shot_settings["shared"] do
+# prefixes repeat across rows: with the default per-row examples every prefix
+# is sent once per model, so nothing is cached. Cached input tokens are
+# reported per model at the end of a run.
+prompt_cache_settings = {
+    "anthropic": {"enabled": True, "min_tokens": 1024, "min_uses": 2},
+    "google": {"enabled": True, "min_tokens": 4096, "min_uses": 2, "ttl": "600s"},
+}
+
 datasets = [
-    # {"loader": load_and_prepare_data_SBRD, "samples": 100, "shots": universal_shots, "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_DurumWheat, "samples": 100, "shots": universal_shots, "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_soybean_seeds, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_mango_leaf, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_DeepWeeds, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
-    # # {"loader": load_and_prepare_data_IP02, "samples": 105, "shots": universal_shots,  "vision_prompt": universal_prompt}, # implement resizing for this data and run every model again
-    # {"loader": load_and_prepare_data_bean_leaf, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_YellowRust, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_FUSARIUM22, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
-    # {"loader": load_and_prepare_data_InsectCount, "samples": 100, "shots": universal_shots,  "vision_prompt": insect_count_prompt}, 
-    # {"loader": load_and_prepare_data_DiseaseQuantify, "samples": 100, "shots": universal_shots,  "vision_prompt": disease_count_prompt},
-    # {"loader": load_and_prepare_data_IDC, "samples": 100, "shots": universal_shots,  "vision_prompt": idc_prompt},
-    # {"loader": load_and_prepare_data_Soybean_PNAS, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt}, 
-    {"loader": load_and_prepare_data_Soybean_Dangerous_Insects, "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt}, 
+    # {"dataset": "SBRD", "samples": 100, "shots": universal_shots, "vision_prompt": universal_prompt},
+    # {"dataset": "Durum Wheat", "samples": 100, "shots": universal_shots, "vision_prompt": universal_prompt},
+    # {"dataset": "Soybean Seeds", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
+    # {"dataset": "Mango Leaf Disease", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
+    # {"dataset": "DeepWeeds", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
+    # # {"dataset": "IP02", "samples": 105, "shots": universal_shots,  "vision_prompt": universal_prompt}, # images are downscaled per vendor via image_settings; run every model again
+    # {"dataset": "Bean Leaf Lesions", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
+    # {"dataset": "Yellow Rust 19", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
+    # {"dataset": "FUSARIUM 22", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt},
+    # {"dataset": "InsectCount", "samples": 100, "shots": universal_shots,  "vision_prompt": insect_count_prompt}, 
+    # {"dataset": "PlantDoc", "samples": 100, "shots": universal_shots,  "vision_prompt": disease_count_prompt},
+    # {"dataset": "IDC", "samples": 100, "shots": universal_shots,  "vision_prompt": idc_prompt},
+    # {"dataset": "Soybean Diseases", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt}, 
+    {"dataset": "Dangerous Insects", "samples": 100, "shots": universal_shots,  "vision_prompt": universal_prompt}, 
 
 ]
 
@@ -99,50 +204,434 @@ def extract_json(s):
             return None
     return None
 
-def load_image(image_path: str) -> str:
+def has_prediction(response):
+    """Whether a model response holds the JSON "prediction" that `parse_prediction` reads."""
+    parsed = extract_json(response)
+    return isinstance(parsed, dict) and 'prediction' in parsed
+
+def load_image(image_path: str, settings=None) -> str:
     """
     Load image from file, convert to JPEG, and encode as base64.
+    Encodings are served from `image_cache`, so each file is only encoded once
+    per preprocessing `settings` (see `image_settings`).
     """
     try:
-        with Image.open(image_path) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=95)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        return image_cache.get(image_path, settings)
     except Exception as e:
         print(f"Error processing image {image_path}: {str(e)}")
         return None
 
+def get_image_executor():
+    global image_executor
+    if image_executor is None and image_workers:
+        image_executor = ProcessPoolExecutor(max_workers=image_workers)
+    return image_executor
+
+def get_response_cache():
+    global response_cache
+    if response_cache is None and response_cache_settings["enabled"]:
+        response_cache = ResponseCache(response_cache_settings["path"], response_cache_settings["max_bytes"], response_cache_settings["refresh"])
+    return response_cache
+
+def close_response_cache():
+    global response_cache
+    if response_cache is not None:
+        stats = response_cache.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), {stats['entries']} responses stored")
+        response_cache.close()
+        response_cache = None
+
+def shutdown_image_executor():
+    global image_executor
+    if image_executor is not None:
+        # Called from the event loop: don't block it while the worker processes exit
+        image_executor.shutdown(wait=False, cancel_futures=True)
+        image_executor = None
+
+async def load_image_async(image_path: str, settings=None) -> str:
+    """
+    Like `load_image`, but cache misses are encoded in the image process pool so
+    CPU-bound decoding and encoding never stall the event loop.
+    """
+    try:
+        return await image_cache.get_async(image_path, get_image_executor(), settings)
+    except Exception as e:
+        print(f"Error processing image {image_path}: {str(e)}")
+        return None
+
+async def prefetch_images(image_paths, settings=None):
+    """
+    Encode `image_paths` ahead of the request workers, keeping at most
+    `image_workers` encodes queued. Workers that need an image still being
+    prefetched wait for that encode instead of starting another one.
+    """
+    semaphore = asyncio.Semaphore(image_workers or 1)
+
+    async def prefetch(image_path):
+        async with semaphore:
+            await load_image_async(image_path, settings)
+
+    unique_paths = list(dict.fromkeys(image_paths))[:image_cache.max_entries]
+    await asyncio.gather(*[prefetch(image_path) for image_path in unique_paths])
+
+class TokenBucket:
+    """A budget of `capacity` units that refills continuously over `time_window` seconds."""
+    def __init__(self, capacity, time_window):
+        self.capacity = capacity
+        self.refill_rate = capacity / time_window
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until `amount` units are available (requests larger than the bucket wait for a full bucket)."""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.refill_rate)
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+def parse_reset_seconds(value, now=None):
+    """
+    Convert a vendor rate-limit reset header into seconds from now. Handles plain
+    seconds ("20", Retry-After), durations ("1s", "6m0s", "250ms"), RFC 3339
+    timestamps (Anthropic) and HTTP dates.
+    """
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    durations = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if durations and ''.join(n + u for n, u in durations) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in durations)
+    now = time.time() if now is None else now
+    try:
+        reset_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            reset_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, reset_at.timestamp() - now)
+
 class RateLimiter:
-    def __init__(self, max_requests, time_window):
+    """
+    Token-bucket limiter with one bucket per budget: requests, and optionally
+    input tokens and payload bytes per `time_window`, plus a cap on requests in
+    flight. Waiters queue on a FIFO lock and the head sleeps exactly until its
+    request fits, so nothing polls. Responses can tighten the budgets through
+    `update_from_headers` (Retry-After and vendor rate-limit headers).
+    """
+    def __init__(self, max_requests, time_window, max_tokens=None, max_bytes=None, max_concurrent=None):
         self.max_requests = max_requests
         self.time_window = time_window
-        self.request_times = []
+        self.budgets = {"requests": TokenBucket(max_requests, time_window)}
+        if max_tokens:
+            self.budgets["tokens"] = TokenBucket(max_tokens, time_window)
+        if max_bytes:
+            self.budgets["bytes"] = TokenBucket(max_bytes, time_window)
+        self.in_flight = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        self.blocked_until = 0.0
+        self.rate_scale = 1.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self, tokens=0, payload_bytes=0):
+        """Wait until every budget can cover the request, then consume from them."""
+        amounts = {"requests": 1, "tokens": tokens, "bytes": payload_bytes}
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                delay = self.blocked_until - now
+                for name, bucket in self.budgets.items():
+                    delay = max(delay, bucket.delay(amounts[name], now))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            for name, bucket in self.budgets.items():
+                bucket.consume(amounts[name])
+
+    @asynccontextmanager
+    async def limit(self, tokens=0, payload_bytes=0):
+        """Hold a rate-limit slot (and an in-flight slot, if capped) for the duration of a request."""
+        if self.in_flight is not None:
+            await self.in_flight.acquire()
+        try:
+            await self.wait(tokens, payload_bytes)
+            yield
+        finally:
+            if self.in_flight is not None:
+                self.in_flight.release()
+
+    def pause(self, seconds):
+        """Block every waiter on this limiter for `seconds`, e.g. after a 429."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def throttle(self, seconds):
+        """Pause for `seconds` and halve the refill rates; used when the vendor answers 429."""
+        self.pause(seconds)
+        self.set_rate_scale(max(0.1, self.rate_scale * 0.5))
 
-    async def wait(self):
+    def recover(self):
+        """Step the refill rates back towards the configured limits after a successful request."""
+        if self.rate_scale < 1.0:
+            self.set_rate_scale(min(1.0, self.rate_scale + 0.05))
+
+    def set_rate_scale(self, scale):
+        now = time.monotonic()
+        for bucket in self.budgets.values():
+            bucket.refill(now)
+            bucket.refill_rate = bucket.capacity / self.time_window * scale
+        self.rate_scale = scale
+
+    def update_from_headers(self, headers):
+        """Adapt to Retry-After and the OpenAI/Anthropic/OpenRouter rate-limit headers of a response."""
+        headers = {k.lower(): v for k, v in headers.items()}
+        if 'retry-after' in headers:
+            seconds = parse_reset_seconds(headers['retry-after'])
+            if seconds is not None:
+                self.pause(seconds)
+        now = time.monotonic()
+        for name in ("requests", "tokens"):
+            for prefix in ("x-ratelimit", "anthropic-ratelimit"):
+                remaining = headers.get(f"{prefix}-remaining-{name}", headers.get(f"{prefix}-{name}-remaining"))
+                if remaining is None:
+                    continue
+                try:
+                    remaining = float(remaining)
+                except ValueError:
+                    continue
+                if name in self.budgets:
+                    bucket = self.budgets[name]
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, remaining)
+                if remaining <= 0:
+                    reset = headers.get(f"{prefix}-reset-{name}", headers.get(f"{prefix}-{name}-reset"))
+                    seconds = parse_reset_seconds(reset) if reset else None
+                    if seconds is not None:
+                        self.pause(seconds)
+        # OpenRouter reports a single request budget with the reset as epoch milliseconds
+        if headers.get('x-ratelimit-remaining') == '0' and 'x-ratelimit-reset' in headers:
+            try:
+                self.pause(max(0.0, float(headers['x-ratelimit-reset']) / 1000 - time.time()))
+            except ValueError:
+                pass
+
+def estimate_request_size(inputs):
+    """
+    Rough (input tokens, payload bytes) of a request for the token and byte
+    budgets: ~4 characters per text token and `tokens_per_image` per image.
+    """
+    texts = [inputs['prompt'], inputs['prompt']]
+    images = [inputs['image']]
+    for example in inputs['examples']:
+        if 'text' in example:
+            texts.append(example['text'])
+        elif 'image_url' in example:
+            images.append(example['image_url']['url'])
+        elif 'source' in example:
+            images.append(example['source']['data'])
+    text_chars = sum(len(text) for text in texts)
+    image_bytes = sum(len(image) for image in images)
+    return text_chars // 4 + tokens_per_image * len(images), text_chars + image_bytes
+
+class PrefixCache:
+    """
+    Counts the distinct requests each request prefix (prompt and few-shot
+    examples) has been used by, so a client only asks its vendor to cache
+    prefixes that repeat. Requests are told apart by their queried image, so
+    retries and rebuilt requests of the same row count once.
+    `entries` holds whatever the client keeps per cached prefix.
+    """
+    def __init__(self, enabled=True, min_tokens=0, min_uses=2, ttl="3600s"):
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.min_uses = min_uses
+        self.ttl = parse_reset_seconds(ttl) if ttl else None
+        self.uses = {}
+        self.entries = {}
+
+    def key(self, inputs):
+        """The key of the prefix of `inputs` if it should be cached, else None."""
+        if not self.enabled or not inputs['examples']:
+            return None
+        # The prefix is the whole request but the queried image
+        if estimate_request_size(inputs)[0] - tokens_per_image < self.min_tokens:
+            return None
+        key = hashlib.sha256(json.dumps([inputs['prompt'], inputs['examples']], sort_keys=True).encode('utf-8')).hexdigest()
+        uses = self.uses.setdefault(key, set())
+        uses.add(hashlib.sha256(inputs['image'].encode('utf-8')).hexdigest())
+        return key if len(uses) >= self.min_uses else None
+
+class APIError(Exception):
+    """A failed vendor request; `retryable` tells RetryPolicy whether another attempt can help."""
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+def check_response_status(response, body):
+    """Raise an APIError for HTTP error statuses; 408, 409, 429 and 5xx are retryable."""
+    if response.status < 400:
+        return
+    retry_after = response.headers.get('Retry-After')
+    raise APIError(
+        f"HTTP {response.status}: {body}",
+        status=response.status,
+        retryable=response.status in (408, 409, 429) or response.status >= 500,
+        retry_after=parse_reset_seconds(retry_after) if retry_after else None,
+    )
+
+class RetryPolicy:
+    """
+    Retries transient vendor failures with capped exponential backoff and full
+    jitter, giving up after `max_attempts` or once `deadline` seconds have passed
+    since the first attempt. A 429 throttles the client's RateLimiter, so every
+    request queued on that client slows down instead of burning its own retries.
+    """
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, deadline=900.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def classify(self, exc):
+        """Return (retryable, is_rate_limit, retry_after) for an exception raised by a request."""
+        if isinstance(exc, APIError):
+            return exc.retryable, exc.status == 429, exc.retry_after
+        if isinstance(exc, anthropic.APIStatusError):
+            retry_after = exc.response.headers.get('Retry-After')
+            retry_after = parse_reset_seconds(retry_after) if retry_after else None
+            return exc.status_code in (408, 409, 429) or exc.status_code >= 500, exc.status_code == 429, retry_after
+        if isinstance(exc, (anthropic.APIConnectionError, aiohttp.ClientError, asyncio.TimeoutError)):
+            return True, False, None
+        return False, False, None
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, api, send):
+        """Run `send()` until it succeeds, a non-retryable error occurs or the budget runs out."""
+        started = time.monotonic()
+        attempt = 0
         while True:
-            current_time = time.time()
-            self.request_times = [t for t in self.request_times if t > current_time - self.time_window]
-            if len(self.request_times) < self.max_requests:
-                self.request_times.append(current_time)
-                break
-            await asyncio.sleep(0.1)
-
-class GPTAPI:
-    def __init__(self, api_key, model):
+            attempt += 1
+            api.stats["requests"] += 1
+            remaining = self.deadline - (time.monotonic() - started)
+            try:
+                result = await asyncio.wait_for(send(), timeout=remaining)
+                api.rate_limiter.recover()
+                return result
+            except Exception as e:
+                retryable, is_rate_limit, retry_after = self.classify(e)
+                if isinstance(e, anthropic.APIStatusError):
+                    api.rate_limiter.update_from_headers(e.response.headers)
+                delay = max(self.backoff(attempt), retry_after or 0)
+                if is_rate_limit:
+                    api.rate_limiter.throttle(delay)
+                out_of_time = time.monotonic() - started + delay >= self.deadline
+                if not retryable or attempt >= self.max_attempts or out_of_time:
+                    api.stats["failures"] += 1
+                    raise
+                api.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+class BaseAPI:
+    """
+    Owns one long-lived aiohttp session per API client, so requests reuse
+    keep-alive connections instead of paying a TCP+TLS handshake each time.
+    Use as `async with api:` or call `await api.close()` when done.
+    Subclasses implement `send_request`; `get_image_information` wraps it in
+    the client's RetryPolicy and, if enabled, the response cache.
+    """
+    vendor = None
+
+    def __init__(self, pool_settings=None):
+        self.pool_settings = {**http_pool_settings, **(pool_settings or {})}
+        self._session = None
+        self.retry_policy = RetryPolicy(**retry_settings)
+        self.response_cache = get_response_cache()
+        self.generation_params = {}
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "cached_responses": 0, "input_tokens": 0, "cached_input_tokens": 0, "cache_write_tokens": 0}
+        # Seconds each get_image_information call took, retries and rate-limit waits included
+        self.latencies = []
+
+    async def get_image_information(self, inputs: dict) -> str:
+        # Only responses that hold a prediction are cached (and served from the
+        # cache), so cells that came out NA are requested again when rerun
+        key = None
+        if self.response_cache is not None:
+            key = request_key(self.vendor, self.model, inputs, self.generation_params)
+            response = self.response_cache.get(key, valid=has_prediction)
+            if response is not None:
+                self.stats["cached_responses"] += 1
+                return response
+        started = time.monotonic()
+        try:
+            response = await self.retry_policy.call(self, lambda: self.send_request(inputs))
+        finally:
+            self.latencies.append(time.monotonic() - started)
+        if key is not None and has_prediction(response):
+            self.response_cache.put(key, response)
+        return response
+
+    def get_session(self):
+        # Created lazily so the session binds to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_settings["limit"],
+                limit_per_host=self.pool_settings["limit_per_host"],
+                keepalive_timeout=self.pool_settings["keepalive_timeout"],
+                ttl_dns_cache=self.pool_settings["ttl_dns_cache"],
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.pool_settings["timeout"]),
+            )
+        return self._session
+
+    def record_usage(self, input_tokens=0, cached_input_tokens=0, cache_write_tokens=0):
+        """Add the prompt token usage of one response to `stats`; `input_tokens` includes the cached ones."""
+        self.stats["input_tokens"] += input_tokens or 0
+        self.stats["cached_input_tokens"] += cached_input_tokens or 0
+        self.stats["cache_write_tokens"] += cache_write_tokens or 0
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+class GPTAPI(BaseAPI):
+    vendor = "openai"
+
+    def __init__(self, api_key, model, pool_settings=None):
+        super().__init__(pool_settings)
         self.api_key = api_key
         self.model = model
-        self.url = "https://api.openai.com/v1/chat/completions"
+        self.url = f"{api_base_urls['openai']}/chat/completions"
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
-        self.rate_limiter = RateLimiter(max_requests=20, time_window=1)
+        self.rate_limiter = RateLimiter(**rate_limit_settings["openai"])
+        self.image_settings = image_settings["openai"]
+        self.generation_params = {"max_tokens": 4096, "temperature": 1.0}
 
-    async def get_image_information(self, inputs: dict) -> str:
-        await self.rate_limiter.wait()
-        payload = {
+    def build_payload(self, inputs: dict) -> dict:
+        """The chat completions request body; batch.py submits the same bodies."""
+        return {
             "model": self.model,
             "messages": [
                 {
@@ -161,42 +650,82 @@ class GPTAPI:
                     ]
                 }
             ],
-            "max_tokens": 4096, 
-            "temperature":1.0
+            **self.generation_params,
         }
-        async with aiohttp.ClientSession() as session:
+
+    async def send_request(self, inputs: dict) -> str:
+        payload = self.build_payload(inputs)
+        session = self.get_session()
+        async with self.rate_limiter.limit(*estimate_request_size(inputs)):
             async with session.post(self.url, headers=self.headers, json=payload) as response:
+                self.rate_limiter.update_from_headers(response.headers)
+                check_response_status(response, await response.text())
                 result = await response.json()
-                if "choices" in result and result["choices"]:
-                    return result["choices"][0]['message']['content']
-                else:
-                    raise Exception(f"Unexpected API response format: {result}")
-
-class ClaudeAPI:
-    def __init__(self, api_key, model):
-        self.client = Anthropic(api_key=api_key)
+        usage = result.get("usage") or {}
+        self.record_usage(usage.get("prompt_tokens"), (usage.get("prompt_tokens_details") or {}).get("cached_tokens"))
+        if "choices" in result and result["choices"]:
+            return result["choices"][0]['message']['content']
+        else:
+            raise APIError(f"Unexpected API response format: {result}", retryable=True)
+
+class ClaudeAPI(BaseAPI):
+    vendor = "anthropic"
+
+    def __init__(self, api_key, model, pool_settings=None):
+        super().__init__(pool_settings)
+        # The async client keeps requests off the event loop thread, so Claude
+        # runs get the same concurrency as the aiohttp-based clients
+        self.client = AsyncAnthropic(
+            api_key=api_key,
+            base_url=api_base_urls["anthropic"],
+            max_retries=0,  # retries are handled by RetryPolicy
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_settings["limit"],
+                    max_keepalive_connections=self.pool_settings["limit_per_host"],
+                    keepalive_expiry=self.pool_settings["keepalive_timeout"],
+                ),
+                timeout=self.pool_settings["timeout"],
+                follow_redirects=True,
+            ),
+        )
         self.model = model
-        self.rate_limiter = RateLimiter(max_requests=5, time_window=2)  # Adjust these values as needed
+        self.rate_limiter = RateLimiter(**rate_limit_settings["anthropic"])
+        self.image_settings = image_settings["anthropic"]
+        self.prompt_cache = PrefixCache(**prompt_cache_settings["anthropic"])
+        self.generation_params = {"max_tokens": 4096, "temperature": 1.0}
 
-    async def get_image_information(self, inputs: dict) -> str:
-        await self.rate_limiter.wait()
+    def build_params(self, inputs: dict):
+        """
+        The Messages API parameters of a request and the extra headers it needs;
+        batch.py submits the same parameters.
+        """
+        prefix = [
+            {"type": "text", "text": inputs['prompt']},
+            *[
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/jpeg",
+                        "data": ex['image_url']['url'].split(',')[1] if ex['type'] == 'image_url' else ex['source']['data']
+                    }
+                }
+                if ex['type'] in ['image_url', 'image'] else ex
+                for ex in inputs['examples']
+            ],
+        ]
+        extra_headers = None
+        if self.prompt_cache.key(inputs) is not None:
+            # The breakpoint goes after the examples, so a cached k-shot prefix
+            # is also found by requests with more of the same examples
+            prefix[-1] = {**prefix[-1], "cache_control": {"type": "ephemeral"}}
+            extra_headers = {"anthropic-beta": "prompt-caching-2024-07-31"}
         messages = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": inputs['prompt']},
-                    *[
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": ex['image_url']['url'].split(',')[1] if ex['type'] == 'image_url' else ex['source']['data']
-                            }
-                        }
-                        if ex['type'] in ['image_url', 'image'] else ex
-                        for ex in inputs['examples']
-                    ],
+                    *prefix,
                     {"type": "text", "text": inputs['prompt']},
                     {
                         "type": "image",
@@ -209,29 +738,44 @@ class ClaudeAPI:
                 ]
             }
         ]
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=4096,
-            temperature=1.0,
-            messages=messages
-        )
+        params = {"model": self.model, **self.generation_params, "messages": messages}
+        return params, extra_headers
+
+    async def send_request(self, inputs: dict) -> str:
+        params, extra_headers = self.build_params(inputs)
+        async with self.rate_limiter.limit(*estimate_request_size(inputs)):
+            raw_response = await self.client.messages.with_raw_response.create(**params, extra_headers=extra_headers)
+        self.rate_limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        # input_tokens only counts the tokens after the last cache breakpoint
+        cache_read = getattr(response.usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(response.usage, "cache_creation_input_tokens", None) or 0
+        self.record_usage(response.usage.input_tokens + cache_read + cache_write, cache_read, cache_write)
         return response.content[0].text
+
+    async def close(self):
+        await self.client.close()
+        await super().close()
 # Set the base directory
 
 
-class OpenRouterAPI:
-    def __init__(self, api_key, model):#  liuhaotian/llava-yi-34b
+class OpenRouterAPI(BaseAPI):
+    vendor = "openrouter"
+
+    def __init__(self, api_key, model, pool_settings=None):#  liuhaotian/llava-yi-34b
+        super().__init__(pool_settings)
         self.api_key = api_key
         self.model = model
-        self.url = "https://openrouter.ai/api/v1/chat/completions"
+        self.url = f"{api_base_urls['openrouter']}/chat/completions"
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}",
         }
-        self.rate_limiter = RateLimiter(max_requests=15, time_window=5)  # Adjust as needed
+        self.rate_limiter = RateLimiter(**rate_limit_settings["openrouter"])
+        self.image_settings = image_settings["openrouter"]
+        self.generation_params = {"temperature": 1.0}
 
-    async def get_image_information(self, inputs: dict) -> str:
-        await self.rate_limiter.wait()
+    async def send_request(self, inputs: dict) -> str:
         payload = {
             "model": self.model,
             "messages": [
@@ -250,29 +794,39 @@ class OpenRouterAPI:
                     ]
                 }
             ],
-            "temperature":1.0
+            **self.generation_params,
         }
-        async with aiohttp.ClientSession() as session:
+        session = self.get_session()
+        async with self.rate_limiter.limit(*estimate_request_size(inputs)):
             async with session.post(self.url, headers=self.headers, json=payload) as response:
+                self.rate_limiter.update_from_headers(response.headers)
+                check_response_status(response, await response.text())
                 result = await response.json()
-                if "choices" in result and result["choices"]:
-                    return result["choices"][0]['message']['content']
-                else:
-                    raise Exception(f"Unexpected API response format: {result}")
+        usage = result.get("usage") or {}
+        self.record_usage(usage.get("prompt_tokens"), (usage.get("prompt_tokens_details") or {}).get("cached_tokens"))
+        if "choices" in result and result["choices"]:
+            return result["choices"][0]['message']['content']
+        else:
+            raise APIError(f"Unexpected API response format: {result}", retryable=True)
+
+class GeminiAPI(BaseAPI):
+    vendor = "google"
 
-class GeminiAPI:
-    def __init__(self, api_key, model):
+    def __init__(self, api_key, model, pool_settings=None):
+        super().__init__(pool_settings)
         self.api_key = api_key
         self.model = model
-        self.url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+        self.base_url = api_base_urls["google"]
+        self.url = f"{self.base_url}/models/{model}:generateContent"
         self.headers = {
             "Content-Type": "application/json",
         }
-        self.rate_limiter = RateLimiter(max_requests=15, time_window=5)  # Adjust as needed
+        self.rate_limiter = RateLimiter(**rate_limit_settings["google"])
+        self.image_settings = image_settings["google"]
+        self.prompt_cache = PrefixCache(**prompt_cache_settings["google"])
+        self.generation_params = {"temperature": 1.0, "maxOutputTokens": 4096, "response_mime_type": "application/json"}
 
-    async def get_image_information(self, inputs: dict) -> str:
-        await self.rate_limiter.wait()
-        
+    async def send_request(self, inputs: dict) -> str:
         gemini_examples = []
         gemini_examples.extend([{"text": inputs['prompt']}])
         for example in inputs['examples']:
@@ -294,20 +848,91 @@ class GeminiAPI:
                     "parts": gemini_examples
                 }
             ],
-            "generationConfig": {
-                "temperature": 1.0,
-                "maxOutputTokens": 4096,
-                "response_mime_type": "application/json",
-            }
+            "generationConfig": self.generation_params,
         }
+        cache_key = self.prompt_cache.key(inputs)
+        if cache_key is not None:
+            cached_content = await self.cached_content(cache_key, gemini_examples[:-1])
+            if cached_content is not None:
+                payload["cachedContent"] = cached_content
+                payload["contents"] = [{"role": "user", "parts": gemini_examples[-1:]}]
 
-        async with aiohttp.ClientSession() as session:
+        session = self.get_session()
+        async with self.rate_limiter.limit(*estimate_request_size(inputs)):
             async with session.post(f"{self.url}?key={self.api_key}", headers=self.headers, json=payload) as response:
+                self.rate_limiter.update_from_headers(response.headers)
+                body = await response.text()
+                if response.status in (403, 404) and "cachedContent" in payload:
+                    # The cache expired or was deleted early; upload it again on the next attempt
+                    self.prompt_cache.entries.pop(cache_key, None)
+                    raise APIError(f"HTTP {response.status}: {body}", status=response.status, retryable=True)
+                check_response_status(response, body)
+                result = await response.json()
+        usage = result.get("usageMetadata") or {}
+        self.record_usage(usage.get("promptTokenCount"), usage.get("cachedContentTokenCount"))
+        if "candidates" in result and result["candidates"]:
+            return result["candidates"][0]['content']['parts'][0]['text']
+        else:
+            raise APIError(f"Unexpected API response format: {result}", retryable=True)
+
+    async def cached_content(self, cache_key, parts):
+        """
+        Name of the cachedContents resource holding the prefix `parts`, uploading it
+        on first use. Concurrent requests with the same prefix share one upload.
+        Returns None, and the request is sent uncached, if the upload fails.
+        """
+        entry = self.prompt_cache.entries.get(cache_key)
+        if entry is not None and entry["expires"] <= time.monotonic() + 30:
+            entry = None
+        if entry is None:
+            entry = {"task": asyncio.ensure_future(self.create_cached_content(parts)), "expires": time.monotonic() + self.prompt_cache.ttl}
+            self.prompt_cache.entries[cache_key] = entry
+        try:
+            return await asyncio.shield(entry["task"])
+        except Exception as e:
+            if self.prompt_cache.entries.get(cache_key) is entry:
+                del self.prompt_cache.entries[cache_key]
+            if isinstance(e, APIError) and e.status in (400, 403, 404) and self.prompt_cache.enabled:
+                # e.g. an unversioned model or a prefix below the minimum size
+                print(f"Disabling prompt caching for {self.model}: {str(e)}")
+                self.prompt_cache.enabled = False
+            return None
+
+    async def create_cached_content(self, parts):
+        payload = {
+            "model": f"models/{self.model}",
+            "contents": [{"role": "user", "parts": parts}],
+            "ttl": f"{self.prompt_cache.ttl:g}s",
+        }
+        session = self.get_session()
+        size = sum(len(part.get("text", "")) // 4 + (tokens_per_image if "inline_data" in part else 0) for part in parts)
+        async with self.rate_limiter.limit(size, len(json.dumps(payload))):
+            async with session.post(f"{self.base_url}/cachedContents?key={self.api_key}", headers=self.headers, json=payload) as response:
+                self.rate_limiter.update_from_headers(response.headers)
+                check_response_status(response, await response.text())
                 result = await response.json()
-                if "candidates" in result and result["candidates"]:
-                    return result["candidates"][0]['content']['parts'][0]['text']
-                else:
-                    raise Exception(f"Unexpected API response format: {result}")
+        self.record_usage(cache_write_tokens=(result.get("usageMetadata") or {}).get("totalTokenCount"))
+        return result["name"]
+
+    async def close(self):
+        # Stop paying for cache storage once the run is over
+        names = []
+        for entry in self.prompt_cache.entries.values():
+            task = entry["task"]
+            if task.done() and not task.cancelled() and task.exception() is None:
+                names.append(task.result())
+            else:
+                task.cancel()
+        self.prompt_cache.entries.clear()
+        if names:
+            session = self.get_session()
+            for name in names:
+                try:
+                    async with session.delete(f"{self.base_url}/{name}?key={self.api_key}") as response:
+                        await response.read()
+                except aiohttp.ClientError as e:
+                    print(f"Error deleting cached content {name}: {str(e)}")
+        await super().close()
 
 class ProgressBar:
     def __init__(self, total):
@@ -321,132 +946,321 @@ class ProgressBar:
 
 ################################################################################################################################################################
 
-async def process_image(api, i, number_of_shots, all_data_results, all_data, progress_bar):
+async def build_inputs(api, i, number_of_shots, all_data, prompt, example_table):
+    """
+    The request inputs of row `i` with `number_of_shots` examples from
+    `example_table`, in the message format of `api`, along with the paths and
+    categories of the examples that were included.
+    """
+    image_path = all_data[0][i]
+    image_base64 = await load_image_async(image_path, api.image_settings)
+    if image_base64 is None:
+        raise ValueError(f"Failed to load image: {image_path}")
+
+    examples = []
+    example_paths = []
+    example_categories = []
+    for j in example_table.examples(i, number_of_shots):
+        example_image_path = all_data[0][j]
+        example_image_base64 = await load_image_async(example_image_path, api.image_settings)
+        if example_image_base64 is not None:
+            if isinstance(api, GPTAPI) or isinstance(api, OpenRouterAPI):
+                examples.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{example_image_base64}", "detail": "high"}})
+            elif isinstance(api, ClaudeAPI):
+                examples.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/jpeg",
+                        "data": example_image_base64
+                    }
+                })
+            elif isinstance(api, GeminiAPI):
+                examples.append({"image_url": {"url": f"data:image/jpeg;base64,{example_image_base64}"}})
+            else:
+                raise ValueError(f"Unsupported API type: {type(api)}")
+
+            examples.append({"type": "text", "text": f'{{"prediction": "{all_data.at[j, 1]}"}}' })
+            example_paths.append(example_image_path)
+            example_categories.append(all_data.at[j, 1])
+
+    return {"image": image_base64, "examples": examples, "prompt": prompt}, example_paths, example_categories
+
+def parse_prediction(prediction, image_path):
+    """The "prediction" field of a model response, or 'NA' if the response holds none."""
+    try:
+        extracted_json = extract_json(prediction)
+        return extracted_json['prediction']
+    except Exception as e:
+        print(f"Error parsing JSON for image {image_path}. API response: {prediction}. Error: {str(e)}")
+        return 'NA'
+
+async def process_image(api, i, number_of_shots, all_data_results, all_data, progress_bar, example_table, record=None, prompt=None):
+    """
+    Query `api` for row `i` with `number_of_shots` examples from `example_table`
+    (the dataset's FewShotTable, see `load_example_table`) and write the result
+    into `all_data_results`; `record`, if given, persists the cell as soon as it is done.
+    `prompt` defaults to the module-level `vision_prompt`.
+    """
+    prompt = vision_prompt if prompt is None else prompt
     try:
         image_path = all_data[0][i]
-        image_base64 = load_image(image_path)
-        if image_base64 is None:
-            raise ValueError(f"Failed to load image: {image_path}")
-        
-        examples = []
-        example_paths = []
-        example_categories = []
-        num_rows = len(all_data)
-        random_indices = random.sample([idx for idx in range(num_rows) if idx != i], number_of_shots)
-
-        for j in random_indices:
-            example_image_path = all_data[0][j]
-            example_image_base64 = load_image(example_image_path)
-            if example_image_base64 is not None:
-                if isinstance(api, GPTAPI) or isinstance(api, OpenRouterAPI):
-                    examples.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{example_image_base64}", "detail": "high"}})
-                elif isinstance(api, ClaudeAPI):
-                    examples.append({
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": example_image_base64
-                        }
-                    })
-                elif isinstance(api, GeminiAPI):
-                    examples.append({"image_url": {"url": f"data:image/jpeg;base64,{example_image_base64}"}})
-                else:
-                    raise ValueError(f"Unsupported API type: {type(api)}")
-
-                examples.append({"type": "text", "text": f'{{"prediction": "{all_data.at[j, 1]}"}}' })
-                example_paths.append(example_image_path)
-                example_categories.append(all_data.at[j, 1])
-
-        prediction = await api.get_image_information({"image": image_base64, "examples": examples, "prompt": vision_prompt})
-        
-        try:
-            extracted_json = extract_json(prediction)
-            parsed_prediction = extracted_json['prediction']
-        except Exception as e:
-            print(f"Error parsing JSON for image {image_path}. API response: {prediction}. Error: {str(e)}")
-            parsed_prediction = 'NA'
+        inputs, example_paths, example_categories = await build_inputs(api, i, number_of_shots, all_data, prompt, example_table)
+        prediction = await api.get_image_information(inputs)
+        parsed_prediction = parse_prediction(prediction, image_path)
 
 
         all_data_results.at[i, f"# of Shots {number_of_shots}"] = parsed_prediction
         all_data_results.at[i, f"Example Paths {number_of_shots}"] = str(example_paths) # removed json.dump from here. 
         all_data_results.at[i, f"Example Categories {number_of_shots}"] = str(example_categories)
+        if record is not None:
+            record(number_of_shots, i, image_path, parsed_prediction, example_paths, example_categories)
 
     except Exception as e:
         print(f"Error processing {all_data[0][i]}: {str(e)}")
         all_data_results.at[i, f"# of Shots {number_of_shots}"] = 'NA'
         all_data_results.at[i, f"Example Paths {number_of_shots}"] = 'NA'
         all_data_results.at[i, f"Example Categories {number_of_shots}"] = 'NA'
+        if record is not None:
+            record(number_of_shots, i, all_data[0][i], 'NA', 'NA', 'NA')
     finally:
         progress_bar.update()
 
-async def process_images_for_shots(api, number_of_shots, all_data_results, all_data):
-    progress_bar = ProgressBar(len(all_data))
-    tasks = []
-    for i in range(len(all_data)):
-        task = asyncio.ensure_future(process_image(api, i, number_of_shots, all_data_results, all_data, progress_bar))
-        tasks.append(task)
-    
-    await asyncio.gather(*tasks)
+async def process_images_for_shots(api, number_of_shots, all_data_results, all_data, example_table, indices=None, record=None, max_in_flight=None):
+    """
+    Process rows `indices` (default: all rows) of `all_data` with a pool of
+    `max_in_flight` workers (default: `workers_per_model`). A row's images are
+    only loaded once a worker picks it up, so at most `max_in_flight` prompts
+    are held in memory however many rows there are. Examples come from
+    `example_table`, the dataset's FewShotTable (see `load_example_table`), so
+    they are the ones main() sends for the same dataset.
+    """
+    indices = range(len(all_data)) if indices is None else indices
+    run = {"all_data": all_data, "results": all_data_results, "prompt": None, "record": record, "examples": example_table, "remaining": len(indices)}
+    queue = asyncio.Queue()
+    for i in indices:
+        queue.put_nowait((run, number_of_shots, i))
+
+    progress_bar = ProgressBar(len(indices))
+    workers = min(max_in_flight or workers_per_model, len(indices))
+    await asyncio.gather(*[drain_queue(api, queue, progress_bar) for _ in range(workers)])
     progress_bar.close()
 
-async def main():
+def create_api(vendor, model):
+    if vendor == "openai":
+        return GPTAPI(api_key=os.getenv("OPENAI_API_KEY"), model=model)
+    elif vendor == "anthropic":
+        return ClaudeAPI(api_key=os.getenv("ANTHROPIC_API_KEY"), model=model)
+    elif vendor == "openrouter":
+        return OpenRouterAPI(api_key=os.getenv("OPENROUTER_API_KEY"), model=model)
+    elif vendor == "google":
+        return GeminiAPI(api_key=os.getenv("GOOGLE_API_KEY"), model=model)
+    else:
+        raise ValueError(f"Unsupported model type: {vendor}")
 
+async def drain_queue(api, queue, progress_bar, on_run_complete=None):
+    """
+    Worker for one model's queue of (run, number_of_shots, i) jobs. Every job is
+    queued before the workers start, so an empty queue means the model is done.
+    `on_run_complete(run)`, a coroutine function, is awaited once the last job
+    of a (dataset, model) run finishes.
+    """
+    while True:
+        try:
+            run, number_of_shots, i = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        await process_image(api, i, number_of_shots, run["results"], run["all_data"], progress_bar, run["examples"], run["record"], run["prompt"])
+        run["remaining"] -= 1
+        if run["remaining"] == 0 and on_run_complete is not None:
+            await on_run_complete(run)
 
+def save_image_manifest(run):
+    """
+    Save the preprocessing settings and the size/quality chosen for each image of
+    a (dataset, model) run next to its results CSV, so the run can be reproduced.
+    """
+    images = {}
+    for image_path in run["all_data"][0]:
+        info = image_cache.describe(image_path, run["image_settings"])
+        if info is not None:
+            images[stored_path(image_path)] = info
+    manifest_file = os.path.splitext(run["output_file"])[0] + ".images.json"
+    with open(manifest_file, 'w') as f:
+        json.dump({"settings": run["image_settings"], "images": images}, f, indent=1)
+
+def write_run_results(run, stored):
+    """Write the Parquet results of a run from its checkpoint rows `stored`, and the legacy CSV if `write_legacy_csv` is set."""
+    results = long_results(stored, run["all_data"], run["dataset"], run["model"], run["shots"])
+    parquet_file = os.path.splitext(run["output_file"])[0] + ".parquet"
+    write_results(results, parquet_file)
+    print(f"Results saved to {parquet_file}")
+    if write_legacy_csv:
+        to_legacy_frame(results).to_csv(run["output_file"])
+        print(f"Results saved to {run['output_file']}")
+    return results
+
+async def save_results(run, checkpoint):
+    """
+    Write a finished (dataset, model) run from its checkpoint rows: the Parquet
+    results, the legacy CSV if `write_legacy_csv` is set, and the image manifest.
+    The checkpoint and image cache are read on the event loop; the tables are
+    built and written in a thread, so the other workers keep sending requests.
+    """
+    stored = checkpoint.load(run["dataset"], run["model"])
+    save_image_manifest(run)
+    return await asyncio.to_thread(write_run_results, run, stored)
 
-    global vision_prompt
+def print_run_summary(run_summary, api_stats):
+    """Print NA rates per model, summed over datasets, next to each client's request, retry and prompt token counts."""
+    if not run_summary:
+        return
+    summary = pd.DataFrame(run_summary).groupby("model", sort=False)[["predictions", "na"]].sum()
+    summary["na_rate"] = (summary["na"] / summary["predictions"]).round(3)
+    summary = summary.join(pd.DataFrame.from_dict(api_stats, orient="index"))
+    summary["cached_share"] = (summary["cached_input_tokens"] / summary["input_tokens"].where(summary["input_tokens"] > 0)).round(3)
+    print("Per-model summary:")
+    print(summary.to_string())
 
+def load_example_table(dataset_name, all_data, max_shots):
+    """
+    The few-shot table of a loaded dataset, drawn with `few_shot_settings` and
+    saved as results/<dataset>.examples.json, so every caller and every resumed
+    run uses the same examples.
+    """
+    examples_file = os.path.join("results", f"{dataset_name}.examples.json")
+    return FewShotTable.load_or_draw(examples_file, dataset_name, all_data, max_shots, **few_shot_settings)
+
+def load_datasets():
+    """
+    Load every entry of `datasets` with its formatted prompt and few-shot table,
+    as (all_data, dataset name, prompt, shots, examples) tuples.
+    """
+    loaded_datasets = []
     for dataset in datasets:
-        loader = dataset["loader"]
         total_samples_to_check = dataset["samples"]
-        shots = dataset["shots"]
-        
-        all_data, expected_classes, output_file_name = loader(total_samples_to_check)
+
+        all_data, expected_classes, output_file_name = load_dataset(dataset["dataset"], total_samples_to_check)
         #print the output_filename and length of expected classes along with those expected classes legibally
         print(f"Dataset Name: {output_file_name}")
         print(f"Number of classes / unique labels: {len(expected_classes)}")
         print(f"Expected classes: {expected_classes}")
         print("----------------------------")
-        vision_prompt=dataset["vision_prompt"].format(expected_classes=expected_classes)
-
-        print(f"\nProcessing dataset: {output_file_name}")
+        prompt = dataset["vision_prompt"].format(expected_classes=expected_classes)
+        examples = load_example_table(output_file_name, all_data, max(dataset["shots"]))
+        loaded_datasets.append((all_data, output_file_name, prompt, dataset["shots"], examples))
+    return loaded_datasets
 
-        for vendor_model in all_vendors_models:
-            vendor = vendor_model["vendor"]
-            model = vendor_model["model"]
-            model_name = vendor_model["model_name"]
+def results_frame(all_data, shots):
+    """An empty results table of one (dataset, model) run: the samples plus three columns per shot count."""
+    all_data_results = all_data.copy(deep=True)
+    all_data_results.columns = all_data_results.columns.map(str)
+    for number_of_shots in shots:
+        for column in (f"# of Shots {number_of_shots}", f"Example Paths {number_of_shots}", f"Example Categories {number_of_shots}"):
+            all_data_results[column] = None
+    return all_data_results
 
-            print(f"Running model: {model_name}")
+async def main():
+    """
+    Queue every (dataset, model, shots, image) job up front and drain one queue
+    per model concurrently. Each model's client has its own RateLimiter, so the
+    vendors run side by side and wall time approaches that of the slowest model
+    rather than the sum over all of them.
+    """
+    run_summary = []
+    checkpoint = CheckpointStore(checkpoint_path)
+    loaded_datasets = load_datasets()
 
-            if vendor == "openai":
-                api = GPTAPI(api_key=os.getenv("OPENAI_API_KEY"), model=model)
-            elif vendor == "anthropic":
-                api = ClaudeAPI(api_key=os.getenv("ANTHROPIC_API_KEY"), model=model)
-            elif vendor == "openrouter":
-                api = OpenRouterAPI(api_key=os.getenv("OPENROUTER_API_KEY"), model=model)
-            elif vendor == "google":
-                api = GeminiAPI(api_key=os.getenv("GOOGLE_API_KEY"), model=model)
-            else:
-                raise ValueError(f"Unsupported model type: {vendor}")
+    async def save_run(run):
+        # A run that cannot be saved must not stop the other models' workers
+        try:
+            await save_results(run, checkpoint)
+        except Exception as e:
+            print(f"Error saving results of {run['model']} on {run['dataset']}: {str(e)}")
+        predictions = run["results"][[f"# of Shots {number_of_shots}" for number_of_shots in run["shots"]]]
+        run_summary.append({
+            "model": run["model"],
+            "dataset": run["dataset"],
+            "predictions": predictions.size,
+            "na": int((predictions == 'NA').sum().sum()),
+        })
 
-            all_data_results = all_data.copy(deep=True)
-            all_data_results.columns = all_data_results.columns.map(str)
+    apis = {}
+    queues = {}
+    for vendor_model in all_vendors_models:
+        model_name = vendor_model["model_name"]
+        apis[model_name] = create_api(vendor_model["vendor"], vendor_model["model"])
+        queues[model_name] = asyncio.Queue()
 
-            for number_of_shots in shots:
-                print(f"Running with {number_of_shots} shots")
-                await process_images_for_shots(api, number_of_shots, all_data_results, all_data)
+    total_jobs = 0
+    for all_data, output_file_name, prompt, shots, examples in loaded_datasets:
+        for model_name in apis:
+            all_data_results = results_frame(all_data, shots)
 
             # Create the results directory structure
             results_dir = os.path.join("results", model_name)
             os.makedirs(results_dir, exist_ok=True)
-
-            # Save the results file
             output_file = os.path.join(results_dir, f"{output_file_name}.csv")
-            all_data_results.to_csv(output_file)
-            print(f"Results saved to {output_file}")
 
-        print(f"Completed processing for dataset: {output_file_name}\n")
+            if rerun_na_from_csv and os.path.exists(output_file):
+                imported = checkpoint.import_csv(output_file, output_file_name, model_name)
+                print(f"Imported {imported} predictions from {output_file}")
+            if resume:
+                pending = checkpoint.restore(all_data_results, output_file_name, model_name, shots)
+            else:
+                pending = {number_of_shots: list(range(len(all_data))) for number_of_shots in shots}
+
+            run = {
+                "dataset": output_file_name,
+                "model": model_name,
+                "all_data": all_data,
+                "results": all_data_results,
+                "prompt": prompt,
+                "examples": examples,
+                "shots": shots,
+                "output_file": output_file,
+                "image_settings": apis[model_name].image_settings,
+                "record": functools.partial(checkpoint.record, output_file_name, model_name),
+                "remaining": sum(len(indices) for indices in pending.values()),
+            }
+            restored = len(all_data) * len(shots) - run["remaining"]
+            print(f"Queued {run['remaining']} requests for {model_name} on {output_file_name} ({restored} restored from checkpoint)")
+            if run["remaining"] == 0:
+                await save_run(run)
+            for number_of_shots in shots:
+                for i in pending[number_of_shots]:
+                    queues[model_name].put_nowait((run, number_of_shots, i))
+            total_jobs += run["remaining"]
+
+    # Start encoding every dataset's images in the process pool while the first requests go out
+    distinct_settings = list({json.dumps(api.image_settings, sort_keys=True): api.image_settings for api in apis.values()}.values())
+    prefetch_tasks = [
+        asyncio.ensure_future(prefetch_images(all_data[0], settings))
+        for all_data, _, _, _, _ in loaded_datasets
+        for settings in distinct_settings
+    ]
+    progress_bar = ProgressBar(total_jobs)
+    try:
+        workers = [
+            drain_queue(apis[model_name], queues[model_name], progress_bar, save_run)
+            for model_name in apis
+            for _ in range(workers_per_model)
+        ]
+        await asyncio.gather(*workers)
+    finally:
+        progress_bar.close()
+        for task in prefetch_tasks:
+            task.cancel()
+        shutdown_image_executor()
+        for api in apis.values():
+            await api.close()
+        checkpoint.close()
+        close_response_cache()
+
+    print_run_summary(run_summary, {model_name: api.stats for model_name, api in apis.items()})
+    stats = image_cache.stats()
+    print(f"Image cache: {stats['hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} encodes ({stats['hit_rate']:.1%} hit rate)")
 
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+import sys
+import time
+import asyncio
+import resource
+import multiprocessing
+import aiohttp
+import numpy as np
+import pandas as pd
+import inference
+import mock_server
+from inference import create_api, load_example_table, process_images_for_shots, results_frame, shutdown_image_executor
+from data_loader import load_dataset
+
+
+# End-to-end benchmark of the request pipeline against mock_server.py, so
+# changes to the clients, rate limiting or image handling can be measured
+# without API credits. Every model in inference.all_vendors_models sweeps the
+# dataset over `shots` through process_images_for_shots, all models at once as
+# in inference.main(), with the clients' own rate limits, retries and workers,
+# and the dataset's few-shot table (results/<dataset>.examples.json).
+loadtest_settings = {"dataset": "Bean Leaf Lesions", "samples": 100, "shots": [8, 4, 2, 1, 0], "vision_prompt": inference.universal_prompt}
+# Keyword arguments of mock_server.MockVendorServer (latency, faults, rate_limits, seed)
+mock_settings = {"seed": 0}
+# Client rate limits during the test (see inference.rate_limit_settings); None keeps those
+loadtest_rate_limits = None
+loadtest_host = "127.0.0.1"
+loadtest_port = 8089
+
+
+def run_mock_server(host, port, settings):
+    asyncio.run(mock_server.serve(host, port, **settings))
+
+async def wait_for_server(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{url}/mock/stats") as response:
+                    return await response.json()
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+async def sweep(api, all_data, shots, examples):
+    """Run every shot count over `all_data`; returns the results table and the wall time."""
+    all_data_results = results_frame(all_data, shots)
+    started = time.monotonic()
+    for number_of_shots in shots:
+        await process_images_for_shots(api, number_of_shots, all_data_results, all_data, examples)
+    return all_data_results, time.monotonic() - started
+
+def summarize(model_name, api, all_data_results, shots, wall_time):
+    predictions = all_data_results[[f"# of Shots {number_of_shots}" for number_of_shots in shots]]
+    latencies = np.array(api.latencies) if api.latencies else np.array([np.nan])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "model": model_name,
+        "requests": predictions.size,
+        "wall_s": round(wall_time, 2),
+        "req_per_s": round(predictions.size / wall_time, 2),
+        "p50_s": round(p50, 3),
+        "p95_s": round(p95, 3),
+        "p99_s": round(p99, 3),
+        "retries": api.stats["retries"],
+        "failures": api.stats["failures"],
+        "na_rate": round(float((predictions == 'NA').sum().sum()) / predictions.size, 3),
+    }
+
+async def run_loadtest():
+    """
+    Start the mock server in its own process, sweep every model against it and
+    print requests/sec, latency percentiles (per request, retries and rate-limit
+    waits included), NA rate and peak memory. Returns the per-model report.
+    """
+    url = f"http://{loadtest_host}:{loadtest_port}"
+    server = multiprocessing.get_context("spawn").Process(target=run_mock_server, args=(loadtest_host, loadtest_port, mock_settings), daemon=True)
+    server.start()
+    saved = (inference.api_base_urls, inference.rate_limit_settings, inference.vision_prompt, inference.response_cache_settings)
+    apis = {}
+    try:
+        await wait_for_server(url)
+        inference.api_base_urls = mock_server.mock_base_urls(loadtest_host, loadtest_port)
+        # Cached responses would skip the pipeline being measured
+        inference.response_cache_settings = {**inference.response_cache_settings, "enabled": False}
+        if loadtest_rate_limits is not None:
+            inference.rate_limit_settings = loadtest_rate_limits
+
+        all_data, expected_classes, dataset_name = load_dataset(loadtest_settings["dataset"], loadtest_settings["samples"])
+        inference.vision_prompt = loadtest_settings["vision_prompt"].format(expected_classes=expected_classes)
+        shots = loadtest_settings["shots"]
+        examples = load_example_table(dataset_name, all_data, max(shots))
+        for vendor_model in inference.all_vendors_models:
+            apis[vendor_model["model_name"]] = create_api(vendor_model["vendor"], vendor_model["model"])
+
+        started = time.monotonic()
+        sweeps = await asyncio.gather(*[sweep(api, all_data, shots, examples) for api in apis.values()])
+        total_time = time.monotonic() - started
+        server_counts = await wait_for_server(url)
+    finally:
+        shutdown_image_executor()
+        for api in apis.values():
+            await api.close()
+        inference.api_base_urls, inference.rate_limit_settings, inference.vision_prompt, inference.response_cache_settings = saved
+        server.terminate()
+        server.join()
+
+    report = pd.DataFrame([
+        summarize(model_name, api, all_data_results, shots, wall_time)
+        for (model_name, api), (all_data_results, wall_time) in zip(apis.items(), sweeps)
+    ]).set_index("model")
+    total_requests = int(report["requests"].sum())
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_per_mb = 1024 * 1024 if sys.platform == "darwin" else 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_per_mb
+    peak_workers_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / rss_per_mb
+    print(f"Load test: {dataset_name}, {len(all_data)} samples, shots {shots}, {len(apis)} models")
+    print(report.to_string())
+    print(f"Total: {total_requests} requests in {total_time:.2f}s ({total_requests / total_time:.2f} req/s)")
+    print(f"Peak memory: {peak_rss:.0f} MB (largest child process, image workers and mock server: {peak_workers_rss:.0f} MB)")
+    print(f"Mock server responses: {server_counts}")
+    return report
+
+
+if __name__ == "__main__":
+    asyncio.run(run_loadtest())
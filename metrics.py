@@ -0,0 +1,607 @@
+import os
+import csv
+import json
+import zlib
+import hashlib
+import warnings
+import numpy as np
+import pandas as pd
+from results_store import read_results
+
+
+# dataset -> (category, metric, subcategory), in the column order of the result tables
+dataset_mapping = {
+    'Durum Wheat': ('Identification (I)', 'F1', 'Seed Morphology'),
+    'Soybean Seeds': ('Identification (I)', 'F1', 'Seed Morphology'),
+    'Mango Leaf Disease': ('Identification (I)', 'F1', 'Foliar Stress'),
+    'Bean Leaf Lesions': ('Identification (I)', 'F1', 'Foliar Stress'),
+    'Soybean Diseases': ('Identification (I)', 'F1', 'Foliar Stress'),
+    'Dangerous Insects': ('Identification (I)', 'F1', 'Invasive Species'),
+    'DeepWeeds': ('Identification (I)', 'F1', 'Invasive Species'),
+    'Yellow Rust 19': ('Classification (C)', 'NMAE', 'Disease Severity'),
+    'IDC': ('Classification (C)', 'NMAE', 'Stress Tolerance'),
+    'FUSARIUM 22': ('Classification (C)', 'NMAE', 'Stress Tolerance'),
+    'InsectCount': ('Quantification (Q)', 'NMAE', 'Pest'),
+    'PlantDoc': ('Quantification (Q)', 'NMAE', 'Disease'),
+}
+
+# Ordinal scores of the classification datasets; any other label scores max + 1
+ordinal_maps = {
+    'FUSARIUM 22': {
+        'Highly Resistant': 1,
+        'Resistant': 2,
+        'Moderately Resistant': 3,
+        'Susceptible': 4,
+        'Highly Susceptible': 5,
+    },
+    'Yellow Rust 19': {
+        'Resistant (R)': 1,
+        'Moderately Resistant (MR)': 2,
+        'MRMS': 3,
+        'Moderately Susceptible (MS)': 4,
+        'Susceptible (S)': 5,
+        'No disease (0)': 0,
+    },
+    'IDC': {i: i for i in range(1, 6)},
+}
+
+shots_list = [0, 1, 2, 4, 8]
+
+# Bootstrap confidence intervals of the table metrics
+bootstrap_resamples = 1000
+confidence_level = 0.95
+bootstrap_seed = 42
+
+# Bump when scoring changes, so cached metrics computed by older code are discarded
+METRICS_VERSION = 2
+
+KEYS = ["model", "dataset", "shots"]
+
+
+def list_models(results_dir="results", order=()):
+    """
+    Model folders under `results_dir`, the row order of the result tables: the
+    models named in `order` first (see `table_model_order`), then the rest by
+    name, so regenerating the tables doesn't reorder their rows.
+    """
+    models = [f for f in os.listdir(results_dir) if os.path.isdir(os.path.join(results_dir, f))]
+    rank = {model: n for n, model in enumerate(order)}
+    return sorted(models, key=lambda model: (rank.get(model, len(rank)), model))
+
+def table_model_order(output_dir="analysis/plain-results"):
+    """The row order of the result tables already written to `output_dir` (empty if there are none)."""
+    for number_of_shots in shots_list:
+        path = os.path.join(output_dir, f"result_table_shot_{number_of_shots}.csv")
+        if os.path.exists(path):
+            with open(path, newline='') as f:
+                first_column = [row[0] for row in csv.reader(f) if row]
+            if 'Model' in first_column:
+                return first_column[first_column.index('Model') + 1:]
+    return []
+
+def _infer_types(values):
+    """
+    Give a column of result strings the types `pd.read_csv` would: empty and NA
+    cells become NaN, and the column is numeric if every other cell parses as a number.
+    """
+    values = values.astype(object).where(values.notna() & ~values.isin(['', 'NA']), np.nan)
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.notna().sum() == values.notna().sum():
+        return numeric.astype(object).where(numeric.notna(), np.nan)
+    return values
+
+def _long_from_csv(csv_path, model, dataset):
+    # Same parsing as the analysis notebooks, so labels and predictions keep the types they always had
+    df = pd.read_csv(csv_path)
+    frames = []
+    for column in df.columns:
+        if column.startswith("# of Shots "):
+            frames.append(pd.DataFrame({
+                "shots": int(column[len("# of Shots "):]),
+                "sample": np.arange(len(df)),
+                "label": df['1'].astype(object),
+                "prediction": df[column].astype(object),
+            }))
+    frame = pd.concat(frames, ignore_index=True)
+    frame.insert(0, "model", model)
+    frame.insert(1, "dataset", dataset)
+    return frame
+
+def _long_from_parquet(parquet_path):
+    frame = read_results(parquet_path)
+    frame = frame[["model", "dataset", "shots", "sample", "label", "prediction"]].astype({"model": str, "dataset": str, "shots": int})
+    first_shots = frame["shots"] == frame["shots"].iloc[0]
+    labels = _infer_types(frame.loc[first_shots, "label"].astype(str))
+    frame["label"] = frame["sample"].map(dict(zip(frame.loc[first_shots, "sample"], labels)))
+    frame["prediction"] = pd.concat([_infer_types(cells) for _, cells in frame.groupby("shots", sort=False)["prediction"]]).reindex(frame.index)
+    return frame
+
+def result_file(results_dir, model, dataset):
+    """Path of a run's results: its Parquet file when present, otherwise its legacy CSV, or None."""
+    for extension in (".parquet", ".csv"):
+        path = os.path.join(results_dir, model, f"{dataset}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_result_file(path, model, dataset):
+    """Load one results file (see `result_file`) in the long layout of `load_results`."""
+    if path.endswith(".parquet"):
+        return _long_from_parquet(path)
+    return _long_from_csv(path, model, dataset)
+
+def load_results(results_dir="results", models=None, datasets=None):
+    """
+    Load every results/<model>/<dataset> file once into one long DataFrame with
+    columns model, dataset, shots, sample, label and prediction. A dataset's
+    Parquet results are used when present, otherwise its legacy CSV.
+    """
+    models = list_models(results_dir) if models is None else models
+    datasets = list(dataset_mapping) if datasets is None else datasets
+    frames = []
+    for model in models:
+        for dataset in datasets:
+            path = result_file(results_dir, model, dataset)
+            if path:
+                frames.append(load_result_file(path, model, dataset))
+    if not frames:
+        return pd.DataFrame(columns=KEYS + ["sample", "label", "prediction"])
+    return pd.concat(frames, ignore_index=True)
+
+def _filled(values, fill):
+    """`fillna` without pandas downcasting the object column."""
+    return values.astype(object).where(values.notna(), fill)
+
+def _label_counts(frame, true_labels, pred_labels):
+    """
+    Count true labels (support), predictions and true positives per cell and
+    label, as (cells, labels) arrays built with one bincount each. Also returns
+    the cells (one row per model, dataset and shots) and each row's cell number.
+    """
+    group = frame.groupby(KEYS, sort=False).ngroup().to_numpy()
+    cells = frame.drop_duplicates(KEYS)[KEYS].reset_index(drop=True)
+    n_cells = len(cells)
+
+    # One code per distinct label across all cells; 4 and 4.0 share a code, as they compare equal
+    codes, uniques = pd.factorize(pd.concat([true_labels, pred_labels], ignore_index=True), sort=False)
+    true_codes, pred_codes = codes[:len(frame)], codes[len(frame):]
+    n_labels = len(uniques)
+
+    support = np.bincount(group * n_labels + true_codes, minlength=n_cells * n_labels).reshape(n_cells, n_labels)
+    predicted = np.bincount(group * n_labels + pred_codes, minlength=n_cells * n_labels).reshape(n_cells, n_labels)
+    correct = true_codes == pred_codes
+    true_positives = np.bincount((group * n_labels + true_codes)[correct], minlength=n_cells * n_labels).reshape(n_cells, n_labels)
+    return cells, group, support, predicted, true_positives
+
+def _mixed_types(true_labels, pred_labels, group, n_cells):
+    """Cells whose labels mix text and numbers; like sklearn, these are not scored."""
+    is_text = np.concatenate([true_labels.map(type).eq(str).to_numpy(), pred_labels.map(type).eq(str).to_numpy()])
+    text_count = np.bincount(np.concatenate([group, group])[is_text], minlength=n_cells)
+    return (text_count > 0) & (text_count < 2 * np.bincount(group, minlength=n_cells))
+
+def _identification(frame):
+    """Weighted F1 (x100) per cell, from per-label counts of all cells at once."""
+    true_labels = _filled(frame["label"], 'Unknown')
+    pred_labels = _filled(frame["prediction"], 'NA_placeholder')
+    cells, group, support, predicted, true_positives = _label_counts(frame, true_labels, pred_labels)
+    cells["score"] = weighted_f1(support, predicted, true_positives) * 100
+    cells.loc[_mixed_types(true_labels, pred_labels, group, len(cells)), "score"] = np.nan
+    return cells
+
+def weighted_f1(support, predicted, true_positives):
+    """
+    Support-weighted F1 over the last axis of label count arrays, as
+    precision_recall_fscore_support(average='weighted', zero_division=0).
+    """
+    denominator = support + predicted
+    f1 = np.divide(2 * true_positives, denominator, out=np.zeros(true_positives.shape), where=denominator > 0)
+    total = support.sum(axis=-1)
+    return np.divide((f1 * support).sum(axis=-1), total, out=np.zeros(total.shape), where=total > 0)
+
+def _classification_rows(frame):
+    """Per-row ordinal error; labels outside the ordinal map score max + 1 and are flagged `unseen`."""
+    scored = []
+    for dataset, rows in frame.groupby("dataset", sort=False):
+        ordinal_map = ordinal_maps[dataset]
+        worst = max(ordinal_map.values()) + 1
+        true_ordinal = _filled(rows["label"], 'Unknown').map(ordinal_map)
+        pred_ordinal = _filled(rows["prediction"], 'NA_placeholder').map(ordinal_map)
+        scored.append(pd.DataFrame({
+            "model": rows["model"],
+            "dataset": dataset,
+            "shots": rows["shots"],
+            "sample": rows["sample"],
+            "error": (true_ordinal.fillna(worst) - pred_ordinal.fillna(worst)).abs(),
+            "unseen": true_ordinal.isna() | pred_ordinal.isna(),
+            "lowest": min(ordinal_map.values()),
+            "highest": max(ordinal_map.values()),
+        }))
+    return pd.concat(scored)
+
+def _classification(frame):
+    """Ordinal NMAE (x100) per cell; an unseen label widens the range by one."""
+    cells = _classification_rows(frame).groupby(KEYS, sort=False).agg(
+        mae=("error", "mean"), unseen=("unseen", "any"), lowest=("lowest", "first"), highest=("highest", "first"),
+    ).reset_index()
+    max_possible_error = cells["highest"] + cells["unseen"] - cells["lowest"]
+    cells["score"] = np.where(max_possible_error == 0, 0.0, cells["mae"] / max_possible_error * 100)
+    return cells[KEYS + ["score"]]
+
+def _quantification_rows(frame):
+    """Per-row absolute and percentage errors, NaN unless both sides are numbers."""
+    true_values = pd.to_numeric(frame["label"], errors='coerce')
+    pred_values = pd.to_numeric(frame["prediction"], errors='coerce')
+    valid = true_values.notna() & pred_values.notna()
+    nonzero = valid & (true_values != 0)
+    return pd.DataFrame({
+        "model": frame["model"], "dataset": frame["dataset"], "shots": frame["shots"], "sample": frame["sample"],
+        "true": true_values.where(valid), "error": (true_values - pred_values).abs().where(valid),
+        "percentage_error": ((true_values - pred_values) / true_values).abs().where(nonzero),
+    })
+
+def _quantification(frame):
+    """NMAE (x100, normalized by the range of true counts) and MAPE per cell, over rows where both sides are numbers."""
+    cells = _quantification_rows(frame).groupby(KEYS, sort=False).agg(
+        mae=("error", "mean"), lowest=("true", "min"), highest=("true", "max"), mape=("percentage_error", "mean"),
+    ).reset_index()
+    max_possible_error = cells["highest"] - cells["lowest"]
+    cells["score"] = np.where(max_possible_error == 0, 0.0, cells["mae"] / max_possible_error * 100)
+    cells.loc[cells["mae"].isna(), "score"] = np.nan
+    cells["mape"] = cells["mape"] * 100
+    return cells[KEYS + ["score", "mape"]]
+
+def compute_metrics(results):
+    """
+    Score every (model, dataset, shots) cell of `load_results` output in one pass
+    per task category. Returns one row per cell with the table metric in `score`
+    (F1 for identification, NMAE otherwise) and MAPE for quantification.
+    """
+    category = results["dataset"].map(lambda dataset: dataset_mapping[dataset][0])
+    parts = []
+    for name, scorer in (('Identification (I)', _identification), ('Classification (C)', _classification), ('Quantification (Q)', _quantification)):
+        rows = results[category == name]
+        if len(rows):
+            parts.append(scorer(rows.reset_index(drop=True)))
+    metrics = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=KEYS + ["score"])
+    if "mape" not in metrics:
+        metrics["mape"] = np.nan
+    return metrics
+
+def class_stats(results):
+    """
+    Per-class (one-vs-rest) F1 of the identification and classification cells,
+    summarized per cell as the mean and the coefficient of variation (population
+    std / mean, x100) across the classes present in the true labels. Labels are
+    compared as strings, as in the per-class plots of the analysis notebook.
+    """
+    category = results["dataset"].map(lambda dataset: dataset_mapping[dataset][0])
+    frame = results[category.isin(['Identification (I)', 'Classification (C)'])].reset_index(drop=True)
+    if frame.empty:
+        return pd.DataFrame(columns=KEYS + ["class_f1_mean", "class_f1_cv"])
+    true_labels = _filled(frame["label"], 'Unknown').astype(str)
+    pred_labels = _filled(frame["prediction"], 'NA_placeholder').astype(str)
+    cells, _, support, predicted, true_positives = _label_counts(frame, true_labels, pred_labels)
+
+    present = support > 0
+    f1 = np.where(present, 2 * true_positives / np.maximum(support + predicted, 1), 0.0) * 100
+    n_classes = present.sum(axis=1)
+    mean = f1.sum(axis=1) / n_classes
+    std = np.sqrt((np.where(present, f1 - mean[:, None], 0.0) ** 2).sum(axis=1) / n_classes)
+    cells["class_f1_mean"] = mean
+    cells["class_f1_cv"] = np.where(mean != 0, std / np.where(mean != 0, mean, 1) * 100, 0.0)
+    return cells
+
+def class_performance_variation(stats, shots=(0, 8)):
+    """The analysis/class_performance_variation.csv table: per-class F1 CV per model and dataset."""
+    stats = stats[stats["shots"].isin(shots)]
+    table = stats.pivot(index=["model", "dataset"], columns="shots", values="class_f1_cv").reindex(columns=list(shots))
+    table.columns = [f"{number_of_shots}-shot CV" for number_of_shots in shots]
+    table.index.names = ["Model", "Dataset"]
+    return table.sort_index().round(2).reset_index()
+
+def resample_indices(dataset, n, n_resamples=None, seed=None):
+    """
+    (n_resamples, n) matrix of bootstrap row indices for a dataset of `n` samples.
+    It is drawn from a generator seeded by `seed` and the dataset name, so every
+    model and shot count of a dataset is resampled identically (paired), and a
+    dataset's intervals do not depend on which other results are loaded.
+    """
+    n_resamples = bootstrap_resamples if n_resamples is None else n_resamples
+    seed = bootstrap_seed if seed is None else seed
+    rng = np.random.default_rng([seed, zlib.crc32(dataset.encode('utf-8')), n])
+    return rng.integers(0, n, size=(n_resamples, n))
+
+def _cell_matrix(rows, column, n_cells, n):
+    return rows[column].to_numpy().reshape(n_cells, n)
+
+def _f1_replicates(rows, index, chunk_elements=4_000_000):
+    """Weighted F1 (x100) of each cell for every resample: (cells, resamples)."""
+    true_labels = _filled(rows["label"], 'Unknown')
+    pred_labels = _filled(rows["prediction"], 'NA_placeholder')
+    codes, uniques = pd.factorize(pd.concat([true_labels, pred_labels], ignore_index=True), sort=False)
+    n_labels = len(uniques)
+    n_resamples, n = index.shape
+    n_cells = len(rows) // n
+    true_codes, pred_codes = codes[:len(rows)].reshape(n_cells, n), codes[len(rows):].reshape(n_cells, n)
+
+    replicates = np.empty((n_cells, n_resamples))
+    # Resamples are processed in chunks that bound the (cells, resamples, n) code arrays
+    step = max(1, chunk_elements // (n_cells * n))
+    for start in range(0, n_resamples, step):
+        chunk = index[start:start + step]
+        t, p = true_codes[:, chunk], pred_codes[:, chunk]
+        size = n_cells * len(chunk) * n_labels
+        offset = (np.arange(n_cells * len(chunk)) * n_labels).reshape(n_cells, len(chunk), 1)
+        support = np.bincount((t + offset).ravel(), minlength=size)
+        predicted = np.bincount((p + offset).ravel(), minlength=size)
+        true_positives = np.bincount((t + offset)[t == p], minlength=size)
+        shape = (n_cells, len(chunk), n_labels)
+        replicates[:, start:start + len(chunk)] = weighted_f1(support.reshape(shape), predicted.reshape(shape), true_positives.reshape(shape)) * 100
+
+    group = np.repeat(np.arange(n_cells), n)
+    replicates[_mixed_types(true_labels, pred_labels, group, n_cells)] = np.nan
+    return replicates
+
+def _ordinal_replicates(rows, index):
+    """Ordinal NMAE (x100) of each cell for every resample: (cells, resamples)."""
+    n = index.shape[1]
+    n_cells = len(rows) // n
+    error = _cell_matrix(rows, "error", n_cells, n).astype(float)[:, index]
+    unseen = _cell_matrix(rows, "unseen", n_cells, n).astype(bool)[:, index].any(axis=-1)
+    max_possible_error = rows["highest"].iloc[0] + unseen - rows["lowest"].iloc[0]
+    mae = error.mean(axis=-1)
+    return np.where(max_possible_error == 0, 0.0, mae / np.where(max_possible_error == 0, 1, max_possible_error) * 100)
+
+def _quantity_replicates(rows, index):
+    """Quantification NMAE (x100) of each cell for every resample: (cells, resamples)."""
+    n = index.shape[1]
+    n_cells = len(rows) // n
+    error = _cell_matrix(rows, "error", n_cells, n).astype(float)[:, index]
+    true = _cell_matrix(rows, "true", n_cells, n).astype(float)[:, index]
+    valid = ~np.isnan(error)
+    count = valid.sum(axis=-1)
+    mae = np.where(valid, error, 0.0).sum(axis=-1) / np.maximum(count, 1)
+    max_possible_error = np.where(valid, true, -np.inf).max(axis=-1) - np.where(valid, true, np.inf).min(axis=-1)
+    with np.errstate(invalid='ignore'):
+        score = np.where(max_possible_error == 0, 0.0, mae / np.where(max_possible_error == 0, 1, max_possible_error) * 100)
+    return np.where(count == 0, np.nan, score)
+
+def bootstrap_intervals(results, n_resamples=None, confidence=None, seed=None):
+    """
+    Percentile bootstrap confidence intervals of the table metric of every
+    (model, dataset, shots) cell. Each dataset's resampling index matrix is
+    built once (see `resample_indices`) and all of its cells are scored for all
+    resamples at once: weighted F1 from batched per-label bincounts, NMAE from
+    gathered error matrices. Returns KEYS plus ci_low and ci_high.
+    """
+    n_resamples = bootstrap_resamples if n_resamples is None else n_resamples
+    confidence = confidence_level if confidence is None else confidence
+    alpha = (1 - confidence) / 2 * 100
+    intervals = []
+    for dataset, rows in results.groupby("dataset", sort=False):
+        category = dataset_mapping[dataset][0]
+        if category == 'Classification (C)':
+            rows, replicate = _classification_rows(rows), _ordinal_replicates
+        elif category == 'Quantification (Q)':
+            rows, replicate = _quantification_rows(rows), _quantity_replicates
+        else:
+            replicate = _f1_replicates
+        rows = rows.sort_values(KEYS + ["sample"], kind="stable").reset_index(drop=True)
+        sizes = rows.groupby(KEYS, sort=False).size()
+        # Cells are resampled together when they have the same number of samples
+        for n, same_size in sizes.groupby(sizes, sort=False):
+            cells = same_size.index.to_frame(index=False)
+            cell_rows = rows.merge(cells, on=KEYS, sort=False)
+            replicates = replicate(cell_rows, resample_indices(dataset, n, n_resamples, seed))
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                low, high = np.nanpercentile(replicates, [alpha, 100 - alpha], axis=1)
+            cells["ci_low"], cells["ci_high"] = low, high
+            intervals.append(cells)
+    if not intervals:
+        return pd.DataFrame(columns=KEYS + ["ci_low", "ci_high"])
+    return pd.concat(intervals, ignore_index=True)
+
+def result_tables(metrics, models=None, shots=None):
+    """Model x dataset tables per shot count, with (category, metric, subcategory, dataset) columns, as `result_table_dict`."""
+    models = list(pd.unique(metrics["model"])) if models is None else models
+    shots = shots_list if shots is None else shots
+    columns = pd.MultiIndex.from_tuples([
+        (category, metric, subcategory, dataset)
+        for dataset, (category, metric, subcategory) in dataset_mapping.items()
+    ])
+    tables = {}
+    for number_of_shots in shots:
+        cells = metrics[metrics["shots"] == number_of_shots]
+        table = cells.pivot(index="model", columns="dataset", values="score").reindex(index=models, columns=list(dataset_mapping))
+        table = table.astype(float).round(2)
+        table.index.name = 'Model'
+        table.columns = columns
+        tables[number_of_shots] = table
+    return tables
+
+def ci_tables(metrics, intervals, models=None, shots=None):
+    """
+    The result tables with a bootstrap interval beside every value: columns are
+    (category, metric, subcategory, dataset, stat) with stat value, ci_low and ci_high.
+    """
+    models = list(pd.unique(metrics["model"])) if models is None else models
+    shots = shots_list if shots is None else shots
+    cells = metrics.merge(intervals, on=KEYS, how="left").rename(columns={"score": "value"})
+    stats = ["value", "ci_low", "ci_high"]
+    columns = pd.MultiIndex.from_tuples([
+        (category, metric, subcategory, dataset, stat)
+        for dataset, (category, metric, subcategory) in dataset_mapping.items()
+        for stat in stats
+    ])
+    tables = {}
+    for number_of_shots in shots:
+        shot_cells = cells[cells["shots"] == number_of_shots]
+        table = shot_cells.pivot(index="model", columns="dataset", values=stats)
+        table = table.reindex(index=models, columns=[(stat, dataset) for dataset in dataset_mapping for stat in stats])
+        table = table.astype(float).round(2)
+        table.index.name = 'Model'
+        table.columns = columns
+        tables[number_of_shots] = table
+    return tables
+
+def write_result_tables(tables, output_dir="analysis/plain-results"):
+    os.makedirs(output_dir, exist_ok=True)
+    for number_of_shots, table in tables.items():
+        table.to_csv(os.path.join(output_dir, f"result_table_shot_{number_of_shots}.csv"))
+
+def build_result_tables(results_dir="results", output_dir="analysis/plain-results"):
+    """Load all results once, score them, and write (if `output_dir`) and return `result_table_dict`."""
+    models = list_models(results_dir, table_model_order(output_dir) if output_dir else ())
+    metrics = compute_metrics(load_results(results_dir, models))
+    tables = result_tables(metrics, models)
+    if output_dir:
+        write_result_tables(tables, output_dir)
+    return tables
+
+
+def file_fingerprint(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MetricsCache:
+    """
+    Per-(model, dataset) metrics keyed on the content hash of the results file
+    they were computed from.
+
+    `refresh` fingerprints every results file and only loads and scores the
+    files whose hash is new; the cells of every other run come from the cache,
+    which is kept as JSON at `path`.
+    """
+    def __init__(self, path="analysis/metrics_cache.json"):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                stored = json.load(f)
+            if stored.get("version") == METRICS_VERSION and stored.get("bootstrap") == self.bootstrap_settings():
+                self.entries = stored["entries"]
+
+    @staticmethod
+    def bootstrap_settings():
+        return [bootstrap_resamples, confidence_level, bootstrap_seed]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": METRICS_VERSION, "bootstrap": self.bootstrap_settings(), "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, results_dir="results", models=None):
+        """
+        Bring the cache up to date with `results_dir`. Returns the cell metrics
+        (as `compute_metrics`), the per-class stats (as `class_stats`), the
+        bootstrap intervals (as `bootstrap_intervals`) and the (model, dataset)
+        runs that were recomputed.
+        """
+        models = list_models(results_dir) if models is None else models
+        current, stale = {}, []
+        for model in models:
+            for dataset in dataset_mapping:
+                path = result_file(results_dir, model, dataset)
+                if path is None:
+                    continue
+                key = f"{model}/{dataset}"
+                fingerprint = file_fingerprint(path)
+                if self.entries.get(key, {}).get("fingerprint") == fingerprint:
+                    current[key] = self.entries[key]
+                else:
+                    stale.append((key, model, dataset, path, fingerprint))
+
+        if stale:
+            results = pd.concat([load_result_file(path, model, dataset) for _, model, dataset, path, _ in stale], ignore_index=True)
+            metrics, stats, intervals = compute_metrics(results), class_stats(results), bootstrap_intervals(results)
+            for key, model, dataset, _, fingerprint in stale:
+                current[key] = {
+                    "fingerprint": fingerprint,
+                    "metrics": _records(metrics, model, dataset),
+                    "class_stats": _records(stats, model, dataset),
+                    "intervals": _records(intervals, model, dataset),
+                }
+        self.entries = current
+
+        columns = {
+            "metrics": ["shots", "score", "mape"],
+            "class_stats": ["shots", "class_f1_mean", "class_f1_cv"],
+            "intervals": ["shots", "ci_low", "ci_high"],
+        }
+        frames = {}
+        for part, part_columns in columns.items():
+            rows = [
+                [entry_key.split("/", 1)[0], entry_key.split("/", 1)[1]] + row
+                for entry_key, entry in self.entries.items() for row in entry[part]
+            ]
+            frames[part] = pd.DataFrame(rows, columns=["model", "dataset"] + part_columns).astype({"shots": int})
+        return frames["metrics"], frames["class_stats"], frames["intervals"], [(model, dataset) for _, model, dataset, _, _ in stale]
+
+
+def _records(frame, model, dataset):
+    cells = frame[(frame["model"] == model) & (frame["dataset"] == dataset)]
+    return cells.drop(columns=["model", "dataset"]).values.tolist()
+
+def _write_if_changed(text, path):
+    """Write `text` to `path` unless the file already holds exactly that; returns whether it was written."""
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            if f.read() == text:
+                return False
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+    return True
+
+def refresh_analysis(results_dir="results", output_dir="analysis/plain-results",
+                     variation_path="analysis/class_performance_variation.csv", cache_path="analysis/metrics_cache.json"):
+    """
+    Incrementally refresh the result tables (with their bootstrap CI versions,
+    result_table_shot_{shots}_ci.csv) and class_performance_variation.csv:
+    only results files whose contents changed since the last refresh are scored,
+    and only output files whose contents change are rewritten. Returns
+    `result_table_dict`, the per-class stats (see `class_stats`) and the CI
+    tables (see `ci_tables`).
+    """
+    cache = MetricsCache(cache_path)
+    models = list_models(results_dir, table_model_order(output_dir) if output_dir else ())
+    metrics, stats, intervals, recomputed = cache.refresh(results_dir, models)
+    cache.save()
+
+    tables = result_tables(metrics, models)
+    interval_tables = ci_tables(metrics, intervals, models)
+    written = []
+    if output_dir:
+        for number_of_shots in tables:
+            outputs = [
+                (tables[number_of_shots], f"result_table_shot_{number_of_shots}.csv"),
+                (interval_tables[number_of_shots], f"result_table_shot_{number_of_shots}_ci.csv"),
+            ]
+            for table, filename in outputs:
+                path = os.path.join(output_dir, filename)
+                if _write_if_changed(table.to_csv(), path):
+                    written.append(path)
+    if variation_path and len(stats):
+        if _write_if_changed(class_performance_variation(stats).to_csv(index=False), variation_path):
+            written.append(variation_path)
+    print(f"Recomputed {len(recomputed)} of {len(cache.entries)} results files; updated {len(written)} output files")
+    return tables, stats, interval_tables
+
+
+if __name__ == "__main__":
+    result_table_dict, _, _ = refresh_analysis()
+    for number_of_shots, table in result_table_dict.items():
+        print(f"{number_of_shots}-shot results are:")
+        print(table)
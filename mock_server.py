@@ -0,0 +1,523 @@
+import re
+import ast
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from aiohttp import web
+
+
+# Address the server listens on when run as a script; point
+# inference.api_base_urls at mock_base_urls(mock_host, mock_port)
+mock_host = "127.0.0.1"
+mock_port = 8080
+# Seconds a submitted batch stays in progress before its results are ready
+batch_delay = 2.0
+# Response latency per vendor in seconds: lognormal around `median` with shape
+# `sigma`, plus `per_image` for every image in the request, capped at `max`
+latency_settings = {
+    "openai": {"median": 1.5, "sigma": 0.4, "per_image": 0.1, "max": 30.0},
+    "anthropic": {"median": 2.0, "sigma": 0.4, "per_image": 0.15, "max": 30.0},
+    "openrouter": {"median": 3.0, "sigma": 0.6, "per_image": 0.2, "max": 60.0},
+    "google": {"median": 1.0, "sigma": 0.5, "per_image": 0.05, "max": 30.0},
+}
+# Fractions of requests answered with an injected 429 (with Retry-After), a
+# 500/502/503, or a 200 whose answer is not JSON
+fault_settings = {"rate_limit": 0.02, "server_error": 0.01, "bad_answer": 0.01, "retry_after": 1.0}
+# Requests per minute each vendor endpoint admits; the rest get 429. The budget
+# is reported in each vendor's rate-limit headers
+vendor_rate_limits = {"openai": 10000, "anthropic": 4000, "openrouter": 1000, "google": 2000}
+
+
+def mock_answer(prompt, image, bad=False):
+    """
+    A well-formed model answer: one of the classes listed in the prompt, chosen
+    by the image so repeated requests get the same answer. A `bad` answer holds
+    no JSON, like a model that ignored the output format.
+    """
+    if bad:
+        return "I am unable to determine the class of this image."
+    choices = ["0"]
+    match = re.search(r"\[[^\[\]]*\]", prompt or "")
+    if match:
+        try:
+            choices = [str(choice) for choice in ast.literal_eval(match.group())] or choices
+        except (ValueError, SyntaxError):
+            pass
+    digest = int(hashlib.md5((image or "").encode('utf-8')).hexdigest(), 16)
+    return json.dumps({"prediction": choices[digest % len(choices)]})
+
+def mock_base_urls(host=mock_host, port=mock_port):
+    """Values for inference.api_base_urls that send every client to a mock server."""
+    return {
+        "openai": f"http://{host}:{port}/v1",
+        "anthropic": f"http://{host}:{port}",
+        "openrouter": f"http://{host}:{port}/api/v1",
+        "google": f"http://{host}:{port}/v1beta",
+    }
+
+def message_parts(content):
+    """The first text, the last image and a rough prompt token count of a chat or Messages API content list."""
+    prompt, image, tokens = None, None, 0
+    for part in content:
+        if part.get("type") == "text":
+            prompt = part["text"] if prompt is None else prompt
+            tokens += len(part["text"]) // 4
+        elif part.get("type") == "image_url":
+            image = part["image_url"]["url"]
+            tokens += 1105
+        elif part.get("type") == "image":
+            image = part["source"]["data"]
+            tokens += 1105
+    return prompt, image, tokens
+
+def chat_completion(body, bad=False):
+    """An OpenAI-style chat completion answering a chat completions request body."""
+    prompt, image, tokens = message_parts(body["messages"][-1]["content"])
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": mock_answer(prompt, image, bad)}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": tokens, "completion_tokens": 8, "total_tokens": tokens + 8},
+    }
+
+def gemini_parts(parts):
+    """The first text, the last image and a rough prompt token count of Gemini content parts."""
+    prompt, image, tokens = None, None, 0
+    for part in parts:
+        if "text" in part:
+            prompt = part["text"] if prompt is None else prompt
+            tokens += len(part["text"]) // 4
+        elif "inline_data" in part:
+            image = part["inline_data"]["data"]
+            tokens += 258
+    return prompt, image, tokens
+
+def claude_message(body, bad=False, cached_tokens=0, cache_write_tokens=0):
+    """
+    An Anthropic Messages API response answering a request's parameters, with
+    `cached_tokens` read from and `cache_write_tokens` written to the prompt cache.
+    """
+    prompt, image, tokens = message_parts(body["messages"][-1]["content"])
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model"),
+        "content": [{"type": "text", "text": mock_answer(prompt, image, bad)}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": tokens - cached_tokens - cache_write_tokens,
+            "output_tokens": 8,
+            "cache_creation_input_tokens": cache_write_tokens,
+            "cache_read_input_tokens": cached_tokens,
+        },
+    }
+
+def gemini_response(parts, bad=False, cached=None):
+    """A generateContent response answering `parts`, following the `cached` content if the request named one."""
+    prompt, image, tokens = gemini_parts(parts)
+    cached_tokens = 0
+    if cached is not None:
+        prompt = cached["prompt"] if cached["prompt"] is not None else prompt
+        cached_tokens = cached["tokens"]
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": mock_answer(prompt, image, bad)}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": tokens + cached_tokens, "cachedContentTokenCount": cached_tokens, "candidatesTokenCount": 8},
+    }
+
+def request_images(vendor, body):
+    if vendor == "google":
+        parts = [part for content in body["contents"] for part in content["parts"]]
+        return sum("inline_data" in part for part in parts)
+    content = body["messages"][-1]["content"]
+    return sum(part.get("type") in ("image", "image_url") for part in content)
+
+
+class MockVendorServer:
+    """
+    Local stand-in for the vendor APIs, so the pipeline can be exercised and
+    benchmarked without credentials.
+
+    It serves the four synchronous endpoints the clients in inference.py call:
+    OpenAI and OpenRouter chat completions, Anthropic messages (with prompt
+    caching), and Gemini generateContent (with cachedContents). Each answer is
+    delayed by a latency drawn from `latency_settings`. Requests are admitted
+    against `vendor_rate_limits`, faults are injected per `fault_settings`, and
+    every response carries the vendor's rate-limit headers.
+
+    It also implements the OpenAI Files and Batch endpoints and the Anthropic
+    Message Batches endpoints; every batch finishes `batch_delay` seconds after
+    it was created. GET /mock/stats returns the count of each status returned
+    per vendor.
+    """
+    def __init__(self, batch_delay=None, latency=None, faults=None, rate_limits=None, seed=None):
+        self.batch_delay = globals()["batch_delay"] if batch_delay is None else batch_delay
+        self.latency = {**latency_settings, **(latency or {})}
+        self.faults = {**fault_settings, **(faults or {})}
+        self.rate_limits = {**vendor_rate_limits, **(rate_limits or {})}
+        self.random = random.Random(seed)
+        self.buckets = {vendor: [float(limit), time.monotonic()] for vendor, limit in self.rate_limits.items()}
+        self.prompt_caches = {}
+        self.cached_contents = {}
+        self.counts = {}
+        # Requests per vendor currently waiting out their latency, and the most at once
+        self.in_flight = {}
+        self.peak_in_flight = {}
+        self.files = {}
+        self.batches = {}
+        self.runner = None
+
+    def app(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/v1/chat/completions", self.openai_chat)
+        app.router.add_post("/api/v1/chat/completions", self.openrouter_chat)
+        app.router.add_post("/v1/messages", self.anthropic_messages)
+        app.router.add_post("/v1beta/models/{call}", self.gemini_generate)
+        app.router.add_post("/v1beta/cachedContents", self.gemini_create_cache)
+        app.router.add_delete("/v1beta/cachedContents/{cache_id}", self.gemini_delete_cache)
+        app.router.add_get("/mock/stats", self.stats)
+        app.router.add_post("/v1/files", self.openai_upload_file)
+        app.router.add_get("/v1/files/{file_id}/content", self.openai_file_content)
+        app.router.add_post("/v1/batches", self.openai_create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.openai_get_batch)
+        app.router.add_post("/v1/messages/batches", self.anthropic_create_batch)
+        app.router.add_get("/v1/messages/batches/{batch_id}", self.anthropic_get_batch)
+        app.router.add_get("/v1/messages/batches/{batch_id}/results", self.anthropic_batch_results)
+        return app
+
+    async def start(self, host=mock_host, port=mock_port):
+        """Start listening; with port 0 a free port is picked. Returns the server's base URL."""
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return "http://%s:%d" % self.runner.addresses[0][:2]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def finished(self, batch):
+        return time.time() - batch["created"] >= self.batch_delay
+
+    # Synchronous endpoints
+
+    async def respond(self, request, vendor, answer):
+        """
+        Answer a request with `answer(body, bad)` after the vendor's latency, unless
+        it is over the vendor's rate limit or is picked for an injected fault.
+        """
+        body = await request.json()
+        admitted = self.admit(vendor)
+        headers = self.rate_limit_headers(vendor)
+        draw = self.random.random()
+        if not admitted or draw < self.faults["rate_limit"]:
+            retry_after = self.faults["retry_after"] if admitted else 60 / self.rate_limits[vendor]
+            headers["Retry-After"] = f"{retry_after:g}"
+            return self.reply(vendor, {"error": {"type": "rate_limit_error", "message": "Rate limit exceeded"}}, 429, headers)
+        draw -= self.faults["rate_limit"]
+        if draw < self.faults["server_error"]:
+            await asyncio.sleep(self.response_latency(vendor, 0) / 2)
+            status = self.random.choice((500, 502, 503))
+            return self.reply(vendor, {"error": {"type": "api_error", "message": "Injected server error"}}, status, headers)
+        draw -= self.faults["server_error"]
+        result = answer(body, draw < self.faults["bad_answer"])
+        if isinstance(result, web.Response):
+            return result
+        self.in_flight[vendor] = self.in_flight.get(vendor, 0) + 1
+        self.peak_in_flight[vendor] = max(self.peak_in_flight.get(vendor, 0), self.in_flight[vendor])
+        try:
+            await asyncio.sleep(self.response_latency(vendor, request_images(vendor, body)))
+        finally:
+            self.in_flight[vendor] -= 1
+        return self.reply(vendor, result, 200, headers)
+
+    def reply(self, vendor, payload, status, headers):
+        key = f"{vendor} {status}"
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return web.json_response(payload, status=status, headers=headers)
+
+    def response_latency(self, vendor, images):
+        settings = self.latency[vendor]
+        seconds = settings["median"] * math.exp(settings["sigma"] * self.random.gauss(0, 1)) + settings["per_image"] * images
+        return min(seconds, settings["max"])
+
+    def admit(self, vendor):
+        """Take one request from the vendor's per-minute budget, if any is left."""
+        bucket = self.buckets[vendor]
+        now = time.monotonic()
+        limit = self.rate_limits[vendor]
+        bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit / 60)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def rate_limit_headers(self, vendor):
+        """The remaining request budget in the vendor's own header format."""
+        limit = self.rate_limits[vendor]
+        remaining = int(self.buckets[vendor][0])
+        reset = (limit - self.buckets[vendor][0]) * 60 / limit
+        if vendor == "openai":
+            return {"x-ratelimit-limit-requests": str(limit), "x-ratelimit-remaining-requests": str(remaining), "x-ratelimit-reset-requests": f"{reset:.3f}s"}
+        if vendor == "anthropic":
+            reset_at = datetime.fromtimestamp(time.time() + reset, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            return {"anthropic-ratelimit-requests-limit": str(limit), "anthropic-ratelimit-requests-remaining": str(remaining), "anthropic-ratelimit-requests-reset": reset_at}
+        if vendor == "openrouter":
+            return {"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset": str(int((time.time() + reset) * 1000))}
+        return {}
+
+    async def openai_chat(self, request):
+        return await self.respond(request, "openai", chat_completion)
+
+    async def openrouter_chat(self, request):
+        return await self.respond(request, "openrouter", chat_completion)
+
+    async def anthropic_messages(self, request):
+        return await self.respond(request, "anthropic", self.cached_claude_message)
+
+    def cached_claude_message(self, body, bad):
+        """Answer a Messages API request, reading or writing the prefix up to its last cache_control breakpoint."""
+        content = body["messages"][-1]["content"]
+        breakpoints = [n for n, part in enumerate(content) if "cache_control" in part]
+        if not breakpoints:
+            return claude_message(body, bad)
+        prefix = [{k: v for k, v in part.items() if k != "cache_control"} for part in content[:breakpoints[-1] + 1]]
+        tokens = message_parts(prefix)[2]
+        key = hashlib.sha256(json.dumps(prefix, sort_keys=True).encode('utf-8')).hexdigest()
+        if key in self.prompt_caches:
+            return claude_message(body, bad, cached_tokens=tokens)
+        self.prompt_caches[key] = tokens
+        return claude_message(body, bad, cache_write_tokens=tokens)
+
+    async def gemini_generate(self, request):
+        def answer(body, bad):
+            cached = None
+            if "cachedContent" in body:
+                cached = self.cached_contents.get(body["cachedContent"])
+                if cached is None:
+                    return self.reply("google", {"error": {"code": 404, "message": f"{body['cachedContent']} not found"}}, 404, {})
+            return gemini_response(body["contents"][-1]["parts"], bad, cached)
+        return await self.respond(request, "google", answer)
+
+    async def gemini_create_cache(self, request):
+        body = await request.json()
+        prompt, _, tokens = gemini_parts(body["contents"][-1]["parts"])
+        name = f"cachedContents/{uuid.uuid4().hex}"
+        self.cached_contents[name] = {"prompt": prompt, "tokens": tokens}
+        return web.json_response({"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": tokens}})
+
+    async def gemini_delete_cache(self, request):
+        self.cached_contents.pop(f"cachedContents/{request.match_info['cache_id']}", None)
+        return web.json_response({})
+
+    async def stats(self, request):
+        return web.json_response(self.counts)
+
+    # OpenAI Files and Batch API
+
+    async def openai_upload_file(self, request):
+        form = await request.post()
+        upload = form["file"]
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = upload.file.read()
+        return web.json_response({"id": file_id, "object": "file", "bytes": len(self.files[file_id]), "purpose": form.get("purpose")})
+
+    async def openai_file_content(self, request):
+        file_id = request.match_info["file_id"]
+        if file_id not in self.files:
+            return web.json_response({"error": {"message": f"No such file: {file_id}"}}, status=404)
+        return web.Response(body=self.files[file_id], content_type="application/jsonl")
+
+    async def openai_create_batch(self, request):
+        body = await request.json()
+        if body.get("input_file_id") not in self.files:
+            return web.json_response({"error": {"message": "input_file_id not found"}}, status=400)
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = {"vendor": "openai", "created": time.time(), "input_file_id": body["input_file_id"], "output_file_id": None}
+        return web.json_response(self.openai_batch(batch_id))
+
+    async def openai_get_batch(self, request):
+        batch_id = request.match_info["batch_id"]
+        if batch_id not in self.batches:
+            return web.json_response({"error": {"message": f"No such batch: {batch_id}"}}, status=404)
+        return web.json_response(self.openai_batch(batch_id))
+
+    def openai_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        lines = self.files[batch["input_file_id"]].splitlines()
+        if self.finished(batch) and batch["output_file_id"] is None:
+            output = []
+            for line in lines:
+                job = json.loads(line)
+                response = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": chat_completion(job["body"])}
+                output.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": job["custom_id"], "response": response, "error": None}))
+            batch["output_file_id"] = f"file-{uuid.uuid4().hex}"
+            self.files[batch["output_file_id"]] = "\n".join(output).encode('utf-8')
+        done = batch["output_file_id"] is not None
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file_id": batch["input_file_id"],
+            "status": "completed" if done else "in_progress",
+            "output_file_id": batch["output_file_id"],
+            "error_file_id": None,
+            "request_counts": {"total": len(lines), "completed": len(lines) if done else 0, "failed": 0},
+        }
+
+    # Anthropic Message Batches API
+
+    async def anthropic_create_batch(self, request):
+        body = await request.json()
+        batch_id = f"msgbatch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = {"vendor": "anthropic", "created": time.time(), "requests": body["requests"]}
+        return web.json_response(self.anthropic_batch(batch_id, request))
+
+    async def anthropic_get_batch(self, request):
+        batch_id = request.match_info["batch_id"]
+        if batch_id not in self.batches:
+            return web.json_response({"type": "error", "error": {"type": "not_found_error", "message": batch_id}}, status=404)
+        return web.json_response(self.anthropic_batch(batch_id, request))
+
+    async def anthropic_batch_results(self, request):
+        batch_id = request.match_info["batch_id"]
+        batch = self.batches.get(batch_id)
+        if batch is None or not self.finished(batch):
+            return web.json_response({"type": "error", "error": {"type": "not_found_error", "message": batch_id}}, status=404)
+        lines = [
+            json.dumps({"custom_id": job["custom_id"], "result": {"type": "succeeded", "message": claude_message(job["params"])}})
+            for job in batch["requests"]
+        ]
+        return web.Response(body="\n".join(lines).encode('utf-8'), content_type="application/jsonl")
+
+    def anthropic_batch(self, batch_id, request):
+        batch = self.batches[batch_id]
+        done = self.finished(batch)
+        count = len(batch["requests"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if done else "in_progress",
+            "request_counts": {"processing": 0 if done else count, "succeeded": count if done else 0, "errored": 0, "canceled": 0, "expired": 0},
+            "results_url": f"{request.scheme}://{request.host}/v1/messages/batches/{batch_id}/results" if done else None,
+        }
+
+
+class MockZenodoServer:
+    """
+    Local stand-in for the Zenodo records API that data_loader.download_zenodo
+    reads; point data_loader.zenodo_api at `<base URL>/api`.
+
+    `records` maps a record id to its files ({filename: bytes}). Files are served
+    with HTTP Range support (206, or 416 past the end) and their md5 checksum,
+    unless `checksums` ({filename: "md5:<hex>"}) reports another one. Faults
+    queued with `fail` are used up one per request of that file, in order.
+    Every file request is logged in `requests` as (filename, Range header, status).
+    """
+    def __init__(self, records=None, checksums=None):
+        self.records = records or {}
+        self.checksums = checksums or {}
+        self.faults = {}
+        self.requests = []
+        self.runner = None
+
+    def fail(self, filename, *faults):
+        """
+        Queue faults for the next requests of `filename`: {"status": 503} answers
+        with that status, {"interrupt": n} drops the connection after n bytes.
+        """
+        self.faults.setdefault(filename, []).extend(faults)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/records/{record_id}", self.record)
+        app.router.add_get("/api/records/{record_id}/files/{filename}/content", self.file_content)
+        return app
+
+    async def start(self, host=mock_host, port=mock_port):
+        """Start listening; with port 0 a free port is picked. Returns the server's base URL."""
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return "http://%s:%d" % self.runner.addresses[0][:2]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def record(self, request):
+        record_id = request.match_info["record_id"]
+        if record_id not in self.records:
+            return web.json_response({"status": 404, "message": "PID does not exist."}, status=404)
+        base_url = f"{request.scheme}://{request.host}/api/records/{record_id}/files"
+        return web.json_response({"id": record_id, "files": [
+            {
+                "key": filename,
+                "size": len(data),
+                "checksum": self.checksums.get(filename, f"md5:{hashlib.md5(data).hexdigest()}"),
+                "links": {"self": f"{base_url}/{filename}/content"},
+            }
+            for filename, data in self.records[record_id].items()
+        ]})
+
+    async def file_content(self, request):
+        filename = request.match_info["filename"]
+        data = self.records.get(request.match_info["record_id"], {}).get(filename)
+        range_header = request.headers.get("Range")
+        if data is None:
+            return self.log(filename, range_header, web.json_response({"status": 404, "message": "File not found."}, status=404))
+        fault = self.faults[filename].pop(0) if self.faults.get(filename) else {}
+        if "status" in fault:
+            return self.log(filename, range_header, web.json_response({"status": fault["status"], "message": "Injected error"}, status=fault["status"]))
+
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", range_header or "")
+        if match:
+            start = int(match.group(1))
+            if start >= len(data):
+                return self.log(filename, range_header, web.Response(status=416, headers={"Content-Range": f"bytes */{len(data)}"}))
+        status = 206 if match else 200
+        headers = {"Content-Length": str(len(data) - start), "Accept-Ranges": "bytes"}
+        if match:
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+        response = web.StreamResponse(status=status, headers=headers)
+        self.log(filename, range_header, response)
+        await response.prepare(request)
+        if "interrupt" in fault:
+            await response.write(data[start:start + fault["interrupt"]])
+            # Close mid-body, so the client sees fewer bytes than Content-Length
+            request.transport.close()
+            return response
+        await response.write(data[start:])
+        await response.write_eof()
+        return response
+
+    def log(self, filename, range_header, response):
+        self.requests.append((filename, range_header, response.status))
+        return response
+
+
+async def serve(host=mock_host, port=mock_port, **settings):
+    """Run a MockVendorServer (keyword arguments as for MockVendorServer) until cancelled."""
+    server = MockVendorServer(**settings)
+    await server.start(host, port)
+    print(f"Mock vendor server listening on http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
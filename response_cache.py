@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+
+
+def _digest(data):
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def request_key(vendor, model, inputs, params=None):
+    """
+    Canonical hash of a request: vendor, model, prompt, the example texts, the
+    sha256 of every image (rather than its base64) and the generation parameters.
+    Requests that would send the same bytes to the same model get the same key.
+    """
+    examples = []
+    for example in inputs['examples']:
+        if 'text' in example:
+            examples.append(["text", example['text']])
+        elif 'image_url' in example:
+            examples.append(["image", _digest(example['image_url']['url'].split(',', 1)[-1]), example['image_url'].get('detail')])
+        elif 'source' in example:
+            examples.append(["image", _digest(example['source']['data'])])
+    canonical = {
+        "vendor": vendor,
+        "model": model,
+        "prompt": inputs['prompt'],
+        "image": _digest(inputs['image']),
+        "examples": examples,
+        "params": params or {},
+    }
+    return _digest(json.dumps(canonical, sort_keys=True, separators=(',', ':')))
+
+
+class ResponseCache:
+    """
+    On-disk store of model responses keyed by `request_key`, in one SQLite file.
+
+    Responses are stored zlib-compressed. Once their total size exceeds
+    `max_bytes`, the least recently used ones are evicted down to 90% of it.
+    With `refresh`, lookups always miss, so every request is sent again and its
+    fresh response replaces the stored one.
+    """
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, refresh=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                used REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, valid=None):
+        """
+        The stored response for `key`, or None. A stored response that `valid`
+        rejects counts as a miss and is deleted, so the request is sent again.
+        """
+        row = None if self.refresh else self.connection.execute("SELECT response, size FROM responses WHERE key = ?", (key,)).fetchone()
+        response = None if row is None else zlib.decompress(row[0]).decode('utf-8')
+        if response is not None and valid is not None and not valid(response):
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.connection.commit()
+            self.total_bytes -= row[1]
+            response = None
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Committed with the next put or on close; losing it only ages the entry
+        self.connection.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+        return response
+
+    def put(self, key, response):
+        blob = zlib.compress(response.encode('utf-8'))
+        previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+        self.total_bytes += len(blob) - (previous[0] if previous else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+        self.connection.commit()
+
+    def evict(self, target_bytes):
+        """Delete least recently used responses until at most `target_bytes` remain."""
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY used"):
+            if self.total_bytes <= target_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes,
+        }
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,273 @@
+import os
+import ast
+import json
+import time
+import sqlite3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_loader import resolve_path, stored_path
+
+
+# One row per (dataset, model, shots, sample). Paths and labels are dictionary
+# encoded, and few-shot examples are stored as indices into the dataset's samples
+# rather than repeating their paths and labels on every row.
+RESULTS_SCHEMA = pa.schema([
+    ("dataset", pa.dictionary(pa.int32(), pa.string())),
+    ("model", pa.dictionary(pa.int32(), pa.string())),
+    ("shots", pa.int8()),
+    ("sample", pa.int32()),
+    ("image_path", pa.dictionary(pa.int32(), pa.string())),
+    ("label", pa.dictionary(pa.int32(), pa.string())),
+    ("prediction", pa.string()),
+    ("example_indices", pa.list_(pa.int32())),
+])
+
+
+class CheckpointStore:
+    """
+    Durable per-(dataset, model, shots, sample) record of predictions.
+
+    Every finished `process_image` call is committed here immediately, so a
+    crash or Ctrl-C loses at most the requests that were in flight. A resumed
+    run restores these cells and only sends requests for the rest. Rows are
+    matched on the image path as well as the sample index, so a checkpoint
+    never leaks into a run whose sampling has changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS predictions (
+                dataset TEXT NOT NULL,
+                model TEXT NOT NULL,
+                shots INTEGER NOT NULL,
+                sample INTEGER NOT NULL,
+                image_path TEXT NOT NULL,
+                prediction TEXT,
+                example_paths TEXT,
+                example_categories TEXT,
+                updated REAL,
+                PRIMARY KEY (dataset, model, shots, sample)
+            )
+        """)
+        self.connection.commit()
+
+    def record(self, dataset, model, shots, sample, image_path, prediction, example_paths, example_categories):
+        """
+        Store one cell; example lists are kept as JSON, 'NA' marks a failed
+        request. Paths are stored relative to the repository (see `stored_path`).
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                dataset, model, int(shots), int(sample), stored_path(image_path),
+                None if prediction is None else str(prediction),
+                json.dumps([stored_path(p) for p in example_paths]) if isinstance(example_paths, list) else example_paths,
+                json.dumps(example_categories, default=str) if isinstance(example_categories, list) else example_categories,
+                time.time(),
+            ),
+        )
+        self.connection.commit()
+
+    def load(self, dataset, model):
+        """Return the stored cells of one (dataset, model) run as a DataFrame."""
+        return pd.read_sql_query(
+            "SELECT shots, sample, image_path, prediction, example_paths, example_categories "
+            "FROM predictions WHERE dataset = ? AND model = ?",
+            self.connection, params=(dataset, model),
+        )
+
+    def restore(self, all_data_results, dataset, model, shots):
+        """
+        Copy non-NA stored predictions into `all_data_results` and return, per shot
+        count, the sample indices that still need a request.
+        """
+        stored = self.load(dataset, model)
+        stored = stored[stored["prediction"].notna() & (stored["prediction"] != 'NA')]
+        pending = {}
+        for number_of_shots in shots:
+            done = set()
+            for row in stored[stored["shots"] == number_of_shots].itertuples(index=False):
+                i = row.sample
+                if i >= len(all_data_results) or not _same_path(all_data_results.at[i, "0"], row.image_path):
+                    continue
+                all_data_results.at[i, f"# of Shots {number_of_shots}"] = row.prediction
+                all_data_results.at[i, f"Example Paths {number_of_shots}"] = _legacy_list(row.example_paths)
+                all_data_results.at[i, f"Example Categories {number_of_shots}"] = _legacy_list(row.example_categories)
+                done.add(i)
+            pending[number_of_shots] = [i for i in range(len(all_data_results)) if i not in done]
+        return pending
+
+    def import_csv(self, csv_path, dataset, model):
+        """
+        Seed the store from an existing results/<model>/<dataset>.csv so a rerun
+        only sends requests for its NA cells. Cells already in the store win.
+        """
+        existing = pd.read_csv(csv_path, index_col=0, dtype=str, keep_default_na=False, engine='python')
+        stored = self.load(dataset, model)
+        have = set(zip(stored["shots"], stored["sample"]))
+        imported = 0
+        for column in existing.columns:
+            if not column.startswith("# of Shots "):
+                continue
+            number_of_shots = int(column[len("# of Shots "):])
+            for i, row in existing.iterrows():
+                prediction = row[column]
+                if (number_of_shots, int(i)) in have or prediction in ('', 'NA'):
+                    continue
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        dataset, model, number_of_shots, int(i), row["0"], prediction,
+                        row.get(f"Example Paths {number_of_shots}"),
+                        row.get(f"Example Categories {number_of_shots}"),
+                        time.time(),
+                    ),
+                )
+                imported += 1
+        self.connection.commit()
+        return imported
+
+    def close(self):
+        self.connection.close()
+
+
+def long_results(stored, all_data, dataset, model, shots):
+    """
+    Build the typed long-format results of one (dataset, model) run from its
+    checkpoint rows (`CheckpointStore.load`). Rows whose image path no longer
+    matches the sample are dropped; failed cells have a null prediction, and
+    null example indices if the request never got as far as sending examples.
+    Image paths are written relative to the repository (see `stored_path`).
+    """
+    paths = list(all_data[0])
+    index_of = {resolve_path(path): i for i, path in enumerate(paths)}
+    stored = stored[stored["shots"].isin(shots)].set_index(["shots", "sample"])
+    rows = []
+    for number_of_shots in shots:
+        for i, path in enumerate(paths):
+            prediction, example_indices = None, None
+            if (number_of_shots, i) in stored.index:
+                row = stored.loc[(number_of_shots, i)]
+                if _same_path(row["image_path"], path):
+                    if row["prediction"] not in (None, 'NA'):
+                        prediction = row["prediction"]
+                    # A response that could not be parsed still has the examples it was sent
+                    if row["example_paths"] not in (None, 'NA', ''):
+                        example_indices = [index_of[resolve_path(p)] for p in _parse_list(row["example_paths"])]
+            rows.append((number_of_shots, i, prediction, example_indices))
+
+    frame = pd.DataFrame(rows, columns=["shots", "sample", "prediction", "example_indices"])
+    frame.insert(0, "dataset", dataset)
+    frame.insert(1, "model", model)
+    frame.insert(4, "image_path", [stored_path(paths[i]) for i in frame["sample"]])
+    frame.insert(5, "label", [str(all_data.at[i, 1]) for i in frame["sample"]])
+    return frame
+
+def write_results(frame, path):
+    """Write long-format results (see `long_results`) as a Parquet file."""
+    frame = frame.astype({"dataset": "category", "model": "category", "image_path": "category", "label": "category"})
+    table = pa.Table.from_pandas(frame, schema=RESULTS_SCHEMA, preserve_index=False)
+    pq.write_table(table, path, compression="zstd")
+
+def read_results(paths):
+    """Read one or more long-format Parquet results files into a single DataFrame."""
+    if isinstance(paths, str):
+        paths = [paths]
+    frames = [pq.read_table(path).to_pandas() for path in paths]
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def to_legacy_frame(frame):
+    """
+    Rebuild the wide layout of results/<model>/<dataset>.csv (columns "0", "1",
+    then "# of Shots N", "Example Paths N" and "Example Categories N" per shot
+    count) from the long results of one (dataset, model) run.
+    """
+    first_shots = frame[frame["shots"] == frame["shots"].iloc[0]].sort_values("sample")
+    paths = first_shots["image_path"].astype(str).tolist()
+    labels = [_restore_label(label) for label in first_shots["label"].astype(str)]
+    legacy = pd.DataFrame({"0": paths, "1": labels})
+    for number_of_shots in pd.unique(frame["shots"]):
+        cells = frame[frame["shots"] == number_of_shots].sort_values("sample")
+        predictions, example_paths, example_categories = [], [], []
+        for prediction, example_indices in zip(cells["prediction"], cells["example_indices"]):
+            predictions.append('NA' if prediction is None else prediction)
+            if example_indices is None:
+                # Failed requests are marked NA; cells older runs left empty stay empty
+                missing = 'NA' if prediction is None else ''
+                example_paths.append(missing)
+                example_categories.append(missing)
+            else:
+                example_paths.append(str([paths[j] for j in example_indices]))
+                example_categories.append(str([labels[j] for j in example_indices]))
+        legacy[f"# of Shots {number_of_shots}"] = predictions
+        legacy[f"Example Paths {number_of_shots}"] = example_paths
+        legacy[f"Example Categories {number_of_shots}"] = example_categories
+    return legacy
+
+def export_legacy_csv(parquet_path, csv_path):
+    """Write a Parquet results file back out in the legacy CSV layout."""
+    to_legacy_frame(read_results(parquet_path)).to_csv(csv_path)
+
+def convert_legacy_csv(csv_path, dataset, model):
+    """Convert an existing legacy results CSV into the long format (parses its stringified lists once)."""
+    legacy = pd.read_csv(csv_path, index_col=0, dtype=str, keep_default_na=False, engine='python')
+    all_data = pd.DataFrame({0: legacy["0"].tolist(), 1: legacy["1"].tolist()})
+    shots = [int(column[len("# of Shots "):]) for column in legacy.columns if column.startswith("# of Shots ")]
+    stored = pd.concat([
+        pd.DataFrame({
+            "shots": number_of_shots,
+            "sample": range(len(legacy)),
+            "image_path": legacy["0"].tolist(),
+            "prediction": legacy[f"# of Shots {number_of_shots}"].tolist(),
+            "example_paths": legacy[f"Example Paths {number_of_shots}"].tolist(),
+        })
+        for number_of_shots in shots
+    ], ignore_index=True)
+    return long_results(stored, all_data, dataset, model, shots)
+
+def convert_results_dir(results_dir="results"):
+    """Write a long-format <dataset>.parquet next to every legacy results/<model>/<dataset>.csv."""
+    for model in sorted(os.listdir(results_dir)):
+        model_dir = os.path.join(results_dir, model)
+        if not os.path.isdir(model_dir):
+            continue
+        for filename in sorted(os.listdir(model_dir)):
+            if filename.endswith(".csv"):
+                dataset = filename[:-len(".csv")]
+                write_results(convert_legacy_csv(os.path.join(model_dir, filename), dataset, model), os.path.join(model_dir, f"{dataset}.parquet"))
+                print(f"Converted {os.path.join(model_dir, filename)}")
+
+def _parse_list(value):
+    """Parse an example list stored as JSON, or as str(list) by older runs."""
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return ast.literal_eval(value)
+
+def _same_path(a, b):
+    """Whether two image paths, absolute as loaded or relative to the repository as stored, name the same file."""
+    return a == b or resolve_path(a) == resolve_path(b)
+
+def _restore_label(label):
+    """Labels are stored as strings; quantification and rating labels are whole numbers."""
+    try:
+        return int(label)
+    except ValueError:
+        return label
+
+def _legacy_list(value):
+    """Render a stored example list the way the results CSVs always have: str(list)."""
+    try:
+        return str(json.loads(value))
+    except (TypeError, ValueError):
+        return value
+
+
+if __name__ == "__main__":
+    convert_results_dir()
@@ -0,0 +1,55 @@
+import os
+import sys
+import asyncio
+import threading
+import pytest
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def serve_in_thread():
+    """
+    Start mock servers on an event loop in a background thread, for code under
+    test that makes blocking requests. Returns a function that starts a server
+    on a free port and returns its base URL; the servers stop after the test.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def serve(server):
+        servers.append(server)
+        return asyncio.run_coroutine_threadsafe(server.start("127.0.0.1", 0), loop).result()
+
+    yield serve
+    for server in servers:
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def vendor_server(serve_in_thread, monkeypatch):
+    """
+    A mock_server.MockVendorServer without latency or injected faults, with
+    inference.api_base_urls pointed at it and fast retries.
+    """
+    import inference
+    import mock_server
+
+    server = mock_server.MockVendorServer(
+        batch_delay=0.5,
+        latency={vendor: {"median": 0.01, "sigma": 0.0, "per_image": 0.0, "max": 0.01} for vendor in mock_server.latency_settings},
+        faults={"rate_limit": 0.0, "server_error": 0.0, "bad_answer": 0.0},
+        seed=0,
+    )
+    host, port = serve_in_thread(server)[len("http://"):].split(":")
+    monkeypatch.setattr(inference, "api_base_urls", mock_server.mock_base_urls(host, int(port)))
+    monkeypatch.setitem(inference.retry_settings, "base_delay", 0.01)
+    for variable in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "OPENROUTER_API_KEY", "GOOGLE_API_KEY"):
+        monkeypatch.setenv(variable, "test-key")
+    return server
@@ -0,0 +1,92 @@
+import os
+import json
+import asyncio
+import pandas as pd
+import pytest
+from PIL import Image
+import batch
+import inference
+from few_shot import FewShotTable
+from results_store import CheckpointStore
+
+
+CLASSES = ["Healthy", "Rust"]
+SHOTS = [2, 0]
+MODELS = [
+    {"vendor": "openai", "model": "gpt-4o-2024-05-13", "model_name": "GPT-4o"},
+    {"vendor": "anthropic", "model": "claude-3-haiku-20240307", "model_name": "Claude-3-haiku"},
+]
+
+
+class Killed(Exception):
+    pass
+
+
+@pytest.fixture
+def batch_run(vendor_server, tmp_path, monkeypatch):
+    """A batch run of two models over a six-image dataset, in `tmp_path`."""
+    paths = []
+    for n in range(6):
+        path = str(tmp_path / f"image{n}.png")
+        Image.new('RGB', (32, 32), (40 * n, 120, 80)).save(path)
+        paths.append(path)
+    all_data = pd.DataFrame({0: paths, 1: [CLASSES[n % 2] for n in range(6)]})
+    prompt = inference.universal_prompt.format(expected_classes=CLASSES)
+    examples = FewShotTable.draw("Tiny", all_data, max(SHOTS))
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(inference, "load_datasets", lambda: [(all_data, "Tiny", prompt, SHOTS, examples)])
+    monkeypatch.setattr(inference, "all_vendors_models", MODELS)
+    monkeypatch.setattr(inference, "checkpoint_path", str(tmp_path / "checkpoint.sqlite"))
+    monkeypatch.setattr(inference, "image_workers", None)
+    monkeypatch.setattr(batch, "batch_dir", str(tmp_path / "batches"))
+    monkeypatch.setattr(batch, "batch_poll_interval", 0.1)
+    return all_data, examples
+
+def checkpoint_cells(model):
+    checkpoint = CheckpointStore(inference.checkpoint_path)
+    try:
+        return checkpoint.load("Tiny", model)
+    finally:
+        checkpoint.close()
+
+def check_cells(all_data, examples):
+    for vendor_model in MODELS:
+        cells = checkpoint_cells(vendor_model["model_name"]).set_index(["shots", "sample"])
+        assert len(cells) == len(all_data) * len(SHOTS)
+        for (number_of_shots, i), cell in cells.iterrows():
+            assert cell["prediction"] in CLASSES
+            assert cell["image_path"] == all_data[0][i]
+            assert json.loads(cell["example_paths"]) == [all_data[0][j] for j in examples.examples(i, number_of_shots)]
+        assert os.path.exists(os.path.join("results", vendor_model["model_name"], "Tiny.parquet"))
+
+
+def test_submit_poll_collect(batch_run, vendor_server):
+    all_data, examples = batch_run
+    asyncio.run(batch.main())
+
+    check_cells(all_data, examples)
+    assert sorted(job["vendor"] for job in vendor_server.batches.values()) == ["anthropic", "openai"]
+    state = batch.BatchState(os.path.join(batch.batch_dir, "state.json"))
+    assert len(state.batches) == 2 and not state.open_batches()
+
+def test_resume_does_not_submit_again(batch_run, vendor_server, monkeypatch):
+    all_data, examples = batch_run
+    batch_outputs = batch.batch_outputs
+
+    async def killed(api, open_batch):
+        raise Killed
+    # The run stops once its batches are submitted, before any is collected
+    monkeypatch.setattr(batch, "batch_outputs", killed)
+    with pytest.raises(Killed):
+        asyncio.run(batch.main())
+    submitted = set(vendor_server.batches)
+    assert len(submitted) == 2
+    assert checkpoint_cells("GPT-4o").empty
+
+    monkeypatch.setattr(batch, "batch_outputs", batch_outputs)
+    asyncio.run(batch.main())
+
+    # The rerun collects the batches of the first run instead of submitting new ones
+    assert set(vendor_server.batches) == submitted
+    check_cells(all_data, examples)
@@ -0,0 +1,29 @@
+import asyncio
+import time
+from inference import create_api
+
+
+PROMPT = "Given the image, identify the class. It should be one of the : ['Healthy', 'Rust']."
+LATENCY = 0.3
+
+
+def test_claude_requests_run_concurrently(vendor_server):
+    vendor_server.latency["anthropic"] = {"median": LATENCY, "sigma": 0.0, "per_image": 0.0, "max": LATENCY}
+
+    async def scenario():
+        api = create_api("anthropic", "claude-3-haiku-20240307")
+        try:
+            started = time.monotonic()
+            responses = await asyncio.gather(*[
+                api.get_image_information({"image": f"image-{n}", "examples": [], "prompt": PROMPT})
+                for n in range(4)
+            ])
+            return responses, time.monotonic() - started
+        finally:
+            await api.close()
+
+    responses, elapsed = asyncio.run(scenario())
+    assert all('"prediction"' in response for response in responses)
+    # Sent one after another, the four requests would take 4 * LATENCY
+    assert vendor_server.peak_in_flight["anthropic"] > 1
+    assert elapsed < 3 * LATENCY
@@ -0,0 +1,90 @@
+import os
+import hashlib
+import pytest
+import requests
+import data_loader
+from mock_server import MockZenodoServer
+
+
+DATA = bytes(range(256)) * 40
+
+
+class Progress:
+    """Stands in for the tqdm bar download_file reports to."""
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+
+@pytest.fixture
+def zenodo(serve_in_thread, monkeypatch):
+    server = MockZenodoServer({"123": {"images.zip": DATA, "labels.csv": b"image,label\n"}})
+    monkeypatch.setattr(data_loader, "zenodo_api", serve_in_thread(server) + "/api")
+    monkeypatch.setattr(data_loader, "download_chunk_size", 1024)
+    monkeypatch.setattr(data_loader, "download_retry_delay", 0.0)
+    return server
+
+def file_url(filename):
+    return f"{data_loader.zenodo_api}/records/123/files/{filename}/content"
+
+def md5(data):
+    return f"md5:{hashlib.md5(data).hexdigest()}"
+
+
+def test_resumes_part_file_of_an_earlier_run(zenodo, tmp_path):
+    target = str(tmp_path / "images.zip")
+    with open(f"{target}.part", 'wb') as f:
+        f.write(DATA[:3000])
+    progress = Progress()
+    data_loader.download_file(file_url("images.zip"), target, md5(DATA), progress)
+
+    with open(target, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(f"{target}.part")
+    assert zenodo.requests == [("images.zip", "bytes=3000-", 206)]
+    assert progress.n == len(DATA)
+
+def test_resumes_after_dropped_connection(zenodo, tmp_path):
+    zenodo.fail("images.zip", {"interrupt": 4000})
+    target = str(tmp_path / "images.zip")
+    progress = Progress()
+    data_loader.download_file(file_url("images.zip"), target, md5(DATA), progress)
+
+    with open(target, 'rb') as f:
+        assert f.read() == DATA
+    assert zenodo.requests[0] == ("images.zip", None, 200)
+    assert zenodo.requests[1][1].startswith("bytes=") and zenodo.requests[1][2] == 206
+    # Bytes received before the drop are not counted twice
+    assert progress.n == len(DATA)
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retries_rate_limits_and_server_errors(zenodo, tmp_path, status):
+    zenodo.fail("images.zip", {"status": status}, {"status": status})
+    target = str(tmp_path / "images.zip")
+    data_loader.download_file(file_url("images.zip"), target, md5(DATA))
+
+    with open(target, 'rb') as f:
+        assert f.read() == DATA
+    assert [logged[2] for logged in zenodo.requests] == [status, status, 200]
+
+def test_does_not_retry_missing_file(zenodo, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        data_loader.download_file(file_url("missing.zip"), str(tmp_path / "missing.zip"))
+    assert len(zenodo.requests) == 1
+
+def test_checksum_mismatch_discards_download(zenodo, tmp_path):
+    target = str(tmp_path / "images.zip")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        data_loader.download_file(file_url("images.zip"), target, md5(b"other contents"))
+    assert not os.path.exists(target)
+    assert not os.path.exists(f"{target}.part")
+
+def test_downloads_every_file_of_a_record(zenodo, tmp_path):
+    download_path = str(tmp_path / "record")
+    data_loader.download_zenodo("123", download_path)
+
+    assert sorted(os.listdir(download_path)) == ["images.zip", "labels.csv"]
+    with open(os.path.join(download_path, "images.zip"), 'rb') as f:
+        assert f.read() == DATA
@@ -0,0 +1,17 @@
+import metrics
+
+
+def test_models_keep_the_row_order_of_existing_tables(tmp_path):
+    results_dir = tmp_path / "results"
+    for model in ("GPT-4o", "Claude-3-haiku", "Gemini-pro-1.5", "Aria"):
+        (results_dir / model).mkdir(parents=True)
+    output_dir = tmp_path / "plain-results"
+    output_dir.mkdir()
+    (output_dir / "result_table_shot_0.csv").write_text(",Identification (I)\n,F1\nModel,\nGemini-pro-1.5,1.0\nGPT-4o,2.0\n")
+
+    # Without tables the models are sorted by name, regardless of directory order
+    assert metrics.list_models(str(results_dir)) == ["Aria", "Claude-3-haiku", "GPT-4o", "Gemini-pro-1.5"]
+    # Models already in the tables keep their rows; new ones follow by name
+    order = metrics.table_model_order(str(output_dir))
+    assert metrics.list_models(str(results_dir), order) == ["Gemini-pro-1.5", "GPT-4o", "Aria", "Claude-3-haiku"]
+    assert metrics.table_model_order(str(tmp_path / "missing")) == []
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+import inference
+from inference import PrefixCache, create_api
+
+
+PROMPT = "Given the image, identify the class. It should be one of the : ['Healthy', 'Rust']."
+
+
+def claude_inputs(image, examples=4):
+    parts = []
+    for n in range(examples):
+        parts.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": f"example-{n}"}})
+        parts.append({"type": "text", "text": '{"prediction": "Rust"}'})
+    return {"image": image, "examples": parts, "prompt": PROMPT}
+
+def gemini_inputs(image, examples=4):
+    parts = []
+    for n in range(examples):
+        parts.append({"image_url": {"url": f"data:image/jpeg;base64,example-{n}"}})
+        parts.append({"type": "text", "text": '{"prediction": "Rust"}'})
+    return {"image": image, "examples": parts, "prompt": PROMPT}
+
+
+def test_prefix_is_counted_once_per_queried_image():
+    cache = PrefixCache(min_uses=2)
+    # Retries and rebuilds of one row don't make its prefix repeated
+    assert cache.key(claude_inputs("image-a")) is None
+    assert cache.key(claude_inputs("image-a")) is None
+    key = cache.key(claude_inputs("image-b"))
+    assert key is not None
+    assert cache.key(claude_inputs("image-a")) == key
+
+def test_claude_breakpoint_written_then_read(vendor_server):
+    async def scenario():
+        api = create_api("anthropic", "claude-3-haiku-20240307")
+        try:
+            first = api.build_params(claude_inputs("image-a"))
+            for image in ("image-a", "image-b", "image-c"):
+                await api.get_image_information(claude_inputs(image))
+            return api, first
+        finally:
+            await api.close()
+
+    api, (params, extra_headers) = asyncio.run(scenario())
+    # The first use of a prefix is sent without a breakpoint
+    assert extra_headers is None
+    assert not any("cache_control" in part for part in params["messages"][0]["content"])
+
+    params, extra_headers = api.build_params(claude_inputs("image-d"))
+    content = params["messages"][0]["content"]
+    breakpoints = [n for n, part in enumerate(content) if "cache_control" in part]
+    # One breakpoint, after the last example and before the repeated prompt and queried image
+    assert breakpoints == [len(content) - 3]
+    assert extra_headers == {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+    # image-b wrote the prefix to the cache and image-c read it
+    assert len(vendor_server.prompt_caches) == 1
+    assert api.stats["cache_write_tokens"] > 0
+    assert api.stats["cached_input_tokens"] == api.stats["cache_write_tokens"]
+
+def test_gemini_uploads_prefix_once_and_reuses_it(vendor_server, monkeypatch):
+    monkeypatch.setitem(inference.prompt_cache_settings["google"], "min_tokens", 0)
+
+    async def scenario():
+        api = create_api("google", "gemini-1.5-flash-001")
+        try:
+            await api.get_image_information(gemini_inputs("image-0"))
+            assert vendor_server.cached_contents == {}
+            # Concurrent requests with a repeated prefix share one upload
+            await asyncio.gather(*[api.get_image_information(gemini_inputs(f"image-{n}")) for n in range(1, 9)])
+            uploaded = set(vendor_server.cached_contents)
+            assert len(uploaded) == 1
+            cached_tokens = api.stats["cached_input_tokens"]
+            assert cached_tokens > 0
+
+            # A cache that is gone on the server side is uploaded again
+            vendor_server.cached_contents.clear()
+            await api.get_image_information(gemini_inputs("image-9"))
+            assert len(vendor_server.cached_contents) == 1
+            assert set(vendor_server.cached_contents) != uploaded
+            assert api.stats["cached_input_tokens"] > cached_tokens
+            assert api.stats["failures"] == 0
+        finally:
+            await api.close()
+
+    asyncio.run(scenario())
+    # Closing the client deletes its cached contents
+    assert vendor_server.cached_contents == {}
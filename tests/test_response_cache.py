@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+import inference
+from inference import create_api
+from response_cache import request_key
+
+
+PROMPT = "Given the image, identify the class. It should be one of the : ['Healthy', 'Rust']."
+
+
+def inputs(image):
+    return {"image": image, "examples": [], "prompt": PROMPT}
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference, "response_cache_settings", {**inference.response_cache_settings, "enabled": True, "path": str(tmp_path / "responses.sqlite")})
+    monkeypatch.setattr(inference, "response_cache", None)
+    yield inference.get_response_cache()
+    inference.close_response_cache()
+
+def sent(vendor_server):
+    return vendor_server.counts.get("openai 200", 0)
+
+async def ask(image):
+    api = create_api("openai", "gpt-4o-2024-05-13")
+    try:
+        return await api.get_image_information(inputs(image)), api.stats["cached_responses"]
+    finally:
+        await api.close()
+
+
+def test_unparseable_answers_are_not_cached(vendor_server, response_cache):
+    vendor_server.faults["bad_answer"] = 1.0
+    response, _ = asyncio.run(ask("image-a"))
+    assert not inference.has_prediction(response)
+    assert response_cache.stats()["entries"] == 0
+
+    # Rerunning the NA cell sends the request again, and the parsed answer is kept
+    vendor_server.faults["bad_answer"] = 0.0
+    response, cached = asyncio.run(ask("image-a"))
+    assert inference.has_prediction(response) and cached == 0
+    assert sent(vendor_server) == 2
+    assert response_cache.stats()["entries"] == 1
+
+    response, cached = asyncio.run(ask("image-a"))
+    assert cached == 1
+    assert sent(vendor_server) == 2
+
+def test_stored_unparseable_answers_are_not_served(vendor_server, response_cache):
+    api = create_api("openai", "gpt-4o-2024-05-13")
+    key = request_key(api.vendor, api.model, inputs("image-b"), api.generation_params)
+    response_cache.put(key, "I am unable to determine the class of this image.")
+
+    response, cached = asyncio.run(ask("image-b"))
+    assert inference.has_prediction(response) and cached == 0
+    # The stored NA answer counts as a miss, not a hit, and one request reached the mock
+    assert sum(vendor_server.counts.values()) == 1
+    stats = response_cache.stats()
+    assert stats["hits"] == 0 and stats["misses"] == 1
+    # The fresh answer replaced it
+    assert stats["entries"] == 1
+    assert response_cache.get(key) == response
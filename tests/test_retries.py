@@ -0,0 +1,60 @@
+import asyncio
+import time
+import pytest
+import inference
+from inference import create_api
+
+
+PROMPT = "Given the image, identify the class. It should be one of the : ['Healthy', 'Rust']."
+
+
+def fail_first_attempt(api, vendor_server, fault, on_failure=None):
+    """Turn the mock's `fault` off once the first attempt has been answered."""
+    send_request = api.send_request
+
+    async def send(inputs):
+        try:
+            return await send_request(inputs)
+        except inference.APIError:
+            if on_failure is not None:
+                on_failure()
+            raise
+        finally:
+            vendor_server.faults[fault] = 0.0
+    api.send_request = send
+
+async def ask(api):
+    try:
+        return await api.get_image_information({"image": "image-a", "examples": [], "prompt": PROMPT})
+    finally:
+        await api.close()
+
+
+def test_server_errors_are_retried(vendor_server):
+    vendor_server.faults["server_error"] = 1.0
+    api = create_api("openai", "gpt-4o-2024-05-13")
+    fail_first_attempt(api, vendor_server, "server_error")
+
+    response = asyncio.run(ask(api))
+    assert inference.has_prediction(response)
+    assert api.stats["retries"] == 1 and api.stats["failures"] == 0
+    assert sum(n for key, n in vendor_server.counts.items() if key.startswith("openai 5")) == 1
+    assert vendor_server.counts["openai 200"] == 1
+
+def test_rate_limit_pauses_the_client(vendor_server):
+    vendor_server.faults.update(rate_limit=1.0, retry_after=0.3)
+    api = create_api("openai", "gpt-4o-2024-05-13")
+    pauses = []
+    # Read before RetryPolicy handles the 429, so only update_from_headers has run
+    fail_first_attempt(api, vendor_server, "rate_limit", lambda: pauses.append(api.rate_limiter.blocked_until - time.monotonic()))
+
+    started = time.monotonic()
+    response = asyncio.run(ask(api))
+    assert inference.has_prediction(response)
+    # The Retry-After header paused the limiter, and the retry waited it out
+    assert pauses and pauses[0] == pytest.approx(0.3, abs=0.1)
+    assert time.monotonic() - started >= 0.3
+    assert api.stats["retries"] == 1
+    # The 429 also slowed the limiter's refill, which recovers gradually
+    assert api.rate_limiter.rate_scale < 1.0
+    assert vendor_server.counts["openai 429"] == 1